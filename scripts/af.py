@@ -2,45 +2,32 @@
 import argparse
 import csv
 import sys
-from collections import defaultdict
+
+import numpy as np
+
+from simmatrix import connected_components, split_components
 
 def load_pairs(path):
-    rows = []
-    samples = set()
+    names_a = []
+    names_b = []
+    identity = []
     with open(path) as f:
         reader = csv.DictReader(f, delimiter='\t')
         for row in reader:
-            a = row['group.a'].split(':', 1)[0]
-            b = row['group.b'].split(':', 1)[0]
-            val = float(row['estimated.identity'])
-            rows.append((a, b, val))
-            samples.add(a)
-            samples.add(b)
-    return rows, sorted(samples)
-
-def union_find(samples):
-    parent = {s: s for s in samples}
-    def find(x):
-        while parent[x] != x:
-            parent[x] = parent[parent[x]]
-            x = parent[x]
-        return x
-    def union(a, b):
-        ra, rb = find(a), find(b)
-        if ra == rb:
-            return
-        parent[rb] = ra
-    return parent, find, union
+            names_a.append(row['group.a'].split(':', 1)[0])
+            names_b.append(row['group.b'].split(':', 1)[0])
+            identity.append(float(row['estimated.identity']))
+    samples = sorted(set(names_a) | set(names_b))
+    index = {s: i for i, s in enumerate(samples)}
+    rows = np.array([index[a] for a in names_a], dtype=np.intp)
+    cols = np.array([index[b] for b in names_b], dtype=np.intp)
+    return rows, cols, np.array(identity, dtype=np.float64), samples
 
-def cluster(rows, samples, threshold):
-    parent, find, union = union_find(samples)
-    for a, b, val in rows:
-        if val >= threshold:
-            union(a, b)
-    comps = defaultdict(list)
-    for s in samples:
-        comps[find(s)].append(s)
-    ordered = sorted(comps.values(), key=lambda c: (-len(c), sorted(c)))
+def cluster(rows, cols, identity, samples, threshold):
+    linked = identity >= threshold
+    labels = connected_components(len(samples), rows[linked], cols[linked])
+    comps = [[samples[i] for i in members] for members in split_components(labels)]
+    ordered = sorted(comps, key=lambda c: (-len(c), sorted(c)))
     return ordered
 
 def build_summary(clusters):
@@ -75,8 +62,8 @@ def main():
     parser.add_argument('--details', help='Optional path to write detailed sample assignments')
     args = parser.parse_args()
 
-    rows, samples = load_pairs(args.input)
-    clusters = cluster(rows, samples, args.threshold)
+    rows, cols, identity, samples = load_pairs(args.input)
+    clusters = cluster(rows, cols, identity, samples, args.threshold)
     summary = build_summary(clusters)
 
     if args.output:
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+bench.py - Benchmarks of the pi, Fst, Tajima's D and EHH code paths
+
+Every case is a synthetic window (synth.py) with a given number of
+haplotypes, fraction of missing pairs and number of lineages. For each
+case, the stages below are timed separately:
+
+    parse   read_similarity_matrix() of the similarity table
+    group   group_indices() of all haplotypes at the grouping threshold
+    pi      pica2.analyze_similarity_matrix()
+    fst     h-fst.py calculate_fst() between even and odd samples
+    hud     hud.py calculate_fst(method='grouped') between the same populations
+    tajd    tj_d.tajimas_d_batch() over --tajd-windows windows
+    ehh     ehhgfa.scan_ihh() over --ehh-sites sites of the same haplotypes
+
+Each stage runs in a fresh process, so its peak RSS (ru_maxrss) is not
+inflated by earlier stages; the set-up (e.g. parsing the table for the pi
+stage) is not timed but does count towards the peak. The wall time is the
+best of --repeat runs.
+
+Results are appended as one JSON object per run to --history. The run is
+compared with the previous one in the history: a stage that got slower or
+larger by more than --tolerance is reported and the exit status is 1.
+
+Usage:
+    python3 bench.py [--haplotypes 50 200 1000 2000] [--missing 0 0.1] [--clusters 10 100]
+                     [--stages parse pi fst] [--history bench-history.jsonl] [--workdir DIR]
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCH_DIR)
+for path in (SCRIPTS_DIR, os.path.join(SCRIPTS_DIR, 'hudson'), os.path.join(SCRIPTS_DIR, 'wip')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import synth  # noqa: E402
+
+STAGES = ('parse', 'group', 'pi', 'fst', 'hud', 'tajd', 'ehh')
+
+THRESHOLD = 0.999
+
+# Differences below this many seconds are noise, whatever the ratio
+MIN_SLOWDOWN = 0.01
+
+
+def case_label(case):
+    return f"n{case['haplotypes']}-m{case['missing']:g}-c{case['clusters']}"
+
+
+def populations(names):
+    """Even and odd samples, as the two populations of the Fst stages."""
+    samples = sorted({name.split('#')[0] for name in names})
+    even = set(samples[::2])
+    pop_a = {name for name in names if name.split('#')[0] in even}
+    return pop_a, set(names) - pop_a
+
+
+def prepare_stage(stage, case, table):
+    """Untimed set-up of one stage; returns the function whose calls are timed."""
+    from simmatrix import read_similarity_matrix
+    if stage == 'parse':
+        return lambda: read_similarity_matrix(table)
+    if stage == 'tajd':
+        from tj_d import tajimas_d_batch
+        rng = np.random.default_rng(case['seed'])
+        S = rng.poisson(20, size=case['tajd_windows']).astype(np.float64)
+        pi = S / 3 * rng.uniform(0.5, 1.5, size=len(S))
+        return lambda: tajimas_d_batch(case['haplotypes'], S, pi)
+    if stage == 'ehh':
+        from ehhgfa import scan_ihh
+        from hapbits import PackedHaplotypes
+        haplotypes = synth.synthetic_haplotypes(case['haplotypes'], case['ehh_sites'], case['clusters'], case['seed'])
+        packed = PackedHaplotypes.from_dense(haplotypes)
+        return lambda: scan_ihh([packed], 100, 0.05, True, 1)
+
+    matrix = read_similarity_matrix(table)
+    if stage == 'group':
+        from simmatrix import group_indices
+        indices = np.arange(len(matrix))
+        return lambda: group_indices(matrix, indices, THRESHOLD)
+    if stage == 'pi':
+        from pica2 import analyze_similarity_matrix
+        return lambda: analyze_similarity_matrix(matrix, THRESHOLD, synth.WINDOW_LENGTH)
+    pop_a, pop_b = populations(matrix.ids)
+    if stage == 'fst':
+        hfst = importlib.import_module('h-fst')
+        return lambda: hfst.calculate_fst(matrix, pop_a, pop_b, synth.WINDOW_LENGTH)
+    if stage == 'hud':
+        import hud
+        return lambda: hud.calculate_fst(matrix, pop_a, pop_b, synth.WINDOW_LENGTH, method='grouped', threshold=THRESHOLD)
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def run_stage(stage, case, table, repeat):
+    """Time one stage in this (fresh) process; returns seconds and peak RSS."""
+    run = prepare_stage(stage, case, table)
+    setup_rss = peak_rss_mb()
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return {'seconds': round(best, 6), 'peak_rss_mb': round(peak_rss_mb(), 1), 'setup_rss_mb': round(setup_rss, 1)}
+
+
+def in_fresh_process(function, *args):
+    """function(*args) in a new interpreter.
+
+    The parent never holds a table or a matrix: Linux carries the peak RSS
+    of a process over fork and exec, so a large parent would raise the
+    ru_maxrss of every later child.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', '-C', SCRIPTS_DIR, 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    runs = []
+    if os.path.exists(path):
+        with open(path) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    return runs
+
+
+def regressions(results, previous, tolerance):
+    """(case, stage, metric, before, after) for every result worse than the previous run by more than tolerance."""
+    before = {(r['case'], r['stage']): r for r in previous.get('results', [])}
+    found = []
+    for result in results:
+        old = before.get((result['case'], result['stage']))
+        if old is None:
+            continue
+        if result['seconds'] > old['seconds'] * tolerance and result['seconds'] - old['seconds'] > MIN_SLOWDOWN:
+            found.append((result['case'], result['stage'], 'seconds', old['seconds'], result['seconds']))
+        if result['peak_rss_mb'] > old['peak_rss_mb'] * tolerance:
+            found.append((result['case'], result['stage'], 'peak_rss_mb', old['peak_rss_mb'], result['peak_rss_mb']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the pi, Fst, Tajima\'s D and EHH paths on synthetic windows')
+    parser.add_argument('--haplotypes', type=int, nargs='+', default=[50, 200, 1000, 2000],
+                        help='haplotype counts (default: 50 200 1000 2000)')
+    parser.add_argument('--missing', type=float, nargs='+', default=[0.0, 0.1],
+                        help='fractions of missing pairs (default: 0 0.1)')
+    parser.add_argument('--clusters', type=int, nargs='+', default=[10],
+                        help='numbers of lineages (default: 10)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='stages to time (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the best is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the synthetic data (default: 1)')
+    parser.add_argument('--tajd-windows', type=int, default=100000,
+                        help='windows scored by the tajd stage (default: 100000)')
+    parser.add_argument('--ehh-sites', type=int, default=2000, help='sites scanned by the ehh stage (default: 2000)')
+    parser.add_argument('--workdir', help='keep the synthetic tables in this directory and reuse them '
+                                          '(default: a temporary directory)')
+    parser.add_argument('--history', default='bench-history.jsonl',
+                        help='JSON-lines history the run is appended to (default: bench-history.jsonl)')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='report stages slower or larger than the previous run by this factor (default: 1.25)')
+    parser.add_argument('--no-history', action='store_true', help='do not append this run to the history')
+    args = parser.parse_args()
+
+    if min(args.haplotypes) < 4 or min(args.clusters) < 1 or not all(0 <= m < 1 for m in args.missing) \
+            or args.repeat < 1:
+        print("Error: Need --haplotypes >= 4, --clusters >= 1, 0 <= --missing < 1 and --repeat >= 1", file=sys.stderr)
+        sys.exit(1)
+
+    tmp = None
+    workdir = args.workdir
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix='impop-bench.')
+        workdir = tmp.name
+
+    results = []
+    print("CASE\tSTAGE\tSECONDS\tPEAK_RSS_MB")
+    try:
+        for n in args.haplotypes:
+            for missing in args.missing:
+                for clusters in args.clusters:
+                    case = {'haplotypes': n, 'missing': missing, 'clusters': clusters, 'seed': args.seed,
+                            'tajd_windows': args.tajd_windows, 'ehh_sites': args.ehh_sites}
+                    label = case_label(case)
+                    table = os.path.join(workdir, f"{label}-s{args.seed}.sim")
+                    if not os.path.exists(table):
+                        in_fresh_process(synth.write_similarity_table, table, n, missing, clusters, args.seed)
+                    for stage in args.stages:
+                        timing = in_fresh_process(run_stage, stage, case, table, args.repeat)
+                        results.append({'case': label, 'stage': stage, **case, **timing})
+                        print(f"{label}\t{stage}\t{timing['seconds']:.6f}\t{timing['peak_rss_mb']:.1f}", flush=True)
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+    run = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    history = read_history(args.history)
+    found = regressions(results, history[-1], args.tolerance) if history else []
+    if not args.no_history:
+        with open(args.history, 'a') as f:
+            print(json.dumps(run), file=f)
+
+    for label, stage, metric, old, new in found:
+        print(f"Warning: {label} {stage}: {metric} {old} -> {new} (x{new / old:.2f})", file=sys.stderr)
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+checks.py - Regression checks of edge cases on small hand-made windows
+
+Each check builds a tiny similarity table in memory and compares the
+results of two code paths that must agree (dense and sparse matrices,
+point estimates and their resampled counterparts). Run after changing
+simmatrix.py, h-fst.py or resample.py:
+
+    python3 checks.py
+
+Prints one line per check and exits with status 1 when any fails.
+"""
+
+import importlib
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCH_DIR)
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from resample import bootstrap_fst, permutation_fst  # noqa: E402
+from simmatrix import SparseSimilarityMatrix, read_similarity_matrix  # noqa: E402
+from synth import write_similarity_table  # noqa: E402
+
+hfst = importlib.import_module('h-fst')
+
+
+def table(pairs):
+    """Similarity table text of (name_a, name_b, identity) rows."""
+    lines = ['group.a\tgroup.b\testimated.identity']
+    lines += [f"{a}\t{b}\t{identity}" for a, b, identity in pairs]
+    return io.StringIO('\n'.join(lines) + '\n')
+
+
+def check_panel_without_pairs():
+    """Panel Fst of a window where no two kept sequences have a reported pair."""
+    rows = [('s1#1#c:1-10', 's1#1#c:1-10', 1.0), ('s2#1#c:1-10', 's2#1#c:1-10', 1.0)]
+    populations = {'A': {'s1#1#c:1-10'}, 'B': {'s2#1#c:1-10'}}
+    dense = hfst.calculate_panel_fst(read_similarity_matrix(table(rows)), populations)
+    sparse_matrix = read_similarity_matrix(table(rows), sparse=True)
+    assert isinstance(sparse_matrix, SparseSimilarityMatrix)
+    sparse = hfst.calculate_panel_fst(sparse_matrix, populations)
+    assert dense == sparse, (dense, sparse)
+
+
+def check_panel_all_shared():
+    """Panel Fst when every sequence is in both populations (all labels dropped)."""
+    rows = [('s1#1#c:1-10', 's2#1#c:1-10', 0.99)]
+    populations = {'A': {'s1#1#c:1-10', 's2#1#c:1-10'}, 'B': {'s1#1#c:1-10', 's2#1#c:1-10'}}
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        dense = hfst.calculate_panel_fst(read_similarity_matrix(table(rows)), populations)
+        sparse = hfst.calculate_panel_fst(read_similarity_matrix(table(rows), sparse=True), populations)
+    finally:
+        sys.stderr = stderr
+    assert dense == sparse, (dense, sparse)
+
+
+def overlapping_populations(path):
+    """Matrix of a synthetic window and two populations sharing a third of their sequences."""
+    write_similarity_table(path, 100, missing=0.1, clusters=5, seed=3)
+    matrix = read_similarity_matrix(path)
+    return matrix, np.arange(60), np.arange(40, 100)
+
+
+def check_permutation_overlap(path):
+    """The observed Fst of the permutation test is the Fst of calculate_fst() when A and B overlap."""
+    matrix, idx_a, idx_b = overlapping_populations(path)
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        expected = hfst.calculate_fst(matrix, set(matrix.names(idx_a)), set(matrix.names(idx_b)))['fst']
+    finally:
+        sys.stderr = stderr
+    observed, _ = permutation_fst(matrix, idx_a, idx_b, 10, 1)
+    assert abs(observed - expected) < 1e-12, (observed, expected)
+
+
+def check_bootstrap_overlap(path):
+    """Bootstrap Fst of overlapping A and B resamples A and B without the shared sequences, like calculate_fst()."""
+    matrix, idx_a, idx_b = overlapping_populations(path)
+    replicates = bootstrap_fst(matrix, idx_a, idx_b, 20, 1)
+    expected = bootstrap_fst(matrix, np.arange(40), np.arange(60, 100), 20, 1)
+    assert np.array_equal(replicates, expected), (replicates[:3], expected[:3])
+
+
+CHECKS = [check_panel_without_pairs, check_panel_all_shared, check_permutation_overlap, check_bootstrap_overlap]
+
+
+def main():
+    failed = 0
+    scratch = tempfile.TemporaryDirectory(prefix='impop-checks.')
+    for check in CHECKS:
+        try:
+            if check.__code__.co_argcount:
+                check(os.path.join(scratch.name, f"{check.__name__}.sim"))
+            else:
+                check()
+            print(f"ok\t{check.__name__}")
+        except Exception as e:  # noqa: BLE001 - report every failing check
+            failed += 1
+            print(f"FAIL\t{check.__name__}\t{e!r}")
+    scratch.cleanup()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
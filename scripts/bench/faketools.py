@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+faketools.py - Stand-ins for impg, odgi and povu serving precomputed windows
+
+The run_*.sh wrappers and scan.py call `impg similarity`, `impg query`,
+`odgi` and `povu` once per window. The executables in bench/fakebin/
+answer those calls from a data directory instead of the PAF and AGC
+files, so the scheduling, caching and streaming of a BED run can be
+timed and regression-tested on a laptop:
+
+    python3 faketools.py regions.bed fake-data -n 200 --missing 0.05
+    PATH=$PWD/fakebin:$PATH IMPOP_FAKE_DATA=$PWD/fake-data ../run_pica2_impg.sh -b regions.bed ...
+
+The data directory holds, for every region of the BED file, REGION.sim
+(an impg similarity table) and REGION.gfa (a bubble graph of the same
+haplotypes), REGION being the impg region with every character other
+than letters, digits, '.', '-' and '_' replaced by '_'. Regions with
+no files fall back to default.sim and default.gfa when present; any
+other file can be dropped in by hand. The stand-ins understand:
+
+    impg similarity -r REGION [--subset-sequence-list FILE]   REGION.sim, restricted to the list
+    impg query -r REGION -o gfa                                REGION.gfa
+    odgi build -g IN -o OUT / odgi sort -i IN -o - / odgi view -i - -g
+                                                               pass the GFA through
+    odgi similarity -i GFA                                     .sim of the region named in the GFA header
+    povu gfa2vcf -i GFA --stdout REF                           one VCF record per variant site (gfa_sites.py)
+
+Environment:
+    IMPOP_FAKE_DATA      data directory (required)
+    IMPOP_FAKE_LATENCY   seconds added to every call, or per tool: 'impg=0.5,odgi=0.05,povu=0.1'
+    IMPOP_FAKE_FAIL      regular expression; impg exits with status 1 for matching regions
+"""
+
+import argparse
+import importlib
+import os
+import re
+import shutil
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCH_DIR)
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+import synth  # noqa: E402
+
+
+def region_file(region, suffix):
+    return re.sub(r'[^\w.-]', '_', region) + suffix
+
+
+def latency(tool):
+    """Seconds of delay for tool from IMPOP_FAKE_LATENCY."""
+    spec = os.environ.get('IMPOP_FAKE_LATENCY', '').strip()
+    if not spec:
+        return 0.0
+    if '=' not in spec:
+        return float(spec)
+    for item in spec.split(','):
+        name, _, seconds = item.partition('=')
+        if name.strip() == tool:
+            return float(seconds)
+    return 0.0
+
+
+def fail(tool, message):
+    print(f"{tool} (fake): {message}", file=sys.stderr)
+    sys.exit(1)
+
+
+def option(argv, *names, default=None):
+    for name in names:
+        if name in argv and argv.index(name) + 1 < len(argv):
+            return argv[argv.index(name) + 1]
+    return default
+
+
+def data_path(region, suffix, tool):
+    """File serving region, or the default file of that kind."""
+    data = os.environ.get('IMPOP_FAKE_DATA')
+    if not data:
+        fail(tool, "IMPOP_FAKE_DATA is not set")
+    for name in (region_file(region, suffix), f"default{suffix}"):
+        path = os.path.join(data, name)
+        if os.path.exists(path):
+            return path
+    fail(tool, f"no {suffix} file for region {region} in {data}")
+
+
+def copy_to_stdout(path):
+    with open(path) as f:
+        shutil.copyfileobj(f, sys.stdout)
+
+
+def serve_similarity(path, subset):
+    """Copy a similarity table to stdout, keeping pairs whose names both match the subset list."""
+    if subset is None:
+        copy_to_stdout(path)
+        return
+    hfst = importlib.import_module('h-fst')
+    with open(subset) as f:
+        prefixes = tuple(filter(None, (hfst.canonicalize_identifier(line) for line in f)))
+    with open(path) as f:
+        sys.stdout.write(f.readline())
+        for line in f:
+            a, b = line.split('\t', 2)[:2]
+            if a.startswith(prefixes) and b.startswith(prefixes):
+                sys.stdout.write(line)
+
+
+def impg(argv):
+    region = option(argv, '-r', '--region')
+    if not argv or argv[0] not in ('similarity', 'query') or region is None:
+        fail('impg', "only 'similarity -r REGION' and 'query -r REGION -o gfa' are supported")
+    pattern = os.environ.get('IMPOP_FAKE_FAIL')
+    if pattern and re.search(pattern, region):
+        fail('impg', f"failing region {region} on request (IMPOP_FAKE_FAIL)")
+    if argv[0] == 'similarity':
+        serve_similarity(data_path(region, '.sim', 'impg'), option(argv, '--subset-sequence-list'))
+    elif option(argv, '-o', '--output-format') == 'gfa':
+        copy_to_stdout(data_path(region, '.gfa', 'impg'))
+    else:
+        fail('impg', "query is only supported with -o gfa")
+
+
+def gfa_region(path):
+    """Region recorded in the RG:Z: tag of a GFA header written by synth.write_gfa()."""
+    with open(path) as f:
+        for line in f:
+            if line.startswith('H\t'):
+                for tag in line.rstrip('\n').split('\t')[1:]:
+                    if tag.startswith('RG:Z:'):
+                        return tag[5:]
+            elif not line.startswith('#'):
+                break
+    return None
+
+
+def odgi(argv):
+    command = argv[0] if argv else None
+    source = option(argv, '-i', '-g', '--idx', '--gfa')
+    if command == 'build':
+        shutil.copyfile(option(argv, '-g', '--gfa'), option(argv, '-o', '--out'))
+    elif command in ('sort', 'view'):
+        if source == '-':
+            shutil.copyfileobj(sys.stdin, sys.stdout)
+        else:
+            copy_to_stdout(source)
+    elif command == 'similarity':
+        region = gfa_region(source)
+        if region is None:
+            fail('odgi', f"no RG:Z: region tag in the header of {source}")
+        copy_to_stdout(data_path(region, '.sim', 'odgi'))
+    else:
+        fail('odgi', "only build, sort, view and similarity are supported")
+
+
+def povu(argv):
+    from gfa_sites import count_variant_sites, read_gfa_paths
+    if not argv or argv[0] != 'gfa2vcf' or '--stdout' not in argv:
+        fail('povu', "only 'gfa2vcf -i GFA --stdout REF' is supported")
+    source = option(argv, '-i')
+    reference = argv[argv.index('--stdout') + 1] if argv.index('--stdout') + 1 < len(argv) else 'CHM13'
+    with open(source) as f:
+        try:
+            sites = count_variant_sites(read_gfa_paths(f), reference)
+        except ValueError as e:
+            fail('povu', str(e))
+    print("##fileformat=VCFv4.2")
+    print("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO")
+    for site in range(sites):
+        print(f"{reference}\t{site + 1}\t.\tA\tC\t.\tPASS\t.")
+
+
+TOOLS = {'impg': impg, 'odgi': odgi, 'povu': povu}
+
+
+def run_tool(tool, argv):
+    """Entry point of the fakebin executables."""
+    delay = latency(tool)
+    if delay > 0:
+        time.sleep(delay)
+    TOOLS[tool](argv)
+
+
+def write_region_data(bed, directory, n, missing, clusters, sites, seed, prefix):
+    """Write REGION.sim and REGION.gfa for every window of a BED file; returns the number of windows."""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    with open(bed) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or line.startswith(('#', 'track', 'browser')) \
+                    or not (fields[1].isdigit() and fields[2].isdigit()):
+                continue
+            chrom, start, end = fields[:3]
+            region = f"{chrom}:{start}-{end}" if chrom.startswith(prefix) else f"{prefix}{chrom}:{start}-{end}"
+            window_seed = seed + count
+            names = synth.write_similarity_table(os.path.join(directory, region_file(region, '.sim')),
+                                                 n, missing, clusters, window_seed)
+            haplotypes = synth.synthetic_haplotypes(n, sites, clusters, window_seed)
+            synth.write_gfa(os.path.join(directory, region_file(region, '.gfa')), names, haplotypes,
+                            region, window_seed)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the data served by the fake impg/odgi/povu for a BED file')
+    parser.add_argument('bed', help='BED file of the windows')
+    parser.add_argument('directory', help='data directory (IMPOP_FAKE_DATA)')
+    parser.add_argument('-n', '--haplotypes', type=int, default=200, help='haplotypes per window (default: 200)')
+    parser.add_argument('--missing', type=float, default=0.0, help='fraction of missing pairs (default: 0)')
+    parser.add_argument('--clusters', type=int, default=10, help='number of lineages (default: 10)')
+    parser.add_argument('--sites', type=int, default=100, help='bubbles per window GFA (default: 100)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the first window (default: 1)')
+    parser.add_argument('-P', '--prefix', default='CHM13#0#', help='region prefix, as in scan.py (default: CHM13#0#)')
+    args = parser.parse_args()
+
+    if args.haplotypes < 2 or args.clusters < 1 or args.sites < 1 or not 0 <= args.missing < 1:
+        print("Error: Need -n >= 2, --clusters >= 1, --sites >= 1 and 0 <= --missing < 1", file=sys.stderr)
+        sys.exit(1)
+    try:
+        count = write_region_data(args.bed, args.directory, args.haplotypes, args.missing, args.clusters,
+                                  args.sites, args.seed, args.prefix)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Wrote {count} windows to {args.directory}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
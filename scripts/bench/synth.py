@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+synth.py - Synthetic impg similarity tables and haplotype matrices for benchmarks
+
+Tables have the nine columns of `impg similarity` and HPRC-style names
+(HG01234#1#CM094061.1:start-end); every unordered pair is reported once,
+self pairs included. Haplotypes are drawn into `clusters` lineages of
+uneven (Zipf-like) size: pairs within a lineage are nearly identical, a
+fraction of them exactly, so grouping at 0.999 finds realistic groups;
+pairs across lineages differ by a lineage-specific distance. A `missing`
+fraction of the off-diagonal pairs is dropped, as impg does for pairs
+with no alignment. Everything is drawn from one seed and is reproducible.
+
+Haplotype matrices (lineage founders plus private mutations) feed the EHH
+benchmark and write_gfa(), which turns them into a bubble graph for the
+`impg query -o gfa` stand-in of faketools.py.
+
+Usage:
+    python3 synth.py out.sim -n 1000 --missing 0.05 --clusters 20 [--seed 1]
+"""
+
+import argparse
+import gzip
+import sys
+
+import numpy as np
+
+HEADER = ('group.a', 'group.b', 'group.a.length', 'group.b.length', 'intersection',
+          'jaccard.similarity', 'cosine.similarity', 'dice.similarity', 'estimated.identity')
+
+# Window of the synthetic region on the reference
+WINDOW_START = 109468899
+WINDOW_LENGTH = 200
+
+
+def haplotype_names(n, seed=1):
+    """n HPRC-style sequence names: two haplotypes per sample, one contig per haplotype."""
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(n):
+        sample = f"{'NA' if i // 2 % 3 == 0 else 'HG'}{i // 2 + 100:05d}"
+        start = WINDOW_START + int(rng.integers(-2000, 2000))
+        names.append(f"{sample}#{i % 2 + 1}#CM{94061 + i:06d}.1:{start}-{start + WINDOW_LENGTH}")
+    return names
+
+
+def cluster_labels(n, clusters, rng):
+    """Lineage of every haplotype; lineage k is drawn with probability proportional to 1 / (k + 1)."""
+    weights = 1.0 / np.arange(1, clusters + 1)
+    return rng.choice(clusters, size=n, p=weights / weights.sum())
+
+
+def identities(n, missing, clusters, seed=1):
+    """(rows, cols, identity) of the reported pairs, upper triangle with the diagonal."""
+    rng = np.random.default_rng(seed)
+    labels = cluster_labels(n, clusters, rng)
+    between = rng.uniform(0.002, 0.02, size=(clusters, clusters))
+    between = np.triu(between, 1) + np.triu(between, 1).T
+
+    rows, cols = np.triu_indices(n)
+    base = between[labels[rows], labels[cols]]
+    noise = rng.exponential(4e-4, size=len(rows))
+    # Half of the pairs within a lineage are identical over the window
+    noise[(base == 0) & (rng.random(len(rows)) < 0.5)] = 0
+    distance = np.clip(base + noise, 0, 1)
+    distance[rows == cols] = 0
+
+    keep = (rows == cols) | (rng.random(len(rows)) >= missing)
+    return rows[keep], cols[keep], np.round(1 - distance[keep], 5)
+
+
+def write_similarity_table(path, n, missing=0.0, clusters=10, seed=1):
+    """Write a synthetic similarity table (gzip if path ends with .gz); returns the sequence names."""
+    names = haplotype_names(n, seed)
+    rows, cols, identity = identities(n, missing, clusters, seed)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as out:
+        out.write('\t'.join(HEADER) + '\n')
+        for start in range(0, len(rows), 100000):
+            chunk = slice(start, start + 100000)
+            lines = []
+            for i, j, value in zip(rows[chunk].tolist(), cols[chunk].tolist(), identity[chunk].tolist()):
+                shared = int(WINDOW_LENGTH * value)
+                jaccard = shared / (2 * WINDOW_LENGTH - shared)
+                lines.append(f"{names[i]}\t{names[j]}\t{WINDOW_LENGTH}\t{WINDOW_LENGTH}\t{shared}\t"
+                             f"{jaccard:.6g}\t{value:.6g}\t{value:.6g}\t{value}\n")
+            out.write(''.join(lines))
+    return names
+
+
+def synthetic_haplotypes(n, sites, clusters=10, seed=1):
+    """(n, sites) uint8 0/1 haplotypes: lineage founders copied with 1% private mutations."""
+    rng = np.random.default_rng(seed)
+    labels = cluster_labels(n, clusters, rng)
+    frequency = rng.beta(0.3, 0.3, size=sites)
+    founders = (rng.random((clusters, sites)) < frequency).astype(np.uint8)
+    mutations = (rng.random((n, sites)) < 0.01).astype(np.uint8)
+    return founders[labels] ^ mutations
+
+
+def write_gfa(path, names, haplotypes, reference, seed=1):
+    """Write a GFA of biallelic bubbles: one per column of haplotypes, between shared segments.
+
+    The reference path (named reference) takes allele 0 everywhere; path
+    names[i] takes the alleles of haplotypes[i]. Every column with an
+    allele 1 is one variant site for gfa_sites.py.
+    """
+    rng = np.random.default_rng(seed)
+    n_sites = haplotypes.shape[1]
+    bases = np.array(list('ACGT'))
+    with open(path, 'w') as out:
+        out.write(f"H\tVN:Z:1.0\tRG:Z:{reference}\n")
+        # Node 3k + 1 is the segment before site k, 3k + 2 and 3k + 3 its two alleles
+        for k in range(n_sites + 1):
+            out.write(f"S\t{3 * k + 1}\t{''.join(rng.choice(bases, size=20))}\n")
+            if k < n_sites:
+                ref, alt = rng.choice(4, size=2, replace=False)
+                out.write(f"S\t{3 * k + 2}\t{bases[ref]}\nS\t{3 * k + 3}\t{bases[alt]}\n")
+                for allele in (2, 3):
+                    out.write(f"L\t{3 * k + 1}\t+\t{3 * k + allele}\t+\t0M\n"
+                              f"L\t{3 * k + allele}\t+\t{3 * k + 4}\t+\t0M\n")
+        for name, alleles in [(reference, np.zeros(n_sites, dtype=np.uint8))] + list(zip(names, haplotypes)):
+            steps = [f"{3 * k + 1}+,{3 * k + 2 + int(a)}+" for k, a in enumerate(alleles.tolist())]
+            steps.append(f"{3 * n_sites + 1}+")
+            out.write(f"P\t{name}\t{','.join(steps)}\t*\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic impg similarity table with HPRC-style names')
+    parser.add_argument('output', help='output table (.gz for gzip)')
+    parser.add_argument('-n', '--haplotypes', type=int, default=200, help='number of haplotypes (default: 200)')
+    parser.add_argument('--missing', type=float, default=0.0,
+                        help='fraction of pairs left out of the table (default: 0)')
+    parser.add_argument('--clusters', type=int, default=10, help='number of lineages (default: 10)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    args = parser.parse_args()
+
+    if args.haplotypes < 2 or args.clusters < 1 or not 0 <= args.missing < 1:
+        print("Error: Need -n >= 2, --clusters >= 1 and 0 <= --missing < 1", file=sys.stderr)
+        sys.exit(1)
+    write_similarity_table(args.output, args.haplotypes, args.missing, args.clusters, args.seed)
+
+
+if __name__ == "__main__":
+    main()
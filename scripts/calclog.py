@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+calclog.py - Levelled logs for the pi and Fst calculations
+
+pica2.py, h-fst.py and hud.py explain every step of a calculation in a
+text log. The group listings and group-pair terms are O(g) and O(g²)
+lines, so they are logged at the DETAIL level. Their loops check
+log.enabled(DETAIL) first. Messages are %-format strings with separate
+arguments, and they are only formatted when the line is actually
+written. A disabled log therefore costs one comparison per call.
+
+A CalcLog can also collect structured values (record()) for the
+consolidated JSON-lines log of `scan.py --log-jsonl`.
+"""
+
+DETAIL = 10
+INFO = 20
+WARNING = 30
+
+LEVELS = {'detail': DETAIL, 'info': INFO, 'warning': WARNING}
+
+
+class CalcLog:
+    """Text log written to handle at or above level, plus optional structured fields."""
+
+    def __init__(self, handle=None, level=DETAIL, fields=None):
+        self.handle = handle
+        self.level = level
+        self.fields = fields
+
+    def enabled(self, level):
+        return self.handle is not None and level >= self.level
+
+    def write(self, level, message, *args):
+        if self.handle is not None and level >= self.level:
+            print(message % args if args else message, file=self.handle)
+
+    def detail(self, message, *args):
+        self.write(DETAIL, message, *args)
+
+    def info(self, message, *args):
+        self.write(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.write(WARNING, message, *args)
+
+    def record(self, **values):
+        """Store structured values for the machine-readable log (no-op without fields)."""
+        if self.fields is not None:
+            self.fields.update(values)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+def as_log(log):
+    """Accept a CalcLog, an open text file (logged at DETAIL, as before) or None."""
+    if isinstance(log, CalcLog):
+        return log
+    return CalcLog(log)
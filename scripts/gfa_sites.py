@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+gfa_sites.py - Count variant sites in the pangenome graph of a window
+
+Tajima's D needs S, the number of segregating sites of a window. It used
+to come from `impg query -o gfa | odgi build | odgi sort | odgi view |
+povu gfa2vcf`, counting VCF records. This module reads the GFA from
+`impg query` directly and keeps only the path lines (P, and W walks); the
+segment sequences are never stored.
+
+Every non-reference path is walked against the reference path. Nodes
+visited exactly once by the reference are anchors. Between two
+consecutive anchors, the path either follows the reference steps or it
+takes another route (SNP, insertion, deletion or more complex bubble).
+A variant site is a pair of anchors where at least one path leaves the
+reference; it is counted once whatever the number of alleles.
+
+Usage:
+    python3 gfa_sites.py window.gfa [-R CHM13]
+"""
+
+import argparse
+import sys
+from collections import Counter
+
+import numpy as np
+
+
+def _flip(step):
+    return step[:-1] + ('-' if step[-1] == '+' else '+')
+
+
+def read_gfa_paths(lines):
+    """Yield (name, steps) for every P and W line; steps are 'id+' / 'id-' strings."""
+    for line in lines:
+        if line.startswith('P\t'):
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3:
+                continue
+            yield fields[1], fields[2].split(',') if fields[2] and fields[2] != '*' else []
+        elif line.startswith('W\t'):
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 7:
+                continue
+            name = f"{fields[1]}#{fields[2]}#{fields[3]}"
+            walk = fields[6].replace('>', ',>').replace('<', ',<').split(',')[1:]
+            yield name, [step[1:] + ('+' if step[0] == '>' else '-') for step in walk]
+
+
+def _reference_sites(reference, path, sites, ref_id):
+    """Add the (ref_id, left anchor, right anchor) pairs where path leaves the reference."""
+    forward, reverse, ref_steps = reference
+    index = np.fromiter((forward.get(step, -1) for step in path), dtype=np.int64, count=len(path))
+    same = int((index >= 0).sum())
+    if 2 * same < len(path):
+        # Paths aligned to the reverse strand traverse the anchors flipped and backwards
+        flipped = np.fromiter((reverse.get(step, -1) for step in reversed(path)), dtype=np.int64, count=len(path))
+        if (flipped >= 0).sum() > same:
+            path = [_flip(step) for step in reversed(path)]
+            index = flipped
+
+    # Consecutive anchor visits; only those that are not adjacent on both the path and the reference need a look
+    at = np.flatnonzero(index >= 0)
+    anchors = index[at]
+    candidates = np.flatnonzero((anchors[1:] > anchors[:-1]) &
+                                ((at[1:] != at[:-1] + 1) | (anchors[1:] != anchors[:-1] + 1)))
+    for j in candidates.tolist():
+        left, right = int(anchors[j]), int(anchors[j + 1])
+        if path[at[j] + 1:at[j + 1]] != ref_steps[left + 1:right]:
+            sites.add((ref_id, left, right))
+
+
+def count_variant_sites(paths, reference):
+    """Number of variant sites over all paths, relative to the paths whose name starts with reference.
+
+    paths is an iterable of (name, steps), e.g. read_gfa_paths(); raises
+    ValueError when no path belongs to the reference.
+    """
+    references = []
+    others = []
+    for name, steps in paths:
+        if name.startswith(reference):
+            visits = Counter(step[:-1] for step in steps)
+            forward = {step: i for i, step in enumerate(steps) if visits[step[:-1]] == 1}
+            reverse = {_flip(step): i for step, i in forward.items()}
+            references.append((forward, reverse, steps))
+        else:
+            others.append(steps)
+    if not references:
+        raise ValueError(f"No path of reference '{reference}' in the graph")
+
+    sites = set()
+    for ref_id, ref in enumerate(references):
+        for steps in others:
+            _reference_sites(ref, steps, sites, ref_id)
+    return len(sites)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count variant sites in a GFA relative to a reference path')
+    parser.add_argument('gfa', help="GFA file, e.g. from 'impg query -o gfa' ('-' for stdin)")
+    parser.add_argument('-R', '--reference', default='CHM13',
+                        help='Prefix of the reference path names (default: CHM13)')
+    args = parser.parse_args()
+
+    try:
+        handle = sys.stdin if args.gfa == '-' else open(args.gfa)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        print(count_variant_sites(read_gfa_paths(handle), args.reference))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+if __name__ == "__main__":
+    main()
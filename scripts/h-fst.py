@@ -7,12 +7,21 @@ FST = (Dxy - πxy) / Dxy
 Where:
 - Dxy = average pairwise diversity between populations
 - πxy = average of within-population diversities
+
+With --panel / --population, every population pair of a K-population panel
+is evaluated from the same similarity matrix: within-population π and the
+K×K Dxy/Fst matrix come from one block-wise reduction.
 """
 
 import sys
 import argparse
 import os
-import csv
+
+import numpy as np
+
+from calclog import INFO, LEVELS, CalcLog, as_log
+from simmatrix import read_similarity_matrix, diversity, block_sums
+from resample import permutation_fst, permutation_p_value
 
 
 def canonicalize_identifier(identifier: str) -> str:
@@ -61,10 +70,57 @@ def canonicalize_identifier(identifier: str) -> str:
     return f"{token}#"
 
 
-def expand_population(raw_ids, all_sequences):
-    """Expand population identifiers into the concrete sequence names."""
+def sequence_key(name):
+    """Split an impg sequence name into its (sample, haplotype) key.
+
+    'HG00097#1#CM094061.1:109468899-109469099' -> ('HG00097', '1');
+    a name with a single '#' gives (sample, None), one without '#' None.
+    """
+    fields = name.split('#', 2)
+    if len(fields) < 2:
+        return None
+    if len(fields) == 2:
+        return (fields[0], None)
+    return (fields[0], fields[1])
+
 
-    expanded = set()
+class SequenceIndex:
+    """Hash index from (sample, haplotype) keys to sequence positions.
+
+    Sequence names are parsed once; a canonicalize_identifier() prefix
+    ('HG00097#' or 'HG00097#1#') then resolves by dict lookup instead of a
+    str.startswith() scan over every sequence.
+    """
+
+    def __init__(self, sequences, keys=None):
+        self.sequences = list(sequences)
+        self.keys = keys if keys is not None else [sequence_key(name) for name in self.sequences]
+        self.by_sample = {}
+        self.by_haplotype = {}
+        for pos, key in enumerate(self.keys):
+            if key is None:
+                continue
+            self.by_sample.setdefault(key[0], []).append(pos)
+            if key[1] is not None:
+                self.by_haplotype.setdefault(key, []).append(pos)
+
+    def lookup(self, prefix):
+        """Positions of the sequences whose name starts with prefix."""
+        fields = prefix.split('#')
+        if len(fields) == 2 and not fields[1]:
+            return self.by_sample.get(fields[0], [])
+        if len(fields) == 3 and not fields[2]:
+            return self.by_haplotype.get((fields[0], fields[1]), [])
+        # Longer prefixes (e.g. including a contig) are rare; scan for them
+        return [pos for pos, name in enumerate(self.sequences) if name.startswith(prefix)]
+
+
+def resolve_population(raw_ids, index):
+    """Resolve population identifiers to sorted sequence positions in index.
+
+    Returns (positions, missing identifiers).
+    """
+    positions = set()
     missing = []
 
     for raw_id in raw_ids:
@@ -72,51 +128,57 @@ def expand_population(raw_ids, all_sequences):
         if not prefix:
             continue
 
-        matches = {seq for seq in all_sequences if seq.startswith(prefix)}
+        matches = index.lookup(prefix)
 
         if matches:
-            expanded.update(matches)
+            positions.update(matches)
         else:
             missing.append(raw_id)
 
-    return expanded, missing
+    return sorted(positions), missing
+
+
+def expand_population(raw_ids, all_sequences):
+    """Expand population identifiers into the concrete sequence names."""
+    index = SequenceIndex(all_sequences)
+    positions, missing = resolve_population(raw_ids, index)
+    return {index.sequences[pos] for pos in positions}, missing
 
-def read_similarity_file(filename):
-    """Read similarity data from TSV file"""
+
+class PopulationResolver:
+    """Resolve named populations against successive windows' sequence names.
+
+    Sequence names carry window coordinates, but the haplotypes behind them
+    rarely change between windows. The resolved population -> position
+    mapping is therefore cached for the last (sample, haplotype) layout and
+    reused as long as a window lists the same haplotypes in the same order.
+    """
+
+    def __init__(self, populations):
+        self.populations = {name: list(raw_ids) for name, raw_ids in populations.items()}
+        self._layout = None
+        self._resolved = None
+
+    def resolve(self, sequences):
+        """Return {population: (positions, missing identifiers)} for a window."""
+        keys = [sequence_key(name) for name in sequences]
+        if keys != self._layout:
+            index = SequenceIndex(sequences, keys)
+            self._resolved = {name: resolve_population(raw_ids, index)
+                              for name, raw_ids in self.populations.items()}
+            self._layout = keys
+        return self._resolved
+
+def read_similarity_file(filename, round_digits=None):
+    """Read similarity data from TSV file into a SimilarityMatrix"""
     try:
-        with open(filename, newline='') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            
-            if not reader.fieldnames:
-                print(f"Error: Empty file {filename}", file=sys.stderr)
-                sys.exit(1)
-                
-            required = {'group.a', 'group.b', 'estimated.identity'}
-            if not required.issubset(set(reader.fieldnames)):
-                print(f"Error: File must contain columns: {required}", file=sys.stderr)
-                print(f"Found: {reader.fieldnames}", file=sys.stderr)
-                sys.exit(1)
-            
-            similarities = {}
-            all_sequences = set()
-            
-            for row in reader:
-                seq1, seq2 = row['group.a'], row['group.b']
-                try:
-                    sim = float(row['estimated.identity'])
-                except ValueError:
-                    print(f"Warning: Invalid similarity value: {row['estimated.identity']}", file=sys.stderr)
-                    continue
-                
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                similarities[key] = sim
-                all_sequences.update([seq1, seq2])
-            
-            return similarities, all_sequences
-            
+        return read_similarity_matrix(filename, round_digits=round_digits, skip_invalid=True)
     except FileNotFoundError:
         print(f"Error: File not found: {filename}", file=sys.stderr)
         sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
 def read_subset_file(filename):
     """Read sequence IDs from a file"""
@@ -127,55 +189,52 @@ def read_subset_file(filename):
         print(f"Error: Subset file not found: {filename}", file=sys.stderr)
         sys.exit(1)
 
-def calculate_diversity(similarities, seq_set1, seq_set2=None, round_digits=None):
+def read_panel_file(filename):
+    """Read a sample -> population table (identifier and population per line).
+
+    Returns a dict population -> list of identifiers, in order of first appearance.
+    """
+    panel = {}
+    try:
+        with open(filename) as f:
+            for line_number, line in enumerate(f, start=1):
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                if len(fields) < 2:
+                    print(f"Warning: Missing population at line {line_number} of {filename}, skipping",
+                          file=sys.stderr)
+                    continue
+                panel.setdefault(fields[1], []).append(fields[0])
+    except FileNotFoundError:
+        print(f"Error: Panel file not found: {filename}", file=sys.stderr)
+        sys.exit(1)
+    return panel
+
+def read_population_lists(specs):
+    """Read NAME=FILE population lists (e.g. EUR=../metadata/agc.EUR) into a panel dict"""
+    panel = {}
+    for spec in specs:
+        name, sep, filename = spec.partition('=')
+        if not sep or not name or not filename:
+            print(f"Error: Population must be given as NAME=FILE (got: {spec})", file=sys.stderr)
+            sys.exit(1)
+        panel.setdefault(name, []).extend(sorted(read_subset_file(filename)))
+    return panel
+
+def calculate_diversity(matrix, seq_set1, seq_set2=None):
     """
     Calculate average pairwise diversity
     If seq_set2 is None: calculate within seq_set1
     If seq_set2 is provided: calculate between seq_set1 and seq_set2
     """
-    diversities = []
-    missing = 0
-    
-    if seq_set2 is None:
-        # Within-population diversity
-        seq_list = list(seq_set1)
-        for i in range(len(seq_list)):
-            for j in range(i + 1, len(seq_list)):
-                seq1, seq2 = seq_list[i], seq_list[j]
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                
-                if key in similarities:
-                    sim = similarities[key]
-                    if round_digits is not None:
-                        sim = round(sim, round_digits)
-                    diversities.append(1 - sim)
-                else:
-                    missing += 1
-    else:
-        # Between-population diversity
-        for seq1 in seq_set1:
-            for seq2 in seq_set2:
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                
-                if key in similarities:
-                    sim = similarities[key]
-                    if round_digits is not None:
-                        sim = round(sim, round_digits)
-                    diversities.append(1 - sim)
-                else:
-                    missing += 1
-    
-    if not diversities:
-        return 0.0, 0, missing
-    
-    return sum(diversities) / len(diversities), len(diversities), missing
+    idx_1 = matrix.indices(seq_set1)
+    idx_2 = None if seq_set2 is None else matrix.indices(seq_set2)
+    return diversity(matrix, idx_1, idx_2)
 
-def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits=None, log_file=None):
-    """Calculate FST using Hudson et al. (1992) formula"""
-    
-    def log_print(msg):
-        if log_file:
-            print(msg, file=log_file)
+def calculate_fst(matrix, pop_a, pop_b, sequence_length=None, round_digits=None, log_file=None):
+    """Calculate FST using Hudson et al. (1992) formula (log_file: file handle or calclog.CalcLog)"""
+    log = as_log(log_file)
     
     # Ensure populations don't overlap
     overlap = pop_a & pop_b
@@ -184,51 +243,59 @@ def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits
         pop_a = pop_a - overlap
         pop_b = pop_b - overlap
     
-    log_print("FST Calculation")
-    log_print("=" * 50)
-    log_print(f"Population A: {len(pop_a)} sequences")
-    log_print(f"Population B: {len(pop_b)} sequences")
+    log.info("FST Calculation")
+    log.info("=" * 50)
+    log.info("Population A: %d sequences", len(pop_a))
+    log.info("Population B: %d sequences", len(pop_b))
     if round_digits is not None:
-        log_print(f"Rounding similarities to {round_digits} decimal places")
-    log_print("")
+        log.info("Rounding similarities to %s decimal places", round_digits)
+        matrix = matrix.rounded(round_digits)
+    log.info("")
     
     # Calculate within-population diversities
-    log_print("Within-population diversity (π):")
-    pi_a, count_a, miss_a = calculate_diversity(similarities, pop_a, round_digits=round_digits)
-    log_print(f"  πA = {pi_a:.6f} (from {count_a} pairs, {miss_a} missing)")
+    log.info("Within-population diversity (π):")
+    pi_a, count_a, miss_a = calculate_diversity(matrix, pop_a)
+    log.info("  πA = %.6f (from %d pairs, %d missing)", pi_a, count_a, miss_a)
     
-    pi_b, count_b, miss_b = calculate_diversity(similarities, pop_b, round_digits=round_digits)
-    log_print(f"  πB = {pi_b:.6f} (from {count_b} pairs, {miss_b} missing)")
+    pi_b, count_b, miss_b = calculate_diversity(matrix, pop_b)
+    log.info("  πB = %.6f (from %d pairs, %d missing)", pi_b, count_b, miss_b)
     
     pi_xy = 0.5 * (pi_a + pi_b)
-    log_print(f"  πXY = {pi_xy:.6f} (average of πA and πB)")
-    log_print("")
+    log.info("  πXY = %.6f (average of πA and πB)", pi_xy)
+    log.info("")
     
     # Calculate between-population diversity
-    log_print("Between-population diversity (Dxy):")
-    dxy, count_between, miss_between = calculate_diversity(similarities, pop_a, pop_b, round_digits=round_digits)
-    log_print(f"  Dxy = {dxy:.6f} (from {count_between} pairs, {miss_between} missing)")
-    log_print("")
+    log.info("Between-population diversity (Dxy):")
+    dxy, count_between, miss_between = calculate_diversity(matrix, pop_a, pop_b)
+    log.info("  Dxy = %.6f (from %d pairs, %d missing)", dxy, count_between, miss_between)
+    log.info("")
     
     # Calculate FST
     if dxy > 0:
         fst = (dxy - pi_xy) / dxy
-        log_print("FST calculation:")
-        log_print(f"  FST = (Dxy - πXY) / Dxy")
-        log_print(f"      = ({dxy:.6f} - {pi_xy:.6f}) / {dxy:.6f}")
-        log_print(f"      = {fst:.6f}")
+        log.info("FST calculation:")
+        log.info("  FST = (Dxy - πXY) / Dxy")
+        log.info("      = (%.6f - %.6f) / %.6f", dxy, pi_xy, dxy)
+        log.info("      = %.6f", fst)
     else:
         fst = 0.0
-        log_print("FST = 0 (Dxy = 0)")
+        log.info("FST = 0 (Dxy = 0)")
+    log.record(size_a=len(pop_a), size_b=len(pop_b), pairs_a=count_a, missing_a=miss_a,
+               pairs_b=count_b, missing_b=miss_b, pairs_ab=count_between, missing_ab=miss_between,
+               pi_a=pi_a, pi_b=pi_b, dxy=dxy, fst=fst)
+    
+    counts = {'pairs_a': count_a, 'missing_a': miss_a, 'pairs_b': count_b, 'missing_b': miss_b,
+              'pairs_ab': count_between, 'missing_ab': miss_between}
     
     # Per-site calculations if sequence length provided
     if sequence_length and sequence_length > 0:
-        log_print("")
-        log_print(f"Per-site values (sequence length = {sequence_length:,}):")
-        log_print(f"  πA per site = {pi_a/sequence_length:.8f}")
-        log_print(f"  πB per site = {pi_b/sequence_length:.8f}")
-        log_print(f"  πXY per site = {pi_xy/sequence_length:.8f}")
-        log_print(f"  Dxy per site = {dxy/sequence_length:.8f}")
+        log.info("")
+        if log.enabled(INFO):
+            log.info("Per-site values (sequence length = %s):", f"{sequence_length:,}")
+        log.info("  πA per site = %.8f", pi_a / sequence_length)
+        log.info("  πB per site = %.8f", pi_b / sequence_length)
+        log.info("  πXY per site = %.8f", pi_xy / sequence_length)
+        log.info("  Dxy per site = %.8f", dxy / sequence_length)
         
         return {
             'fst': fst,
@@ -236,7 +303,8 @@ def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits
             'pi_b': pi_b / sequence_length,
             'pi_xy': pi_xy / sequence_length,
             'dxy': dxy / sequence_length,
-            'da': (dxy - pi_xy) / sequence_length
+            'da': (dxy - pi_xy) / sequence_length,
+            **counts
         }
     else:
         return {
@@ -245,9 +313,91 @@ def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits
             'pi_b': pi_b,
             'pi_xy': pi_xy,
             'dxy': dxy,
-            'da': dxy - pi_xy
+            'da': dxy - pi_xy,
+            **counts
         }
 
+def permutation_test(matrix, pop_a, pop_b, permutations, seed=1, round_digits=None, threads=1):
+    """Empirical p-value of Hudson Fst from shuffling the A/B labels of the pooled sequences.
+
+    The pooled distance matrix and its row sums are built once and every
+    permutation is re-evaluated as a matrix contraction (resample.py), in
+    blocks split over threads worker processes. Returns a dict with the
+    observed Fst, the p-value and the null distribution.
+    """
+    observed, null = permutation_fst(matrix, matrix.indices(pop_a), matrix.indices(pop_b),
+                                     permutations, seed, round_digits, threads)
+    return {'fst': observed, 'p_value': permutation_p_value(observed, null), 'null': null}
+
+def calculate_panel_fst(matrix, populations, sequence_length=None, round_digits=None, log_file=None):
+    """Calculate Hudson FST for every pair of populations in a panel.
+
+    populations maps population name -> set of sequence names. Sequences
+    assigned to more than one population are left out of all of them.
+    Returns one result dict per population pair (in panel order), with the
+    same keys as calculate_fst() plus 'pop_a' and 'pop_b'.
+    """
+    log = as_log(log_file)
+
+    names = list(populations)
+    labels = np.full(len(matrix), -1, dtype=np.intp)
+    shared = np.zeros(len(matrix), dtype=bool)
+    for k, name in enumerate(names):
+        idx = matrix.indices(populations[name])
+        shared[idx[labels[idx] >= 0]] = True
+        labels[idx] = k
+    if shared.any():
+        print(f"Warning: {int(shared.sum())} sequences appear in more than one population", file=sys.stderr)
+        labels[shared] = -1
+
+    log.info("Panel FST Calculation")
+    log.info("=" * 50)
+    sizes = np.bincount(labels[labels >= 0], minlength=len(names))
+    for name, size in zip(names, sizes):
+        log.info("Population %s: %d sequences", name, size)
+    if round_digits is not None:
+        log.info("Rounding similarities to %s decimal places", round_digits)
+        matrix = matrix.rounded(round_digits)
+    log.info("")
+    log.record(sizes={name: int(size) for name, size in zip(names, sizes)}, shared=int(shared.sum()))
+
+    sums, counts = block_sums(matrix, labels, len(names))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(counts > 0, sums / counts, 0.0)
+    totals = np.outer(sizes, sizes).astype(np.float64)
+    totals[np.diag_indices(len(names))] = sizes * (sizes - 1) / 2
+
+    log.info("Within-population diversity (π):")
+    for k, name in enumerate(names):
+        log.info("  π%s = %.6f (from %d pairs, %d missing)",
+                 name, mean[k, k], counts[k, k], totals[k, k] - counts[k, k])
+    log.info("")
+
+    scale = sequence_length if sequence_length and sequence_length > 0 else 1
+    results = []
+    log.info("Between-population diversity (Dxy) and FST:")
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            pi_a, pi_b, dxy = mean[a, a], mean[b, b], mean[a, b]
+            pi_xy = 0.5 * (pi_a + pi_b)
+            fst = (dxy - pi_xy) / dxy if dxy > 0 else 0.0
+            log.detail("  %s vs %s: Dxy = %.6f (from %d pairs, %d missing), FST = %.6f",
+                       names[a], names[b], dxy, counts[a, b], totals[a, b] - counts[a, b], fst)
+            results.append({
+                'pop_a': names[a],
+                'pop_b': names[b],
+                'fst': float(fst),
+                'pi_a': float(pi_a / scale),
+                'pi_b': float(pi_b / scale),
+                'pi_xy': float(pi_xy / scale),
+                'dxy': float(dxy / scale),
+                'da': float((dxy - pi_xy) / scale),
+                'pairs_a': int(counts[a, a]), 'missing_a': int(totals[a, a] - counts[a, a]),
+                'pairs_b': int(counts[b, b]), 'missing_b': int(totals[b, b] - counts[b, b]),
+                'pairs_ab': int(counts[a, b]), 'missing_ab': int(totals[a, b] - counts[a, b]),
+            })
+    return results
+
 def main():
     parser = argparse.ArgumentParser(
         description='Calculate FST from pairwise sequence similarities',
@@ -255,9 +405,16 @@ def main():
         epilog="""
 Example usage:
   %(prog)s similarities.tsv -a pop_a.txt -b pop_b.txt -l 1000000
+  %(prog)s similarities.tsv --panel samples.tsv -l 1000000
+  %(prog)s similarities.tsv -g EUR=agc.EUR -g AFR=agc.AFR -g EAS=agc.EAS
+  %(prog)s similarities.tsv -a pop_a.txt -b pop_b.txt --permutations 10000 -j 4
   
 Output format:
   FST<tab>pi_A<tab>pi_B<tab>pi_XY<tab>Dxy<tab>Da
+  (followed by <tab>p_value with --permutations)
+
+  Panel mode writes one row per population pair, after a header:
+  POP_A<tab>POP_B<tab>FST<tab>PI_A<tab>PI_B<tab>PI_XY<tab>DXY<tab>DA
   
 Where:
   FST = (Dxy - pi_XY) / Dxy  (Hudson et al. 1992)
@@ -266,38 +423,67 @@ Where:
   pi_XY = (pi_A + pi_B) / 2
   Dxy = nucleotide diversity between populations
   Da = Dxy - pi_XY (net divergence)
+  p_value = (1 + permutations with Fst >= observed) / (permutations + 1),
+            shuffling the A/B labels of the pooled sequences
         """
     )
     
     parser.add_argument('similarity_file', 
-                        help='TSV file with columns: group.a, group.b, estimated.identity')
-    parser.add_argument('-a', '--pop-a', required=True,
+                        help='TSV file with columns: group.a, group.b, estimated.identity (gzip or - for stdin)')
+    parser.add_argument('-a', '--pop-a',
                         help='File listing sequence IDs for population A')
-    parser.add_argument('-b', '--pop-b', required=True,
+    parser.add_argument('-b', '--pop-b',
                         help='File listing sequence IDs for population B')
+    parser.add_argument('--panel',
+                        help='Sample -> population table (identifier and population per line); '
+                             'computes every population pair')
+    parser.add_argument('-g', '--population', action='append', default=[], metavar='NAME=FILE',
+                        help='Add a panel population from a sequence ID list (repeatable)')
     parser.add_argument('-l', '--length', type=int, default=None,
                         help='Sequence length for per-site calculations')
     parser.add_argument('-r', '--round', type=int, default=None,
                         help='Round similarities to N decimal places')
     parser.add_argument('-d', '--log-dir', default='.',
                         help='Directory for log file (default: current directory)')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='detail',
+                        help='Least important log lines to write: detail (every population pair), '
+                             'info or warning (default: detail)')
+    parser.add_argument('--permutations', type=int, default=None,
+                        help='Add an empirical p-value from N permutations of the A/B labels')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed of the permutations (default: 1)')
+    parser.add_argument('-j', '--threads', type=int, default=1,
+                        help='Worker processes for the permutations (default: 1)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print detailed progress to stderr')
     
     args = parser.parse_args()
+    panel_mode = bool(args.panel or args.population)
+    if panel_mode and (args.pop_a or args.pop_b):
+        parser.error("-a/-b cannot be combined with --panel/--population")
+    if not panel_mode and not (args.pop_a and args.pop_b):
+        parser.error("either -a and -b, or --panel/--population, are required")
+    if args.permutations is not None and (panel_mode or args.permutations < 1):
+        parser.error("--permutations needs -a/-b and at least one permutation")
+    if args.threads < 1:
+        parser.error("-j must be at least 1")
     
     # Read input files
     if args.verbose:
         print(f"Reading similarity file: {args.similarity_file}", file=sys.stderr)
-    similarities, all_sequences = read_similarity_file(args.similarity_file)
+    matrix = read_similarity_file(args.similarity_file, round_digits=args.round)
     
+    if panel_mode:
+        run_panel(args, matrix)
+        return
+
     if args.verbose:
         print(f"Reading population files...", file=sys.stderr)
     pop_a_raw = read_subset_file(args.pop_a)
     pop_b_raw = read_subset_file(args.pop_b)
 
-    pop_a, missing_a = expand_population(pop_a_raw, all_sequences)
-    pop_b, missing_b = expand_population(pop_b_raw, all_sequences)
+    pop_a, missing_a = expand_population(pop_a_raw, matrix.ids)
+    pop_b, missing_b = expand_population(pop_b_raw, matrix.ids)
 
     if args.verbose:
         print(f"Population A candidates: {len(pop_a_raw)}", file=sys.stderr)
@@ -327,19 +513,72 @@ Where:
     
     # Calculate FST
     with open(log_path, 'w') as log_file:
+        log = CalcLog(log_file, LEVELS[args.log_level])
         results = calculate_fst(
-            similarities, pop_a, pop_b, 
+            matrix, pop_a, pop_b,
             sequence_length=args.length,
             round_digits=args.round,
-            log_file=log_file
+            log_file=log
         )
+        fields = [f"{results[key]:.8f}" for key in ('fst', 'pi_a', 'pi_b', 'pi_xy', 'dxy', 'da')]
+        if args.permutations:
+            test = permutation_test(matrix, pop_a, pop_b, args.permutations, args.seed,
+                                    round_digits=args.round, threads=args.threads)
+            log.info("")
+            log.info("Permutation test (%d permutations of the A/B labels, seed %d):", args.permutations, args.seed)
+            log.info("  Null FST: mean = %.6f, 95th percentile = %.6f",
+                     test['null'].mean(), np.percentile(test['null'], 95))
+            log.info("  p-value = %.6g", test['p_value'])
+            fields.append(f"{test['p_value']:.6g}")
     
     # Output results (tab-delimited for easy parsing)
-    print(f"{results['fst']:.8f}\t{results['pi_a']:.8f}\t{results['pi_b']:.8f}\t"
-          f"{results['pi_xy']:.8f}\t{results['dxy']:.8f}\t{results['da']:.8f}")
+    print('\t'.join(fields))
     
     if args.verbose:
         print(f"Detailed log saved to: {log_path}", file=sys.stderr)
 
+def run_panel(args, matrix):
+    """Panel mode of main(): every population pair from one matrix"""
+    panel = read_panel_file(args.panel) if args.panel else {}
+    for name, ids in read_population_lists(args.population).items():
+        panel.setdefault(name, []).extend(ids)
+
+    populations = {}
+    for name, (positions, missing) in PopulationResolver(panel).resolve(matrix.ids).items():
+        sequences = set(matrix.names(positions))
+        if args.verbose:
+            print(f"Population {name} sequences matched: {len(sequences)}", file=sys.stderr)
+        if missing:
+            print(f"Warning: {len(missing)} identifiers from population {name} did not match any sequences",
+                  file=sys.stderr)
+        if sequences:
+            populations[name] = sequences
+        else:
+            print(f"Warning: No valid sequences found for population {name}, skipping", file=sys.stderr)
+
+    if len(populations) < 2:
+        print("Error: Panel mode needs at least two populations with valid sequences", file=sys.stderr)
+        sys.exit(1)
+
+    base_name = os.path.splitext(os.path.basename(args.similarity_file))[0]
+    log_path = os.path.join(args.log_dir, f"{base_name}_fst_panel.log")
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    with open(log_path, 'w') as log_file:
+        results = calculate_panel_fst(
+            matrix, populations,
+            sequence_length=args.length,
+            round_digits=args.round,
+            log_file=CalcLog(log_file, LEVELS[args.log_level])
+        )
+
+    print("POP_A\tPOP_B\tFST\tPI_A\tPI_B\tPI_XY\tDXY\tDA")
+    for row in results:
+        print(f"{row['pop_a']}\t{row['pop_b']}\t{row['fst']:.8f}\t{row['pi_a']:.8f}\t{row['pi_b']:.8f}\t"
+              f"{row['pi_xy']:.8f}\t{row['dxy']:.8f}\t{row['da']:.8f}")
+
+    if args.verbose:
+        print(f"Detailed log saved to: {log_path}", file=sys.stderr)
+
 if __name__ == "__main__":
     main()
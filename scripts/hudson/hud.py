@@ -12,45 +12,28 @@ Where:
 import sys
 import argparse
 import os
-import csv
-from collections import defaultdict
 
-def read_similarity_file(filename):
-    """Read similarity data from TSV file"""
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from calclog import INFO, LEVELS, CalcLog, as_log
+from simmatrix import (
+    read_similarity_matrix,
+    diversity as pairwise_diversity,
+    group_indices,
+    group_pair_identity,
+)
+
+def read_similarity_file(filename, round_digits=None):
+    """Read similarity data from TSV file into a SimilarityMatrix"""
     try:
-        with open(filename, newline='') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            
-            if not reader.fieldnames:
-                print(f"Error: Empty file {filename}", file=sys.stderr)
-                sys.exit(1)
-                
-            required = {'group.a', 'group.b', 'estimated.identity'}
-            if not required.issubset(set(reader.fieldnames)):
-                print(f"Error: File must contain columns: {required}", file=sys.stderr)
-                print(f"Found: {reader.fieldnames}", file=sys.stderr)
-                sys.exit(1)
-            
-            similarities = {}
-            all_sequences = set()
-            
-            for row in reader:
-                seq1, seq2 = row['group.a'], row['group.b']
-                try:
-                    sim = float(row['estimated.identity'])
-                except ValueError:
-                    print(f"Warning: Invalid similarity value: {row['estimated.identity']}", file=sys.stderr)
-                    continue
-                
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                similarities[key] = sim
-                all_sequences.update([seq1, seq2])
-            
-            return similarities, all_sequences
-            
+        return read_similarity_matrix(filename, round_digits=round_digits, skip_invalid=True)
     except FileNotFoundError:
         print(f"Error: File not found: {filename}", file=sys.stderr)
         sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
 def read_subset_file(filename):
     """Read sequence IDs from a file"""
@@ -61,116 +44,62 @@ def read_subset_file(filename):
         print(f"Error: Subset file not found: {filename}", file=sys.stderr)
         sys.exit(1)
 
-def group_sequences(similarities, sequences, threshold=0.999, round_digits=None):
-    """Group sequences with similarity > threshold"""
-    groups = []
-    remaining = set(sequences)
-    
-    while remaining:
-        current = remaining.pop()
-        group = [current]
-        
-        # Find all sequences similar to current
-        for other in list(remaining):
-            key = (current, other) if current <= other else (other, current)
-            if key in similarities:
-                sim = similarities[key]
-                if round_digits is not None:
-                    sim = round(sim, round_digits)
-                if sim > threshold:
-                    group.append(other)
-                    remaining.remove(other)
-        
-        groups.append(sorted(group))
-    
-    return sorted(groups)
+def group_sequences(matrix, sequences, threshold=0.999):
+    """Group sequences linked by similarity > threshold (connected components, sorted index arrays)"""
+    return group_indices(matrix, matrix.indices(sequences), threshold)
 
-def get_group_similarity(similarities, group1, group2, round_digits=None):
-    """Get representative similarity between two groups (using first found pair)"""
-    for seq1 in group1:
-        for seq2 in group2:
-            key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-            if key in similarities:
-                sim = similarities[key]
-                if round_digits is not None:
-                    sim = round(sim, round_digits)
-                return sim
-    return None
+def grouped_pi(groups, n_total, identity, present):
+    """Frequency-based diversity of one population from its group-level identities.
 
-def calculate_diversity_grouped(similarities, sequences, threshold=0.999, round_digits=None):
-    """Calculate diversity using frequency-based formula after grouping"""
-    groups = group_sequences(similarities, sequences, threshold, round_digits)
-    n_total = len(sequences)
-    
+    identity/present are the (k, k) group_pair_identity() arrays of its
+    groups. Returns (diversity, missing group pairs).
+    """
     if n_total <= 1:
-        return 0.0, len(groups), 0
-    
-    # Calculate diversity between groups
-    diversity_sum = 0.0
-    pair_count = 0
-    missing_count = 0
-    
-    for i in range(len(groups)):
-        for j in range(i + 1, len(groups)):
-            sim = get_group_similarity(similarities, groups[i], groups[j], round_digits)
-            
-            if sim is not None:
-                freq_i = len(groups[i]) / n_total
-                freq_j = len(groups[j]) / n_total
-                diversity_sum += 2 * freq_i * freq_j * (1 - sim)
-                pair_count += 1
-            else:
-                missing_count += 1
-    
+        return 0.0, 0
+    freq = np.array([len(group) for group in groups]) / n_total
+    rows, cols = np.triu_indices(len(groups), k=1)
+    found = present[rows, cols]
+    terms = 2 * freq[rows] * freq[cols] * (1 - identity[rows, cols])
+    # Summed in group-pair order, as pairs are visited one by one
+    diversity_sum = sum(terms[found].tolist())
     # Apply Bessel correction
-    diversity = diversity_sum * n_total / (n_total - 1)
-    
-    return diversity, len(groups), missing_count
+    return diversity_sum * n_total / (n_total - 1), int(np.count_nonzero(~found))
+
+def grouped_fst_terms(matrix, pop_a, pop_b, threshold=0.999):
+    """πA, πB and Dxy of the grouped method from one grouping per population.
+
+    Groups of A and B share one group-level identity matrix; its A and B
+    diagonal blocks give πA and πB and its A x B block gives Dxy, weighted
+    by (|a| |b|) / (nA nB). Returns a dict with the values, group counts
+    and missing group pairs.
+    """
+    groups_a = group_sequences(matrix, pop_a, threshold)
+    groups_b = group_sequences(matrix, pop_b, threshold)
+    identity, present = group_pair_identity(matrix, groups_a + groups_b)
+    k = len(groups_a)
+
+    pi_a, miss_a = grouped_pi(groups_a, len(pop_a), identity[:k, :k], present[:k, :k])
+    pi_b, miss_b = grouped_pi(groups_b, len(pop_b), identity[k:, k:], present[k:, k:])
 
-def calculate_diversity_direct(similarities, seq_set1, seq_set2=None, round_digits=None):
+    sizes_a = np.array([len(group) for group in groups_a])
+    sizes_b = np.array([len(group) for group in groups_b])
+    found = present[:k, k:]
+    weight = np.outer(sizes_a, sizes_b) / (len(pop_a) * len(pop_b))
+    dxy = sum((weight * (1 - identity[:k, k:]))[found].tolist())
+    return {'pi_a': pi_a, 'pi_b': pi_b, 'dxy': dxy, 'groups_a': len(groups_a), 'groups_b': len(groups_b),
+            'missing_a': miss_a, 'missing_b': miss_b, 'missing_ab': int(np.count_nonzero(~found))}
+
+def calculate_diversity_direct(matrix, seq_set1, seq_set2=None):
     """
     Calculate average pairwise diversity (direct method)
     If seq_set2 is None: calculate within seq_set1
     If seq_set2 is provided: calculate between seq_set1 and seq_set2
     """
-    diversities = []
-    missing = 0
-    
-    if seq_set2 is None:
-        # Within-population diversity
-        seq_list = list(seq_set1)
-        for i in range(len(seq_list)):
-            for j in range(i + 1, len(seq_list)):
-                seq1, seq2 = seq_list[i], seq_list[j]
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                
-                if key in similarities:
-                    sim = similarities[key]
-                    if round_digits is not None:
-                        sim = round(sim, round_digits)
-                    diversities.append(1 - sim)
-                else:
-                    missing += 1
-    else:
-        # Between-population diversity
-        for seq1 in seq_set1:
-            for seq2 in seq_set2:
-                key = (seq1, seq2) if seq1 <= seq2 else (seq2, seq1)
-                
-                if key in similarities:
-                    sim = similarities[key]
-                    if round_digits is not None:
-                        sim = round(sim, round_digits)
-                    diversities.append(1 - sim)
-                else:
-                    missing += 1
-    
-    if not diversities:
-        return 0.0, 0, missing
-    
-    return sum(diversities) / len(diversities), len(diversities), missing
+    idx_1 = matrix.indices(seq_set1)
+    idx_2 = None if seq_set2 is None else matrix.indices(seq_set2)
+    return pairwise_diversity(matrix, idx_1, idx_2)
 
-def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits=None, 
+def calculate_fst(matrix, pop_a, pop_b, sequence_length=None, round_digits=None, 
                   log_file=None, method='direct', threshold=0.999):
     """
     Calculate FST using Hudson et al. (1992) formula
@@ -178,10 +107,7 @@ def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits
     method: 'direct' for pairwise average, 'grouped' for frequency-based with grouping
     threshold: similarity threshold for grouping (only used when method='grouped')
     """
-    
-    def log_print(msg):
-        if log_file:
-            print(msg, file=log_file)
+    log = as_log(log_file)
     
     # Ensure populations don't overlap
     overlap = pop_a & pop_b
@@ -190,104 +116,80 @@ def calculate_fst(similarities, pop_a, pop_b, sequence_length=None, round_digits
         pop_a = pop_a - overlap
         pop_b = pop_b - overlap
     
-    log_print("FST Calculation")
-    log_print("=" * 50)
-    log_print(f"Population A: {len(pop_a)} sequences")
-    log_print(f"Population B: {len(pop_b)} sequences")
-    log_print(f"Method: {method}")
+    log.info("FST Calculation")
+    log.info("=" * 50)
+    log.info("Population A: %d sequences", len(pop_a))
+    log.info("Population B: %d sequences", len(pop_b))
+    log.info("Method: %s", method)
     if method == 'grouped':
-        log_print(f"Grouping threshold: {threshold}")
+        log.info("Grouping threshold: %s", threshold)
     if round_digits is not None:
-        log_print(f"Rounding similarities to {round_digits} decimal places")
-    log_print("")
+        log.info("Rounding similarities to %s decimal places", round_digits)
+        matrix = matrix.rounded(round_digits)
+    log.info("")
     
     # Calculate within-population diversities
     if method == 'grouped':
-        log_print("Within-population diversity (π) using grouped method:")
-        pi_a, groups_a, miss_a = calculate_diversity_grouped(
-            similarities, pop_a, threshold, round_digits
-        )
-        log_print(f"  πA = {pi_a:.6f} ({groups_a} groups from {len(pop_a)} sequences, {miss_a} missing pairs)")
-        
-        pi_b, groups_b, miss_b = calculate_diversity_grouped(
-            similarities, pop_b, threshold, round_digits
-        )
-        log_print(f"  πB = {pi_b:.6f} ({groups_b} groups from {len(pop_b)} sequences, {miss_b} missing pairs)")
+        grouped = grouped_fst_terms(matrix, pop_a, pop_b, threshold)
+        pi_a, pi_b = grouped['pi_a'], grouped['pi_b']
+        log.info("Within-population diversity (π) using grouped method:")
+        log.info("  πA = %.6f (%d groups from %d sequences, %d missing pairs)",
+                 pi_a, grouped['groups_a'], len(pop_a), grouped['missing_a'])
+        log.info("  πB = %.6f (%d groups from %d sequences, %d missing pairs)",
+                 pi_b, grouped['groups_b'], len(pop_b), grouped['missing_b'])
     else:
-        log_print("Within-population diversity (π) using direct method:")
+        log.info("Within-population diversity (π) using direct method:")
         pi_a, count_a, miss_a = calculate_diversity_direct(
-            similarities, pop_a, round_digits=round_digits
+            matrix, pop_a
         )
-        log_print(f"  πA = {pi_a:.6f} (from {count_a} pairs, {miss_a} missing)")
+        log.info("  πA = %.6f (from %d pairs, %d missing)", pi_a, count_a, miss_a)
         
         pi_b, count_b, miss_b = calculate_diversity_direct(
-            similarities, pop_b, round_digits=round_digits
+            matrix, pop_b
         )
-        log_print(f"  πB = {pi_b:.6f} (from {count_b} pairs, {miss_b} missing)")
+        log.info("  πB = %.6f (from %d pairs, %d missing)", pi_b, count_b, miss_b)
     
     pi_xy = 0.5 * (pi_a + pi_b)
-    log_print(f"  πXY = {pi_xy:.6f} (average of πA and πB)")
-    log_print("")
+    log.info("  πXY = %.6f (average of πA and πB)", pi_xy)
+    log.info("")
     
     # Calculate between-population diversity
-    log_print("Between-population diversity (Dxy):")
+    log.info("Between-population diversity (Dxy):")
     
     if method == 'grouped':
-        # For Dxy with grouping, we need to handle between-population groups specially
-        groups_a = group_sequences(similarities, pop_a, threshold, round_digits)
-        groups_b = group_sequences(similarities, pop_b, threshold, round_digits)
-        
-        n_total_a = len(pop_a)
-        n_total_b = len(pop_b)
-        n_total = n_total_a + n_total_b
-        
-        dxy_sum = 0.0
-        pair_count = 0
-        missing_count = 0
-        
-        for group_a in groups_a:
-            for group_b in groups_b:
-                sim = get_group_similarity(similarities, group_a, group_b, round_digits)
-                if sim is not None:
-                    freq_a = len(group_a) / n_total
-                    freq_b = len(group_b) / n_total
-                    # For between-population diversity, we use the product of frequencies
-                    # normalized by the relative population sizes
-                    weight = (len(group_a) * len(group_b)) / (n_total_a * n_total_b)
-                    dxy_sum += weight * (1 - sim)
-                    pair_count += 1
-                else:
-                    missing_count += 1
-        
-        dxy = dxy_sum
-        log_print(f"  Dxy = {dxy:.6f} (from {len(groups_a)} x {len(groups_b)} group pairs, {missing_count} missing)")
+        # Group-pair Dxy terms come from the same group-level identities
+        dxy = grouped['dxy']
+        log.info("  Dxy = %.6f (from %d x %d group pairs, %d missing)",
+                 dxy, grouped['groups_a'], grouped['groups_b'], grouped['missing_ab'])
     else:
         dxy, count_between, miss_between = calculate_diversity_direct(
-            similarities, pop_a, pop_b, round_digits=round_digits
+            matrix, pop_a, pop_b
         )
-        log_print(f"  Dxy = {dxy:.6f} (from {count_between} pairs, {miss_between} missing)")
+        log.info("  Dxy = %.6f (from %d pairs, %d missing)", dxy, count_between, miss_between)
     
-    log_print("")
+    log.info("")
     
     # Calculate FST
     if dxy > 0:
         fst = (dxy - pi_xy) / dxy
-        log_print("FST calculation:")
-        log_print(f"  FST = (Dxy - πXY) / Dxy")
-        log_print(f"      = ({dxy:.6f} - {pi_xy:.6f}) / {dxy:.6f}")
-        log_print(f"      = {fst:.6f}")
+        log.info("FST calculation:")
+        log.info("  FST = (Dxy - πXY) / Dxy")
+        log.info("      = (%.6f - %.6f) / %.6f", dxy, pi_xy, dxy)
+        log.info("      = %.6f", fst)
     else:
         fst = 0.0
-        log_print("FST = 0 (Dxy = 0)")
+        log.info("FST = 0 (Dxy = 0)")
+    log.record(method=method, size_a=len(pop_a), size_b=len(pop_b), pi_a=pi_a, pi_b=pi_b, dxy=dxy, fst=fst)
     
     # Per-site calculations if sequence length provided
     if sequence_length and sequence_length > 0:
-        log_print("")
-        log_print(f"Per-site values (sequence length = {sequence_length:,}):")
-        log_print(f"  πA per site = {pi_a/sequence_length:.8f}")
-        log_print(f"  πB per site = {pi_b/sequence_length:.8f}")
-        log_print(f"  πXY per site = {pi_xy/sequence_length:.8f}")
-        log_print(f"  Dxy per site = {dxy/sequence_length:.8f}")
+        log.info("")
+        if log.enabled(INFO):
+            log.info("Per-site values (sequence length = %s):", f"{sequence_length:,}")
+        log.info("  πA per site = %.8f", pi_a / sequence_length)
+        log.info("  πB per site = %.8f", pi_b / sequence_length)
+        log.info("  πXY per site = %.8f", pi_xy / sequence_length)
+        log.info("  Dxy per site = %.8f", dxy / sequence_length)
         
         return {
             'fst': fst,
@@ -334,7 +236,7 @@ Methods:
     )
     
     parser.add_argument('similarity_file', 
-                        help='TSV file with columns: group.a, group.b, estimated.identity')
+                        help='TSV file with columns: group.a, group.b, estimated.identity (gzip or - for stdin)')
     parser.add_argument('-a', '--pop-a', required=True,
                         help='File listing sequence IDs for population A')
     parser.add_argument('-b', '--pop-b', required=True,
@@ -349,6 +251,8 @@ Methods:
                         help='Similarity threshold for grouping (default: 0.999, used only with -m grouped)')
     parser.add_argument('-d', '--log-dir', default='.',
                         help='Directory for log file (default: current directory)')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='detail',
+                        help='Least important log lines to write: detail, info or warning (default: detail)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print detailed progress to stderr')
     
@@ -357,7 +261,8 @@ Methods:
     # Read input files
     if args.verbose:
         print(f"Reading similarity file: {args.similarity_file}", file=sys.stderr)
-    similarities, all_sequences = read_similarity_file(args.similarity_file)
+    matrix = read_similarity_file(args.similarity_file, round_digits=args.round)
+    all_sequences = set(matrix.ids)
     
     if args.verbose:
         print(f"Reading population files...", file=sys.stderr)
@@ -398,10 +303,10 @@ Methods:
     # Calculate FST
     with open(log_path, 'w') as log_file:
         results = calculate_fst(
-            similarities, pop_a, pop_b, 
+            matrix, pop_a, pop_b,
             sequence_length=args.length,
             round_digits=args.round,
-            log_file=log_file,
+            log_file=CalcLog(log_file, LEVELS[args.log_level]),
             method=args.method,
             threshold=args.threshold
         )
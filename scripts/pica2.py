@@ -1,177 +1,128 @@
 import sys
 import argparse
 import os
-import csv
 
-def read_similarity_file(filename):
+import numpy as np
+
+from calclog import DETAIL, LEVELS, CalcLog, as_log
+from simmatrix import read_similarity_matrix, group_indices, representative_identity
+
+def read_similarity_file(filename, round_digits=None):
     """
     Read similarity data from file with columns: group.a, group.b, estimated.identity
-    Returns a tuple (similarity_dict, elements, pair_count) where:
-      * similarity_dict maps an unordered pair (min, max) to the similarity value
-      * elements is the set of unique group identifiers
+    Similarities are rounded to round_digits decimal places on load (None = no rounding).
+    Returns a SimilarityMatrix where:
+      * ids/index intern every unique group identifier to an integer index
+      * dist/present hold the pairwise distances (1 - similarity) and which pairs were reported
       * pair_count counts the number of rows parsed from the file
     """
     try:
-        with open(filename, newline='') as handle:
-            reader = csv.DictReader(handle, delimiter='\t')
-
-            if reader.fieldnames is None:
-                print(f"Error: File {filename} is empty or missing a header")
-                sys.exit(1)
-
-            required_cols = {'group.a', 'group.b', 'estimated.identity'}
-            missing_cols = required_cols - set(reader.fieldnames)
-            if missing_cols:
-                print(f"Error: File must contain columns: {sorted(required_cols)}")
-                print(f"Found columns: {reader.fieldnames}")
-                sys.exit(1)
-
-            similarity_dict = {}
-            elements = set()
-            pair_count = 0
-
-            for row_number, row in enumerate(reader, start=2):  # start=2 accounts for header row
-                pair_count += 1
-                e1 = row['group.a']
-                e2 = row['group.b']
-                try:
-                    similarity = float(row['estimated.identity'])
-                except (TypeError, ValueError):
-                    print(f"Error: Invalid similarity value on line {row_number}: {row['estimated.identity']}")
-                    sys.exit(1)
-
-                key = (e1, e2) if e1 <= e2 else (e2, e1)
-                similarity_dict[key] = similarity
-                elements.add(e1)
-                elements.add(e2)
-
-            if pair_count == 0:
-                print(f"Warning: No similarity entries found in {filename}")
-
-            return similarity_dict, elements, pair_count
-
+        matrix = read_similarity_matrix(filename, round_digits=round_digits)
     except FileNotFoundError:
         print(f"Error: File not found {filename}")
         sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"Error reading file {filename}: {e}")
         sys.exit(1)
 
-def analyze_similarity_matrix(similarity_dict, elements, pair_count, threshold=1.0, sequence_length=None, log_file=None, round_digits=None):
+    if matrix.pair_count == 0:
+        print(f"Warning: No similarity entries found in {filename}")
+
+    return matrix
+
+def analyze_similarity_matrix(matrix, threshold=1.0, sequence_length=None, log_file=None, round_digits=None, indices=None):
     """
     Simple 3-step similarity matrix analysis
     
     Input: 
-        similarity_dict: mapping of unordered pairs to similarity values
-        elements: set of unique element identifiers
-        pair_count: number of pairwise similarities parsed from the input file
+        matrix: SimilarityMatrix with the pairwise similarities of the window
         threshold: similarity threshold for grouping elements
         sequence_length: length of sequences to normalize pi per site
-        log_file: file handle for logging output
+        log_file: file handle or calclog.CalcLog for logging output
         round_digits: number of decimal places to round similarities (None = no rounding)
+        indices: restrict the analysis to these matrix indices (None = all elements)
     Output: pi statistic, pi_per_site
     """
+    log = as_log(log_file)
     
-    def log_print(message):
-        """Print to log file only"""
-        if log_file:
-            print(message, file=log_file)
-    
-    # Optionally round similarity values in-place to avoid duplicating data
+    # Optionally round similarity values (no-op when already rounded on load)
     if round_digits is not None:
-        for key in list(similarity_dict.keys()):
-            similarity_dict[key] = round(similarity_dict[key], round_digits)
+        matrix = matrix.rounded(round_digits)
 
-    def get_similarity(e1, e2):
-        key = (e1, e2) if e1 <= e2 else (e2, e1)
-        return similarity_dict.get(key)
+    if indices is None:
+        indices = np.arange(len(matrix))
 
-    log_print(f"Loaded {pair_count} pairwise similarities")
-    log_print(f"Found {len(elements)} unique elements")
+    log.info("Loaded %d pairwise similarities", matrix.pair_count)
+    log.info("Found %d unique elements", len(indices))
     if round_digits is not None:
-        log_print(f"Rounded similarities to {round_digits} decimal places")
+        log.info("Rounded similarities to %s decimal places", round_digits)
     
-    # Step 1: Find groups (elements with similarity > threshold)
-    groups = []
-    remaining = set(elements)
+    # Step 1: Find groups (connected components of pairs with similarity > threshold)
+    groups = group_indices(matrix, indices, threshold)
     
-    while remaining:
-        # Start new group with first remaining element
-        current = remaining.pop()
-        group = [current]
-        
-        # Find all elements similar to current (above threshold)
-        for other in list(remaining):
-            sim_value = get_similarity(current, other)
-            if sim_value is not None and sim_value > threshold:
-                group.append(other)
-                remaining.remove(other)
-        
-        groups.append(sorted(group))
-    
-    groups.sort()  # Sort for consistency
-    log_print(f"\nStep 1: Grouping elements (threshold > {threshold})")
-    log_print(f"Found {len(groups)} groups:")
-    for i, group in enumerate(groups, 1):
-        log_print(f"  G{i}: {group} (size: {len(group)})")
+    log.info("\nStep 1: Grouping elements (threshold > %s)", threshold)
+    log.info("Found %d groups:", len(groups))
+    if log.enabled(DETAIL):
+        for i, group in enumerate(groups, 1):
+            log.detail("  G%d: %s (size: %d)", i, matrix.names(group), len(group))
     
     # Step 2: Calculate group pairs
-    log_print(f"\nStep 2: Calculating group pairs")
-    group_pairs = []
+    log.info("\nStep 2: Calculating group pairs")
     total_elements = sum(len(group) for group in groups)
+    log.record(pairs=matrix.pair_count, elements=len(indices), groups=len(groups))
     if total_elements == 0:
-        log_print("Warning: No elements available to compute group pairs")
+        log.warning("Warning: No elements available to compute group pairs")
         return 0.0, 0.0
-    for i in range(len(groups)):
-        for j in range(i+1, len(groups)):
-            # Get similarity between groups (any element from each)
-            elem1, elem2 = groups[i][0], groups[j][0]
-            
-            # Check if we have similarity data for this pair
-            similarity = get_similarity(elem1, elem2)
-            if similarity is None:
-                log_print(f"Warning: No similarity data found between groups G{i+1} and G{j+1}, skipping...")
+
+    # Similarity between groups is taken from the first element of each group
+    rows, cols, similarity, has_data = representative_identity(matrix, groups)
+    freq = np.array([len(group) for group in groups], dtype=np.float64) / total_elements
+    pair_values = (1 - similarity) * freq[rows] * freq[cols]
+    group_pairs = pair_values[has_data]
+
+    if log.enabled(DETAIL):
+        sizes = [len(group) for group in groups]
+        for i, j, sim, ok, value in zip(rows, cols, similarity, has_data, pair_values):
+            if not ok:
+                log.detail("Warning: No similarity data found between groups G%d and G%d, skipping...", i + 1, j + 1)
                 continue
-            
-            # Calculate pair value using (1 - similarity) weighted by group frequencies
-            freq_i = len(groups[i]) / total_elements
-            freq_j = len(groups[j]) / total_elements
-            pair_value = (1 - similarity) * freq_i * freq_j
-            group_pairs.append(pair_value)
-            log_print(
-                f"  G{i+1}G{j+1}: (1 - {similarity:.6f}) * "
-                f"({len(groups[i])}/{total_elements}) * "
-                f"({len(groups[j])}/{total_elements}) = {pair_value:.6f}"
-            )
+            log.detail("  G%dG%d: (1 - %.6f) * (%d/%d) * (%d/%d) = %.6f",
+                       i + 1, j + 1, sim, sizes[i], total_elements, sizes[j], total_elements, value)
     
     # Step 3: Calculate pi
-    log_print(f"\nStep 3: Calculating pi")
-    n = sum(len(group) for group in groups)
+    log.info("\nStep 3: Calculating pi")
+    n = total_elements
     if len(group_pairs) == 0:
-        log_print("Warning: No group pairs found with similarity data!")
+        log.warning("Warning: No group pairs found with similarity data!")
         return 0.0, 0.0
     
-    pi = (n / (n-1)) * sum(2 * pair for pair in group_pairs)
+    pair_sum = float(2 * group_pairs.sum())
+    pi = (n / (n-1)) * pair_sum
     
-    log_print(f"  n (total elements) = {n}")
-    log_print(f"  Number of group pairs with data = {len(group_pairs)}")
-    log_print(f"  Sum of 2 * group_pairs = {sum(2 * pair for pair in group_pairs):.6f}")
-    log_print(f"  pi = {n}/{n-1} * {sum(2 * pair for pair in group_pairs):.6f} = {pi:.6f}")
+    log.info("  n (total elements) = %d", n)
+    log.info("  Number of group pairs with data = %d", len(group_pairs))
+    log.info("  Sum of 2 * group_pairs = %.6f", pair_sum)
+    log.info("  pi = %d/%d * %.6f = %.6f", n, n - 1, pair_sum, pi)
+    log.record(group_pairs=len(group_pairs), pi=pi)
     
     # Calculate pi per site if sequence length provided
     pi_per_site = None
     if sequence_length:
         pi_per_site = pi / sequence_length
-        log_print(f"\nNormalization:")
-        log_print(f"  Sequence length = {sequence_length}")
-        log_print(f"  pi per site = {pi:.6f} / {sequence_length} = {pi_per_site:.8f}")
+        log.info("\nNormalization:")
+        log.info("  Sequence length = %s", sequence_length)
+        log.info("  pi per site = %.6f / %s = %.8f", pi, sequence_length, pi_per_site)
+        log.record(sequence_length=sequence_length, pi_per_site=pi_per_site)
     
     return pi, pi_per_site
 
 # Main execution with command line arguments
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze similarity matrix with customizable threshold and sequence length normalization')
-    parser.add_argument('input_file', help='Input file with similarity data (TSV format with group.a, group.b, estimated.identity columns)')
+    parser.add_argument('input_file', help='Input file with similarity data (TSV format with group.a, group.b, estimated.identity columns; gzip or - for stdin)')
     parser.add_argument('--threshold', '-t', type=float, default=0.99, 
                         help='Similarity threshold for grouping elements (default: 0.99)')
     parser.add_argument('--sequence-length', '-l', type=int, 
@@ -180,6 +131,9 @@ if __name__ == "__main__":
                         help='Directory to save log file (default: current directory)')
     parser.add_argument('--round-digits', '-r', type=int, default=None,
                         help='Round similarity values to specified decimal places (default: no rounding)')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='detail',
+                        help='Least important log lines to write: detail (every group and group pair), '
+                             'info (steps and totals) or warning (default: detail)')
     
     args = parser.parse_args()
     
@@ -191,7 +145,7 @@ if __name__ == "__main__":
     os.makedirs(args.log_dir, exist_ok=True)
     
     # Read similarity data from file
-    similarity_dict, elements, pair_count = read_similarity_file(args.input_file)
+    matrix = read_similarity_file(args.input_file, round_digits=args.round_digits)
     
     # Open log file and run analysis
     with open(log_filename, 'w') as log_file:
@@ -206,12 +160,10 @@ if __name__ == "__main__":
         log_file.write(f"Log file: {log_filename}\n\n")
         
         pi, pi_per_site = analyze_similarity_matrix(
-            similarity_dict,
-            elements,
-            pair_count,
+            matrix,
             threshold=args.threshold,
             sequence_length=args.sequence_length,
-            log_file=log_file,
+            log_file=CalcLog(log_file, LEVELS[args.log_level]),
             round_digits=args.round_digits,
         )
         
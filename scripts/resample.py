@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+resample.py - Bootstrap, jackknife and permutation tests for windowed pi and Fst
+
+Haplotype bootstrap (one window): a replicate draws the haplotypes of each
+population with replacement, i.e. gives haplotype i a multinomial count
+w_i. Every pairwise statistic of the replicate is then a weighted mean of
+the distance matrix already in memory,
+
+    sum_{i != j} w_i w_j d_ij / sum_{i != j} w_i w_j p_ij     (p_ij: pair reported by impg)
+
+so a block of replicates is two matrix products (W @ D, W @ P) instead of
+a new impg run per replicate. With all w_i = 1 this is the point estimate
+of simmatrix.diversity(). pica2.py pi keeps the groups of the full sample
+(threshold grouping is not redone per replicate); a replicate changes the
+group frequencies only.
+
+Replicates (and permutations) are drawn in fixed blocks of
+REPLICATE_BLOCK, each block from its own child of SeedSequence(seed).
+The replicates are therefore the same whatever the number of processes
+(-j).
+
+Permutation test (one window): the A/B labels of the pooled haplotypes
+are shuffled and Hudson Fst is re-evaluated from the same matrices, again
+in blocks of labellings, for an empirical p-value (h-fst.py --permutations).
+
+Weighted block jackknife (whole scan): windows are the blocks of a
+delete-one jackknife of a ratio estimator sum(numerators) /
+sum(denominators), weighted by window length as in Busing et al. (1999).
+
+Usage:
+    python3 resample.py window.sim -t 0.999 -r 4 --replicates 1000 [-u list] [-j 4]
+    python3 resample.py window.sim -A agc.EUR -B agc.AFR --replicates 1000
+"""
+
+import argparse
+import importlib
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from simmatrix import group_indices, read_similarity_matrix, representative_identity
+
+# Replicates drawn from one child seed
+REPLICATE_BLOCK = 64
+
+
+def distance_blocks(matrix, idx_a, idx_b=None):
+    """float64 distance and reported-pair blocks; unreported pairs and the diagonal are 0."""
+    idx_b = idx_a if idx_b is None else idx_b
+    dist, present = matrix.block(idx_a, idx_b)
+    dist = np.where(present, dist, 0).astype(np.float64)
+    present = present.astype(np.float64)
+    if idx_b is idx_a:
+        np.fill_diagonal(present, 0)
+        np.fill_diagonal(dist, 0)
+    return dist, present
+
+
+def weighted_mean_distance(dist, present, weights_a, weights_b=None):
+    """Per-replicate mean distance of (replicates, n) weights over the reported pairs; 0 without data."""
+    weights_b = weights_a if weights_b is None else weights_b
+    total = ((weights_a @ dist) * weights_b).sum(axis=1)
+    pairs = ((weights_a @ present) * weights_b).sum(axis=1)
+    return np.divide(total, pairs, out=np.zeros_like(total), where=pairs > 0)
+
+
+def draw_counts(rng, n, replicates):
+    """(replicates, n) haplotype counts of n draws with replacement."""
+    return rng.multinomial(n, np.full(n, 1.0 / n), size=replicates).astype(np.float64)
+
+
+def _pi_block(seed, count, membership, group_dist):
+    rng = np.random.default_rng(seed)
+    n = membership.shape[0]
+    freq = draw_counts(rng, n, count) @ membership / n
+    # pica2: n/(n-1) * sum over group pairs with data of 2 * f_g * f_h * (1 - similarity)
+    return n / (n - 1) * ((freq @ group_dist) * freq).sum(axis=1)
+
+
+def _fst_block(seed, count, dist_a, present_a, dist_b, present_b, dist_ab, present_ab):
+    rng = np.random.default_rng(seed)
+    weights_a = draw_counts(rng, dist_a.shape[0], count)
+    weights_b = draw_counts(rng, dist_b.shape[0], count)
+    pi_a = weighted_mean_distance(dist_a, present_a, weights_a)
+    pi_b = weighted_mean_distance(dist_b, present_b, weights_b)
+    dxy = weighted_mean_distance(dist_ab, present_ab, weights_a, weights_b)
+    pi_xy = 0.5 * (pi_a + pi_b)
+    return np.divide(dxy - pi_xy, dxy, out=np.zeros_like(dxy), where=dxy > 0)
+
+
+def labelled_fst(labels, dist, present, row_dist, row_present):
+    """Hudson Fst for every row of a (permutations, n) 0/1 matrix marking population A.
+
+    Within A is x'Dx; between is x'r - x'Dx and within B is 1'r - 2x'r + x'Dx,
+    with r the row sums of D, so a block of labellings costs one product
+    with D and one with P.
+    """
+    sums = []
+    for matrix, rows in ((dist, row_dist), (present, row_present)):
+        within_a = ((labels @ matrix) * labels).sum(axis=1)
+        to_rows = labels @ rows
+        sums.append((within_a, rows.sum() - 2 * to_rows + within_a, to_rows - within_a))
+    pi_a, pi_b, dxy = (np.divide(total, pairs, out=np.zeros_like(total), where=pairs > 0)
+                       for total, pairs in zip(*sums))
+    pi_xy = 0.5 * (pi_a + pi_b)
+    return np.divide(dxy - pi_xy, dxy, out=np.zeros_like(dxy), where=dxy > 0)
+
+
+def _permutation_block(seed, count, dist, present, row_dist, row_present, n_a):
+    rng = np.random.default_rng(seed)
+    members = np.argpartition(rng.random((count, dist.shape[0])), n_a - 1, axis=1)[:, :n_a]
+    labels = np.zeros((count, dist.shape[0]))
+    np.put_along_axis(labels, members, 1.0, axis=1)
+    return labelled_fst(labels, dist, present, row_dist, row_present)
+
+
+def disjoint_populations(idx_a, idx_b):
+    """idx_a and idx_b without the indices they share, as h-fst.py calculate_fst() drops them from both."""
+    shared = np.intersect1d(idx_a, idx_b)
+    return np.setdiff1d(idx_a, shared), np.setdiff1d(idx_b, shared)
+
+
+def permutation_fst(matrix, idx_a, idx_b, permutations, seed, round_digits=None, threads=1):
+    """Observed Hudson Fst and its null distribution under shuffled A/B labels.
+
+    The pooled distance and reported-pair matrices and their row sums are
+    built once; every permutation draws |A| haplotypes of the pool as A.
+    Returns (observed, null array).
+    """
+    if round_digits is not None:
+        matrix = matrix.rounded(round_digits)
+    idx_a, idx_b = disjoint_populations(idx_a, idx_b)
+    if len(idx_a) == 0 or len(idx_b) == 0:
+        return 0.0, np.zeros(permutations)
+    pool = np.concatenate([idx_a, idx_b])
+    dist, present = distance_blocks(matrix, pool)
+    arrays = (dist, present, dist.sum(axis=1), present.sum(axis=1))
+    observed_labels = np.zeros((1, len(pool)))
+    observed_labels[0, :len(idx_a)] = 1
+    observed = float(labelled_fst(observed_labels, *arrays)[0])
+    return observed, run_replicates(_permutation_block, arrays + (len(idx_a),), permutations, seed, threads)
+
+
+def permutation_p_value(observed, null):
+    """One-sided empirical p-value of observed against null, (1 + #{null >= observed}) / (N + 1)."""
+    # Labellings equal to the observed one give the same value up to summation order
+    return float((1 + np.count_nonzero(null >= observed - 1e-12)) / (len(null) + 1))
+
+
+def run_replicates(block_function, arrays, replicates, seed, threads=1):
+    """Concatenated block_function(child seed, count, *arrays) over blocks of REPLICATE_BLOCK replicates."""
+    counts = [min(REPLICATE_BLOCK, replicates - start) for start in range(0, replicates, REPLICATE_BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    if threads > 1 and len(counts) > 1:
+        with ProcessPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(block_function, child, count, *arrays) for child, count in zip(seeds, counts)]
+            blocks = [future.result() for future in futures]
+    else:
+        blocks = [block_function(child, count, *arrays) for child, count in zip(seeds, counts)]
+    return np.concatenate(blocks) if blocks else np.zeros(0)
+
+
+def bootstrap_pi(matrix, indices, threshold, replicates, seed, round_digits=None, sequence_length=None, threads=1):
+    """Bootstrap replicates of pica2.py pi (per site with sequence_length) over the haplotypes in indices."""
+    if round_digits is not None:
+        matrix = matrix.rounded(round_digits)
+    groups = group_indices(matrix, indices, threshold)
+    n = sum(len(group) for group in groups)
+    if n < 2 or len(groups) < 2:
+        return np.zeros(replicates)
+
+    # Haplotype -> group membership, and the pica2 group-pair distances (both triangles, hence the 2)
+    membership = np.zeros((n, len(groups)))
+    membership[np.arange(n), np.repeat(np.arange(len(groups)), [len(g) for g in groups])] = 1
+    rows, cols, similarity, has_data = representative_identity(matrix, groups)
+    group_dist = np.zeros((len(groups), len(groups)))
+    group_dist[rows[has_data], cols[has_data]] = 1 - similarity[has_data]
+    group_dist += group_dist.T
+
+    pi = run_replicates(_pi_block, (membership, group_dist), replicates, seed, threads)
+    return pi / sequence_length if sequence_length else pi
+
+
+def bootstrap_fst(matrix, idx_a, idx_b, replicates, seed, round_digits=None, threads=1):
+    """Bootstrap replicates of h-fst.py Hudson Fst, resampling populations A and B independently."""
+    if round_digits is not None:
+        matrix = matrix.rounded(round_digits)
+    idx_a, idx_b = disjoint_populations(idx_a, idx_b)
+    if len(idx_a) == 0 or len(idx_b) == 0:
+        return np.zeros(replicates)
+    arrays = distance_blocks(matrix, idx_a) + distance_blocks(matrix, idx_b) + distance_blocks(matrix, idx_a, idx_b)
+    return run_replicates(_fst_block, arrays, replicates, seed, threads)
+
+
+def percentile_interval(replicates, level=0.95):
+    """Percentile bootstrap interval (low, high); NaN without replicates."""
+    values = np.asarray(replicates, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return math.nan, math.nan
+    tail = 50 * (1 - level)
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def weighted_block_jackknife(numerators, denominators, weights):
+    """Delete-one-window jackknife of sum(numerators) / sum(denominators).
+
+    weights are the window sizes m_j. Returns (estimate, jackknife
+    estimate, standard error) following Busing et al. (1999); NaN for
+    fewer than two windows or a zero denominator.
+    """
+    num = np.asarray(numerators, dtype=np.float64)
+    den = np.asarray(denominators, dtype=np.float64)
+    m = np.asarray(weights, dtype=np.float64)
+    g = len(num)
+    if g < 2 or den.sum() == 0:
+        estimate = num.sum() / den.sum() if g and den.sum() != 0 else math.nan
+        return estimate, math.nan, math.nan
+
+    estimate = num.sum() / den.sum()
+    rest = den.sum() - den
+    leave_out = np.divide(num.sum() - num, rest, out=np.full(g, np.nan), where=rest != 0)
+    h = m.sum() / m
+    jackknife = g * estimate - ((1 - m / m.sum()) * leave_out).sum()
+    pseudo = h * estimate - (h - 1) * leave_out
+    variance = ((pseudo - jackknife) ** 2 / (h - 1)).sum() / g
+    return float(estimate), float(jackknife), float(math.sqrt(variance))
+
+
+def fmt(value):
+    return "NA" if not np.isfinite(value) else f"{value:.8f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Haplotype-bootstrap confidence interval of pi or Fst for one window')
+    parser.add_argument('similarity_file', help='impg similarity table of the window (gzip, .simx or - for stdin)')
+    parser.add_argument('-A', '--pop-a', help='Population A list: Hudson Fst (h-fst.py) instead of pi')
+    parser.add_argument('-B', '--pop-b', help='Population B list')
+    parser.add_argument('-u', '--subset', help='Haplotypes to compute pi for (default: all)')
+    parser.add_argument('-t', '--threshold', type=float, default=0.999,
+                        help='Grouping threshold of pica2.py pi (default: 0.999)')
+    parser.add_argument('-r', '--round-digits', type=int, help='Round identities to N decimals')
+    parser.add_argument('-l', '--sequence-length', type=int, help='Report pi per site of this length')
+    parser.add_argument('--replicates', type=int, default=1000, help='Bootstrap replicates (default: 1000)')
+    parser.add_argument('--level', type=float, default=0.95, help='Confidence level (default: 0.95)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='Processes drawing replicates (default: 1)')
+    args = parser.parse_args()
+
+    if args.replicates < 1 or args.threads < 1 or not 0 < args.level < 1:
+        print("Error: Need --replicates >= 1, -j >= 1 and 0 < --level < 1", file=sys.stderr)
+        sys.exit(1)
+    if bool(args.pop_a) != bool(args.pop_b):
+        print("Error: -A and -B must be given together", file=sys.stderr)
+        sys.exit(1)
+    try:
+        matrix = read_similarity_matrix(args.similarity_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    hfst = importlib.import_module('h-fst')
+    if args.pop_a:
+        resolved = hfst.PopulationResolver({'A': hfst.read_subset_file(args.pop_a),
+                                            'B': hfst.read_subset_file(args.pop_b)}).resolve(matrix.ids)
+        idx_a = np.array(resolved['A'][0], dtype=np.intp)
+        idx_b = np.array(resolved['B'][0], dtype=np.intp)
+        point = hfst.calculate_fst(matrix, set(matrix.names(idx_a)), set(matrix.names(idx_b)),
+                                   round_digits=args.round_digits)['fst']
+        replicates = bootstrap_fst(matrix, idx_a, idx_b, args.replicates, args.seed,
+                                   args.round_digits, args.threads)
+        statistic = 'FST'
+    else:
+        from pica2 import analyze_similarity_matrix
+        indices = np.arange(len(matrix), dtype=np.intp)
+        if args.subset:
+            resolved = hfst.PopulationResolver({'S': hfst.read_subset_file(args.subset)}).resolve(matrix.ids)
+            indices = np.array(resolved['S'][0], dtype=np.intp)
+        pi, pi_per_site = analyze_similarity_matrix(matrix, args.threshold, args.sequence_length,
+                                                    round_digits=args.round_digits, indices=indices)
+        point = pi_per_site if args.sequence_length else pi
+        replicates = bootstrap_pi(matrix, indices, args.threshold, args.replicates, args.seed,
+                                  args.round_digits, args.sequence_length, args.threads)
+        statistic = 'PI_PER_SITE' if args.sequence_length else 'PI'
+
+    low, high = percentile_interval(replicates, args.level)
+    print("STATISTIC\tESTIMATE\tREPLICATES\tSE\tLEVEL\tLOW\tHIGH")
+    print(statistic, fmt(point), args.replicates, fmt(float(np.std(replicates, ddof=1)) if args.replicates > 1 else math.nan),
+          args.level, fmt(low), fmt(high), sep='\t')
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,10 @@ set -euo pipefail
 PAF_FILE="../data/hprc465vschm13.aln.paf.gz"
 SEQUENCE_FILES="../data/HPRC_r2_assemblies_0.6.1.agc"
 REGION_PREFIX="CHM13#0#"
-LOG_DIR="./pica2_logs"
+LOG_DIR=""
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
-SCRIPT_PATH="${SCRIPT_DIR}/pica2.py"
+SCAN_SCRIPT="${SCRIPT_DIR}/scan.py"
 
 usage() {
     cat <<USAGE
@@ -26,14 +26,16 @@ Optional arguments:
   -p  PAF file for impg similarity (default: ${PAF_FILE})
   -s  Sequence files for impg similarity (default: ${SEQUENCE_FILES})
   -o  Write output table to file (default: stdout)
-  -d  Directory to store pica2 logs (default: ${LOG_DIR})
+  -d  Directory to store per-window pica2 logs (default: no logs)
   -P  Prefix to prepend to regions (default: ${REGION_PREFIX})
+  -j  Number of windows evaluated in parallel (default: 1)
+  -c  Directory caching per-window similarity matrices across runs (default: no cache)
   -h  Display this help message
 
 The script reproduces the workflow:
-  1. Compute pi in subset A (piA)
-  2. Compute pi in subset B (piB)
-  3. Merge subset lists (A ∪ B) to form subset C and compute piC
+  1. Merge subset lists (A ∪ B) to form subset C and run impg similarity once on C
+  2. Compute pi in subset A (piA) and subset B (piB) from the rows of the C matrix
+  3. Compute pi over the whole of subset C (piC)
   4. Report piA, piB, piC, average piAB = 0.5 * (piA + piB), and Fst = (piC - piAB) / piC per region
 USAGE
     exit 1
@@ -49,49 +51,9 @@ require_file() {
     fi
 }
 
-# Compute nucleotide diversity for a given subset
-compute_pi() {
-    local subset_file="$1"
-    local label="$2"
-    local result_var="$3"
-
-    local tmp_sim
-    tmp_sim=$(mktemp "tmp.${label}.XXXXXX")
-    tmpfiles+=("$tmp_sim")
-
-    local impg_cmd=(impg similarity -p "$PAF_FILE" -r "$REGION" --sequence-files "$SEQUENCE_FILES")
-    if [ -n "$subset_file" ]; then
-        impg_cmd+=(--subset-sequence-list "$subset_file")
-    fi
-
-    if ! "${impg_cmd[@]}" > "$tmp_sim"; then
-        echo "Error: impg similarity failed for subset ${label} in region ${REGION}" >&2
-        return 1
-    fi
-
-    local pica_output
-    if ! pica_output=$(python3 "$SCRIPT_PATH" "$tmp_sim" -t "$THRESHOLD" -l "$LENGTH" -r "$R_VALUE" -d "$LOG_DIR"); then
-        echo "Error: pica2.py failed for subset ${label} in region ${REGION}" >&2
-        echo "$pica_output" >&2
-        return 1
-    fi
-
-    local pi_value
-    pi_value=$(printf '%s\n' "$pica_output" | awk '{print $1}')
-    if [ -z "$pi_value" ]; then
-        echo "Error: Unable to parse pi value for subset ${label} in region ${REGION}" >&2
-        return 1
-    fi
-
-    printf -v "$result_var" '%s' "$pi_value"
-
-    rm -f "$tmp_sim"
-    return 0
-}
-
 OUTPUT_FILE=""
 
-while getopts "A:B:b:p:s:t:r:o:d:P:h" opt; do
+while getopts "A:B:b:p:s:t:r:o:d:P:j:c:h" opt; do
     case $opt in
         A) SUBSET_A_LIST="$OPTARG" ;;
         B) SUBSET_B_LIST="$OPTARG" ;;
@@ -103,6 +65,8 @@ while getopts "A:B:b:p:s:t:r:o:d:P:h" opt; do
         o) OUTPUT_FILE="$OPTARG" ;;
         d) LOG_DIR="$OPTARG" ;;
         P) REGION_PREFIX="$OPTARG" ;;
+        j) THREADS="$OPTARG" ;;
+        c) CACHE_DIR="$OPTARG" ;;
         h) usage ;;
         *) usage ;;
     esac
@@ -120,7 +84,7 @@ require_file "$SUBSET_B_LIST" "Subset list B"
 require_file "$BED_FILE" "BED file"
 require_file "$PAF_FILE" "PAF file"
 require_file "$SEQUENCE_FILES" "Sequence file"
-require_file "$SCRIPT_PATH" "pica2.py script"
+require_file "$SCAN_SCRIPT" "scan.py script"
 
 # Validate threshold and R value
 if ! [[ "$THRESHOLD" =~ ^[0-9]*\.?[0-9]+$ ]]; then
@@ -133,90 +97,25 @@ if ! [[ "$R_VALUE" =~ ^[0-9]+$ ]]; then
     exit 1
 fi
 
-# Prepare log directory
-mkdir -p "$LOG_DIR"
-
-# Track temporary files for cleanup
-declare -a tmpfiles=()
-trap 'for f in "${tmpfiles[@]:-}"; do [ -f "$f" ] && rm -f "$f"; done' EXIT
-
-# Build union list (subset C)
-UNION_LIST=$(mktemp tmp.union.XXXXXX)
-tmpfiles+=("$UNION_LIST")
-awk 'NF && !seen[$0]++' "$SUBSET_A_LIST" "$SUBSET_B_LIST" > "$UNION_LIST"
-
-if [ ! -s "$UNION_LIST" ]; then
-    echo "Error: Union subset list is empty" >&2
+if [ -n "${THREADS:-}" ] && ! [[ "$THREADS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: Number of threads must be a positive integer" >&2
     exit 1
 fi
 
-# Redirect output if requested
+# All windows are evaluated by a single scan.py process (-j: worker processes)
+scan_cmd=(python3 "$SCAN_SCRIPT" pica-fst -b "$BED_FILE" -A "$SUBSET_A_LIST" -B "$SUBSET_B_LIST"
+    -t "$THRESHOLD" -r "$R_VALUE" -p "$PAF_FILE" -s "$SEQUENCE_FILES" -P "$REGION_PREFIX")
 if [ -n "$OUTPUT_FILE" ]; then
-    exec > "$OUTPUT_FILE"
+    scan_cmd+=(-o "$OUTPUT_FILE")
+fi
+if [ -n "$LOG_DIR" ]; then
+    scan_cmd+=(-d "$LOG_DIR")
+fi
+if [ -n "${THREADS:-}" ]; then
+    scan_cmd+=(-j "$THREADS")
+fi
+if [ -n "${CACHE_DIR:-}" ]; then
+    scan_cmd+=(-c "$CACHE_DIR")
 fi
 
-echo -e "REGION\tLENGTH\tTHRESHOLD\tR_VALUE\tPI_A\tPI_B\tPI_C\tPI_AB_AVG\tFST"
-
-# Process each region in the BED file
-while IFS=$'\t' read -r chr start end rest; do
-    if [[ -z "$chr" || "$chr" == "#"* ]]; then
-        continue
-    fi
-
-    if [ -z "$start" ] || [ -z "$end" ]; then
-        echo "Warning: Incomplete BED entry for chromosome ${chr}, skipping" >&2
-        continue
-    fi
-
-    if ! [[ "$start" =~ ^[0-9]+$ && "$end" =~ ^[0-9]+$ ]]; then
-        echo "Warning: Non-integer coordinates in BED entry ${chr}\t${start}\t${end}, skipping" >&2
-        continue
-    fi
-
-    LENGTH=$((end - start))
-    if [ "$LENGTH" -le 0 ]; then
-        echo "Warning: Non-positive interval length for ${chr}:${start}-${end}, skipping" >&2
-        continue
-    fi
-
-    REGION="${REGION_PREFIX}${chr}:${start}-${end}"
-
-    if ! compute_pi "$SUBSET_A_LIST" "A" PI_A; then
-        echo "Warning: Skipping region ${REGION} due to errors with subset A" >&2
-        continue
-    fi
-
-    if ! compute_pi "$SUBSET_B_LIST" "B" PI_B; then
-        echo "Warning: Skipping region ${REGION} due to errors with subset B" >&2
-        continue
-    fi
-
-    if ! compute_pi "$UNION_LIST" "C" PI_C; then
-        echo "Warning: Skipping region ${REGION} due to errors with subset C" >&2
-        continue
-    fi
-
-    PI_AB_AVG=$(python3 - "$PI_A" "$PI_B" <<'PY'
-import sys
-pi_a = float(sys.argv[1])
-pi_b = float(sys.argv[2])
-print(f"{0.5 * (pi_a + pi_b):.8f}")
-PY
-    )
-
-    FST=$(python3 - "$PI_A" "$PI_B" "$PI_C" <<'PY'
-import sys
-pi_a = float(sys.argv[1])
-pi_b = float(sys.argv[2])
-pi_c = float(sys.argv[3])
-pi_ab = 0.5 * (pi_a + pi_b)
-if pi_c == 0:
-    print("NA")
-else:
-    print(f"{(pi_c - pi_ab) / pi_c:.8f}")
-PY
-    )
-
-    echo -e "${REGION}\t${LENGTH}\t${THRESHOLD}\t${R_VALUE}\t${PI_A}\t${PI_B}\t${PI_C}\t${PI_AB_AVG}\t${FST}"
-
-done < "$BED_FILE"
+exec "${scan_cmd[@]}"
@@ -8,8 +8,7 @@ SEQUENCE_FILES="../data/HPRC_r2_assemblies_0.6.1.agc"
 REGION_PREFIX="CHM13#0#"
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
-LOG_DIR="${SCRIPT_DI-o R}/fst_logs"
-FST_SCRIPT="${SCRIPT_DIR}/h-fst.py"
+SCAN_SCRIPT="${SCRIPT_DIR}/scan.py"
 
 usage() {
     cat <<USAGE
@@ -25,8 +24,12 @@ Optional arguments:
   -s  Sequence files for impg similarity (default: ${SEQUENCE_FILES})
   -r  Round similarities to N decimal places (optional)
   -o  Output file (default: stdout)
-  -d  Directory for log files (default: ${LOG_DIR})
+  -d  Directory for per-window log files (default: no logs)
   -P  Region prefix (default: ${REGION_PREFIX})
+  -j  Number of windows evaluated in parallel (default: 1)
+  -c  Directory caching per-window similarity matrices across runs (default: no cache)
+  -T  Also write a typed window table (.parquet with pyarrow, else TSV; see wintable.py)
+  -n  Add an empirical Fst p-value per window from N permutations of the A/B labels
   -v  Verbose output
   -h  Display this help message
 
@@ -49,57 +52,13 @@ require_file() {
     fi
 }
 
-# Process each genomic region
-process_region() {
-    local chr="$1"
-    local start="$2"
-    local end="$3"
-    local length=$((end - start))
-    local region="${REGION_PREFIX}${chr}:${start}-${end}"
-    
-    # Create temporary file for similarities
-    local tmp_sim
-    tmp_sim=$(mktemp "${TMPDIR:-/tmp}/run_h-fst.similarities.XXXXXX")
-    
-    # Get similarities for this region
-    local impg_cmd=(impg similarity -p "$PAF_FILE" -r "$region" --sequence-files "$SEQUENCE_FILES")
-    
-    if ! "${impg_cmd[@]}" > "$tmp_sim" 2>/dev/null; then
-        echo "Error: impg similarity failed for region ${region}" >&2
-        rm -f "$tmp_sim"
-        return 1
-    fi
-
-    # Calculate FST
-    local fst_cmd=(python3 "$FST_SCRIPT" "$tmp_sim" -a "$POP_A_FILE" -b "$POP_B_FILE" -l "$length" -d "$LOG_DIR")
-    
-    if [ -n "$ROUND_DIGITS" ]; then
-        fst_cmd+=(-r "$ROUND_DIGITS")
-    fi
-    
-    local fst_output
-    if ! fst_output=$("${fst_cmd[@]}" 2> >(cat >&2)); then
-        echo "Error: FST calculation failed for region ${region}" >&2
-        rm -f "$tmp_sim"
-        return 1
-    fi
-
-    # Parse output (FST, pi_A, pi_B, pi_XY, Dxy, Da)
-    IFS=$'\t' read -r fst pi_a pi_b pi_xy dxy da <<< "$fst_output"
-    
-    # Output results
-    echo -e "${region}\t${length}\t${fst}\t${pi_a}\t${pi_b}\t${pi_xy}\t${dxy}\t${da}"
-    
-    rm -f "$tmp_sim"
-    return 0
-}
-
 # Parse command line arguments
 OUTPUT_FILE=""
 ROUND_DIGITS=""
 VERBOSE=""
+LOG_DIR=""
 
-while getopts "A:B:b:p:s:r:o:d:P:vh" opt; do
+while getopts "A:B:b:p:s:r:o:d:P:j:c:T:n:vh" opt; do
     case $opt in
         A) POP_A_FILE="$OPTARG" ;;
         B) POP_B_FILE="$OPTARG" ;;
@@ -110,6 +69,10 @@ while getopts "A:B:b:p:s:r:o:d:P:vh" opt; do
         o) OUTPUT_FILE="$OPTARG" ;;
         d) LOG_DIR="$OPTARG" ;;
         P) REGION_PREFIX="$OPTARG" ;;
+        j) THREADS="$OPTARG" ;;
+        c) CACHE_DIR="$OPTARG" ;;
+        T) TABLE_FILE="$OPTARG" ;;
+        n) PERMUTATIONS="$OPTARG" ;;
         v) VERBOSE="1" ;;
         h) usage ;;
         *) usage ;;
@@ -128,7 +91,7 @@ require_file "$POP_B_FILE" "Population B file"
 require_file "$BED_FILE" "BED file"
 require_file "$PAF_FILE" "PAF file"
 require_file "$SEQUENCE_FILES" "Sequence file"
-require_file "$FST_SCRIPT" "fst.py script"
+require_file "$SCAN_SCRIPT" "scan.py script"
 
 # Validate round digits if provided
 if [ -n "$ROUND_DIGITS" ] && ! [[ "$ROUND_DIGITS" =~ ^[0-9]+$ ]]; then
@@ -136,68 +99,42 @@ if [ -n "$ROUND_DIGITS" ] && ! [[ "$ROUND_DIGITS" =~ ^[0-9]+$ ]]; then
     exit 1
 fi
 
-# Create log directory
-mkdir -p "$LOG_DIR"
-
-# Redirect output if requested
-if [ -n "$OUTPUT_FILE" ]; then
-    exec > "$OUTPUT_FILE"
+if [ -n "${THREADS:-}" ] && ! [[ "$THREADS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: Number of threads must be a positive integer" >&2
+    exit 1
 fi
 
-# Output header
-echo -e "REGION\tLENGTH\tFST\tPI_A\tPI_B\tPI_XY\tDXY\tDA"
-
-# Process each region in the BED file
-line_count=0
-success_count=0
-error_count=0
-
-while IFS=$'\t' read -r chr start end rest; do
-    ((line_count += 1))
-
-    # Skip comment lines
-    if [[ -z "$chr" || "$chr" == "#"* ]]; then
-        continue
-    fi
-
-    # Validate coordinates
-    if [ -z "$start" ] || [ -z "$end" ]; then
-        echo "Warning: Incomplete BED entry at line ${line_count}, skipping" >&2
-        ((error_count += 1))
-        continue
-    fi
-    
-    if ! [[ "$start" =~ ^[0-9]+$ && "$end" =~ ^[0-9]+$ ]]; then
-        echo "Warning: Non-integer coordinates at line ${line_count}: ${chr}:${start}-${end}, skipping" >&2
-        ((error_count += 1))
-        continue
-    fi
-    
-    # Validate interval
-    if [ "$start" -ge "$end" ]; then
-        echo "Warning: Invalid interval at line ${line_count}: ${chr}:${start}-${end}, skipping" >&2
-        ((error_count += 1))
-        continue
-    fi
-    
-    # Process the region
-    if [ -n "$VERBOSE" ]; then
-        echo "Processing region: ${chr}:${start}-${end}" >&2
-    fi
-    
-    if process_region "$chr" "$start" "$end"; then
-        ((success_count += 1))
-    else
-        ((error_count += 1))
-    fi
-    
-done < "$BED_FILE"
+if [ -n "${PERMUTATIONS:-}" ] && ! [[ "$PERMUTATIONS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: Number of permutations must be a positive integer" >&2
+    exit 1
+fi
 
-# Summary
+# All windows are evaluated by a single scan.py process (-j: worker processes)
+scan_cmd=(python3 "$SCAN_SCRIPT" fst -b "$BED_FILE" -A "$POP_A_FILE" -B "$POP_B_FILE"
+    -p "$PAF_FILE" -s "$SEQUENCE_FILES" -P "$REGION_PREFIX")
+if [ -n "$ROUND_DIGITS" ]; then
+    scan_cmd+=(-r "$ROUND_DIGITS")
+fi
+if [ -n "$OUTPUT_FILE" ]; then
+    scan_cmd+=(-o "$OUTPUT_FILE")
+fi
+if [ -n "$LOG_DIR" ]; then
+    scan_cmd+=(-d "$LOG_DIR")
+fi
 if [ -n "$VERBOSE" ]; then
-    echo "" >&2
-    echo "Summary:" >&2
-    echo "  Regions processed: ${success_count}" >&2
-    echo "  Regions failed: ${error_count}" >&2
-    echo "  Log directory: ${LOG_DIR}" >&2
+    scan_cmd+=(-v)
+fi
+if [ -n "${THREADS:-}" ]; then
+    scan_cmd+=(-j "$THREADS")
+fi
+if [ -n "${CACHE_DIR:-}" ]; then
+    scan_cmd+=(-c "$CACHE_DIR")
 fi
+if [ -n "${TABLE_FILE:-}" ]; then
+    scan_cmd+=(--table "$TABLE_FILE")
+fi
+if [ -n "${PERMUTATIONS:-}" ]; then
+    scan_cmd+=(--permutations "$PERMUTATIONS")
+fi
+
+exec "${scan_cmd[@]}"
@@ -1,44 +1,58 @@
 #!/usr/bin/env bash
 
-# Run a batch of h-fst comparisons across population panels.
+# Run h-fst comparisons across population panels.
+# Every window's similarity matrix is computed once and all population pairs
+# are evaluated from it (scan.py fst-panel); the long table is then split into
+# one file per pair.
 set -euo pipefail
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_ROOT="$(cd "${SCRIPT_DIR}/.." && pwd)"
-RUN_H_FST="${PROJECT_ROOT}/scripts/run_h-fst.sh"
+SCAN_SCRIPT="${PROJECT_ROOT}/scripts/scan.py"
 PAF_FILE="${PROJECT_ROOT}/../data/hprc465vschm13.aln.paf.gz"
 SEQUENCE_FILES="${PROJECT_ROOT}/../data/HPRC_r2_assemblies_0.6.1.agc"
 METADATA_DIR="${PROJECT_ROOT}/../metadata"
+PANEL_OUTPUT="panels.fst.tsv"
 
 usage() {
     cat <<USAGE
-Usage: $(basename "$0") [-b bed_file] [-p paf_file] [-s agc_file]
+Usage: $(basename "$0") [-b bed_file] [-p paf_file] [-s agc_file] [-j threads]
 
 Options:
   -b  BED file listing regions to process (default: region.bed in current directory)
   -p  Override the default PAF file (default: ${PAF_FILE})
   -s  Override the default AGC file (default: ${SEQUENCE_FILES})
+  -j  Number of windows evaluated in parallel (default: 1)
   -h  Show this help text and exit
 
-Outputs are written alongside your current working directory.
+Outputs are written alongside your current working directory: the long
+table ${PANEL_OUTPUT} (one row per window and population pair) and one
+file per pair (eur.afr.fst, ...).
 USAGE
 }
 
 BED_FILE="region.bed"
+THREADS="1"
 
-while getopts ":b:p:s:h" opt; do
+while getopts ":b:p:s:j:h" opt; do
     case "$opt" in
         b) BED_FILE="$OPTARG" ;;
         p) PAF_FILE="$OPTARG" ;;
         s) SEQUENCE_FILES="$OPTARG" ;;
+        j) THREADS="$OPTARG" ;;
         h) usage; exit 0 ;;
         :) echo "Error: -$OPTARG requires a value" >&2; usage; exit 1 ;;
         *) usage; exit 1 ;;
     esac
 done
 
-if [ ! -f "$RUN_H_FST" ]; then
-    echo "Error: run_h-fst.sh not found at $RUN_H_FST" >&2
+if [ ! -f "$SCAN_SCRIPT" ]; then
+    echo "Error: scan.py not found at $SCAN_SCRIPT" >&2
+    exit 1
+fi
+
+if ! [[ "$THREADS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: Number of threads must be a positive integer" >&2
     exit 1
 fi
 
@@ -70,26 +84,33 @@ pairs=(
     "AMR EAS amr.eas.fst"
 )
 
-for entry in "${pairs[@]}"; do
-    read -r group_a group_b output_file <<<"$entry"
-    subset_a="${METADATA_DIR}/agc.${group_a}"
-    subset_b="${METADATA_DIR}/agc.${group_b}"
-
-    if [ ! -f "$subset_a" ]; then
-        echo "Error: subset list not found: $subset_a" >&2
-        exit 1
-    fi
-    if [ ! -f "$subset_b" ]; then
-        echo "Error: subset list not found: $subset_b" >&2
+populations=()
+for group in EUR AFR EAS SAS AMR; do
+    subset="${METADATA_DIR}/agc.${group}"
+    if [ ! -f "$subset" ]; then
+        echo "Error: subset list not found: $subset" >&2
         exit 1
     fi
+    populations+=(-g "${group}=${subset}")
+done
 
+echo "[h-fst] EUR AFR EAS SAS AMR panel -> ${PANEL_OUTPUT}"
+python3 "$SCAN_SCRIPT" fst-panel \
+    -p "$PAF_FILE" \
+    -s "$SEQUENCE_FILES" \
+    -b "$BED_FILE" \
+    -j "$THREADS" \
+    "${populations[@]}" \
+    -o "$PANEL_OUTPUT"
+
+# Split the long table into the per-pair tables (REGION LENGTH FST PI_A PI_B PI_XY DXY DA),
+# swapping PI_A/PI_B where the panel lists the pair the other way round
+for entry in "${pairs[@]}"; do
+    read -r group_a group_b output_file <<<"$entry"
     echo "[h-fst] ${group_a} vs ${group_b} -> ${output_file}"
-    "${RUN_H_FST}" \
-        -p "$PAF_FILE" \
-        -s "$SEQUENCE_FILES" \
-        -b "$BED_FILE" \
-        -A "$subset_a" \
-        -B "$subset_b" \
-        -o "$output_file"
+    awk -F'\t' -v OFS='\t' -v a="$group_a" -v b="$group_b" '
+        NR == 1 { print "REGION", "LENGTH", "FST", "PI_A", "PI_B", "PI_XY", "DXY", "DA"; next }
+        $3 == a && $4 == b { print $1, $2, $5, $6, $7, $8, $9, $10 }
+        $3 == b && $4 == a { print $1, $2, $5, $7, $6, $8, $9, $10 }
+    ' "$PANEL_OUTPUT" > "$output_file"
 done
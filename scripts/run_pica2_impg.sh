@@ -7,7 +7,7 @@ PAF_FILE="../data/hprc465vschm13.aln.paf.gz"
 SEQUENCE_FILES="../data/HPRC_r2_assemblies_0.6.1.agc"
 REGION_PREFIX="CHM13#0#"
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
-SCRIPT_PATH="${SCRIPT_DIR}/pica2.py"
+SCAN_SCRIPT="${SCRIPT_DIR}/scan.py"
 
 # Display usage information
 usage() {
@@ -16,10 +16,16 @@ Usage: $0 -b <bed_file> -t <threshold> -r <r_value> [options]
   -b  BED file containing regions (required)
   -p  PAF file for impg similarity (default: ${PAF_FILE})
   -s  Sequence files for impg similarity (default: ${SEQUENCE_FILES})
-  -u  File with assemblies to subset (passed to --subset-sequence-list)
+  -u  File with assemblies to subset (passed to --subset-sequence-list).
+      Repeat -u to get one pi column per list from a single full-cohort
+      impg run per window
   -l  Override sequence length passed to pica2.py
   -o  Write output table to file (default: stdout)
   -P  Region prefix for impg (default: ${REGION_PREFIX})
+  -d  Directory for per-window pica2 logs (default: no logs)
+  -j  Number of windows evaluated in parallel (default: 1)
+  -c  Directory caching per-window similarity matrices across runs (default: no cache)
+  -T  Also write a typed window table (.parquet with pyarrow, else TSV; see wintable.py)
 
   pica2 options:
     -t  Similarity threshold for pica2.py (required)
@@ -29,22 +35,28 @@ Usage: $0 -b <bed_file> -t <threshold> -r <r_value> [options]
 
 Example:
   $0 -b ackr1.win.bed -t 0.999 -r 4 -u ../metadata/agc.EUR
+  $0 -b ackr1.win.bed -t 0.999 -r 4 -u ../metadata/agc.EUR -u ../metadata/agc.AFR
 USAGE
     exit 1
 }
 
 # Parse command line options
-while getopts "b:t:r:p:s:u:l:o:P:h" opt; do
+SUBSET_LISTS=()
+while getopts "b:t:r:p:s:u:l:o:P:d:j:c:T:h" opt; do
     case $opt in
         b) BED_FILE="$OPTARG" ;;
         t) THRESHOLD="$OPTARG" ;;
         r) R_VALUE="$OPTARG" ;;
         p) PAF_FILE="$OPTARG" ;;
         s) SEQUENCE_FILES="$OPTARG" ;;
-        u) SUBSET_LIST="$OPTARG" ;;
+        u) SUBSET_LISTS+=("$OPTARG") ;;
         l) SEQUENCE_LENGTH="$OPTARG" ;;
         o) OUTPUT_FILE="$OPTARG" ;;
         P) REGION_PREFIX="$OPTARG" ;;
+        j) THREADS="$OPTARG" ;;
+        c) CACHE_DIR="$OPTARG" ;;
+        T) TABLE_FILE="$OPTARG" ;;
+        d) LOG_DIR="$OPTARG" ;;
         h) usage ;;
         *) usage ;;
     esac
@@ -72,10 +84,12 @@ if [ ! -f "$SEQUENCE_FILES" ]; then
     exit 1
 fi
 
-if [ -n "${SUBSET_LIST:-}" ] && [ ! -f "$SUBSET_LIST" ]; then
-    echo "Error: Subset list '$SUBSET_LIST' not found" >&2
-    exit 1
-fi
+for subset_list in ${SUBSET_LISTS[@]+"${SUBSET_LISTS[@]}"}; do
+    if [ ! -f "$subset_list" ]; then
+        echo "Error: Subset list '$subset_list' not found" >&2
+        exit 1
+    fi
+done
 
 if [ -n "${SEQUENCE_LENGTH:-}" ]; then
     if ! [[ "$SEQUENCE_LENGTH" =~ ^[0-9]+$ ]]; then
@@ -100,93 +114,39 @@ if ! [[ "$R_VALUE" =~ ^[0-9]+$ ]]; then
     exit 1
 fi
 
-# Ensure temporary files are removed even on failure
-tmpfiles=()
-cleanup() {
-    for f in "${tmpfiles[@]}"; do
-        [ -f "$f" ] && rm -f "$f"
-    done
-}
-trap cleanup EXIT
-
-# Print table header
-if [ -n "${OUTPUT_FILE:-}" ]; then
-    exec > "$OUTPUT_FILE"
+if [ ! -f "$SCAN_SCRIPT" ]; then
+    echo "Error: scan.py script '$SCAN_SCRIPT' not found" >&2
+    exit 1
 fi
 
-if [ -n "${SUBSET_LIST:-}" ]; then
-    SUBSET_LABEL=$(basename "$SUBSET_LIST")
-    echo -e "REGION\tSUBSET\tLENGTH\tTHRESHOLD\tR_VALUE\tPICA_OUTPUT"
-else
-    SUBSET_LABEL=""
-    echo -e "REGION\tLENGTH\tTHRESHOLD\tR_VALUE\tPICA_OUTPUT"
+if [ -n "${THREADS:-}" ] && ! [[ "$THREADS" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: Number of threads must be a positive integer" >&2
+    exit 1
 fi
 
-# Process each window in the BED file
-while IFS=$'\t' read -r chr start end name; do
-    # Skip comments or empty rows
-    if [[ -z "$chr" || "$chr" == "#"* ]]; then
-        continue
-    fi
-
-    # Compute window length
-    LENGTH=$((end - start))
-    if [ "$LENGTH" -le 0 ]; then
-        echo "Warning: Skipping region with non-positive length: $chr:$start-$end" >&2
-        continue
-    fi
-
-    if [ -n "$REGION_PREFIX" ]; then
-        # Avoid duplicating prefix when BED entries already carry it
-        case "$chr" in
-            "$REGION_PREFIX"*)
-                REGION="${chr}:${start}-${end}"
-                ;;
-            *)
-                REGION="${REGION_PREFIX}${chr}:${start}-${end}"
-                ;;
-        esac
-    else
-        REGION="${chr}:${start}-${end}"
-    fi
-    tmp_sim=$(mktemp tmp.sim.XXXXXX)
-    tmpfiles+=("$tmp_sim")
-
-    # Determine length passed to pica2 (override if provided)
-    EFFECTIVE_LENGTH="$LENGTH"
-    if [ -n "${SEQUENCE_LENGTH:-}" ]; then
-        EFFECTIVE_LENGTH="$SEQUENCE_LENGTH"
-    fi
-
-    # Build impg command
-    impg_cmd=(impg similarity -p "$PAF_FILE" -r "$REGION" --sequence-files "$SEQUENCE_FILES")
-    if [ -n "${SUBSET_LIST:-}" ]; then
-        impg_cmd+=(--subset-sequence-list "$SUBSET_LIST")
-    fi
-
-    # Step 1: Generate similarity matrix via impg
-    if ! "${impg_cmd[@]}" > "$tmp_sim" 2>/dev/null; then
-        echo "Error: impg similarity failed for region $REGION" >&2
-        rm -f "$tmp_sim"
-        continue
-    fi
-
-    # Step 2: Evaluate nucleotide diversity for the window
-    if ! PICA_RAW=$(python3 "$SCRIPT_PATH" "$tmp_sim" -t "$THRESHOLD" -l "$EFFECTIVE_LENGTH" -r "$R_VALUE" 2>&1); then
-        echo "Error: pica2.py failed for region $REGION" >&2
-        echo "$PICA_RAW" >&2
-        rm -f "$tmp_sim"
-        continue
-    fi
-
-    PICA_OUTPUT=$(echo "$PICA_RAW" | tr '\n' ' ' | sed 's/  */ /g' | sed 's/ *$//')
-
-    if [ -n "${SUBSET_LIST:-}" ]; then
-        echo -e "${REGION}\t${SUBSET_LABEL}\t${EFFECTIVE_LENGTH}\t${THRESHOLD}\t${R_VALUE}\t${PICA_OUTPUT}"
-    else
-        echo -e "${REGION}\t${EFFECTIVE_LENGTH}\t${THRESHOLD}\t${R_VALUE}\t${PICA_OUTPUT}"
-    fi
-
-    rm -f "$tmp_sim"
+# All windows are evaluated by a single scan.py process (-j: worker processes)
+scan_cmd=(python3 "$SCAN_SCRIPT" pi -b "$BED_FILE" -t "$THRESHOLD" -r "$R_VALUE"
+    -p "$PAF_FILE" -s "$SEQUENCE_FILES" -P "$REGION_PREFIX")
+for subset_list in ${SUBSET_LISTS[@]+"${SUBSET_LISTS[@]}"}; do
+    scan_cmd+=(-u "$subset_list")
+done
+if [ -n "${SEQUENCE_LENGTH:-}" ]; then
+    scan_cmd+=(-l "$SEQUENCE_LENGTH")
+fi
+if [ -n "${OUTPUT_FILE:-}" ]; then
+    scan_cmd+=(-o "$OUTPUT_FILE")
+fi
+if [ -n "${LOG_DIR:-}" ]; then
+    scan_cmd+=(-d "$LOG_DIR")
+fi
+if [ -n "${THREADS:-}" ]; then
+    scan_cmd+=(-j "$THREADS")
+fi
+if [ -n "${CACHE_DIR:-}" ]; then
+    scan_cmd+=(-c "$CACHE_DIR")
+fi
+if [ -n "${TABLE_FILE:-}" ]; then
+    scan_cmd+=(--table "$TABLE_FILE")
+fi
 
-done < "$BED_FILE"
+exec "${scan_cmd[@]}"
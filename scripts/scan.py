@@ -0,0 +1,828 @@
+#!/usr/bin/env python3
+"""
+scan.py - Evaluate pi, Fst or Tajima's D over every window of a BED file
+
+The run_*.sh wrappers used to start a new python3 process and write a
+temporary similarity file for every BED line. This driver reads the BED
+once, keeps pica2.py / h-fst.py / tj_d.py loaded, streams each window's
+`impg similarity` output straight into them and writes a single table.
+
+Modes (same output columns as the corresponding wrapper):
+  pi        run_pica2_impg.sh   REGION [SUBSET] LENGTH THRESHOLD R_VALUE PICA_OUTPUT
+            (with several -u lists: REGION LENGTH THRESHOLD R_VALUE PI_<list>...,
+            every list sliced from one full-cohort impg run per window)
+  fst       run_h-fst.sh        REGION LENGTH FST PI_A PI_B PI_XY DXY DA
+  fst-panel run_h_fst_panels.sh REGION LENGTH POP_A POP_B FST PI_A PI_B PI_XY DXY DA
+            (every population pair of a panel from one matrix, one row per pair)
+  pica-fst  run_fst_impg.sh     REGION LENGTH THRESHOLD R_VALUE PI_A PI_B PI_C PI_AB_AVG FST
+            (one impg run over A+B per window, A and B sliced in memory)
+  tajd      run_tajd.sh         REGION LENGTH SAMPLES SEGREGATING_SITES PI TAJIMAS_D
+            (S counted from the impg query GFA in process, or with odgi/povu)
+
+With -j N, windows are evaluated by N worker processes; rows are still
+written in BED order. With -c DIR, each window's similarity matrix is kept
+in a binary on-disk cache (simcache.py), so later scans of the same windows
+with other thresholds, rounding or statistics skip impg entirely.
+With --sparse auto|always, windows where most pairs are missing are held
+as sparse matrices; with --coverage (pi, fst, fst-panel), the reported
+and missing sequence pairs behind each value are added as columns.
+With --table FILE, the rows are also written as a typed columnar table
+(wintable.py: Parquet for FILE.parquet, TSV otherwise).
+With --log-jsonl FILE, one JSON object per window (status, timing and the
+values behind each statistic) is written to FILE in BED order;
+--log-level trims the per-window text logs of -d.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from calclog import LEVELS, CalcLog
+from simmatrix import diversity, read_similarity_matrix
+from simcache import MatrixCache, cache_key
+from pica2 import analyze_similarity_matrix
+from resample import (bootstrap_fst, bootstrap_pi, percentile_interval, permutation_fst, permutation_p_value,
+                      weighted_block_jackknife)
+from tj_d import tajimas_d
+from wintable import WindowTableWriter
+from gfa_sites import count_variant_sites, read_gfa_paths
+
+hfst = importlib.import_module('h-fst')
+
+PAF_FILE = "../data/hprc465vschm13.aln.paf.gz"
+SEQUENCE_FILES = "../data/HPRC_r2_assemblies_0.6.1.agc"
+REGION_PREFIX = "CHM13#0#"
+
+# --sparse choices -> sparse argument of read_similarity_matrix()
+SPARSE = {'never': False, 'auto': 'auto', 'always': True}
+
+# Reported and missing pair columns of --coverage (fst, fst-panel)
+COVERAGE_COLUMNS = ['PAIRS_A', 'MISSING_A', 'PAIRS_B', 'MISSING_B', 'PAIRS_AB', 'MISSING_AB']
+
+
+# Scan options held by each process-pool worker (see init_worker)
+_worker_args = None
+
+
+class WindowError(Exception):
+    """Raised when a single window cannot be evaluated; the scan continues."""
+
+
+def read_bed(filename):
+    """Yield (chrom, start, end) for every valid BED entry, warning about the rest."""
+    with open(filename) as handle:
+        for line_number, line in enumerate(handle, start=1):
+            fields = line.rstrip('\n').split('\t')
+            chrom = fields[0]
+            if not chrom or chrom.startswith('#'):
+                continue
+            if len(fields) < 3 or not fields[1] or not fields[2]:
+                print(f"Warning: Incomplete BED entry at line {line_number}, skipping", file=sys.stderr)
+                continue
+            start, end = fields[1], fields[2]
+            if not (start.isdigit() and end.isdigit()):
+                print(f"Warning: Non-integer coordinates at line {line_number}: {chrom}:{start}-{end}, skipping",
+                      file=sys.stderr)
+                continue
+            start, end = int(start), int(end)
+            if start >= end:
+                print(f"Warning: Invalid interval at line {line_number}: {chrom}:{start}-{end}, skipping",
+                      file=sys.stderr)
+                continue
+            yield chrom, start, end
+
+
+def format_region(prefix, chrom, start, end):
+    """Build the impg region name, avoiding a duplicated prefix."""
+    if prefix and not chrom.startswith(prefix):
+        chrom = f"{prefix}{chrom}"
+    return f"{chrom}:{start}-{end}"
+
+
+def read_sample_list(filename):
+    """Read a subset list, ignoring blank lines and comments."""
+    with open(filename) as handle:
+        return [line.strip() for line in handle if line.strip() and not line.startswith('#')]
+
+
+def impg_similarity(args, region, subset=None):
+    """Similarity matrix for one region, from the --cache-dir cache or from impg.
+
+    The cache holds unrounded matrices, so one entry serves every -r value.
+    """
+    if args.cache is None:
+        return run_impg_similarity(args, region, subset, args.round_digits)
+
+    key = cache_key(args.paf, args.sequence_files, region, subset)
+    matrix = args.cache.get(key, SPARSE[args.sparse])
+    if matrix is None:
+        matrix = run_impg_similarity(args, region, subset, None)
+        args.cache.put(key, matrix)
+    return matrix if args.round_digits is None else matrix.rounded(args.round_digits)
+
+
+def run_impg_similarity(args, region, subset, round_digits):
+    """Run impg similarity for one region and parse its output as it streams in."""
+    cmd = ['impg', 'similarity', '-p', args.paf, '-r', region, '--sequence-files', args.sequence_files]
+    if subset:
+        cmd += ['--subset-sequence-list', subset]
+
+    stderr = None if args.verbose else subprocess.DEVNULL
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+    except OSError as e:
+        raise WindowError(f"impg similarity failed for region {region}: {e}")
+
+    with proc:
+        parse_error = None
+        try:
+            matrix = read_similarity_matrix(proc.stdout, round_digits=round_digits, skip_invalid=True,
+                                            sparse=SPARSE[args.sparse])
+        except ValueError as e:
+            parse_error = e
+            proc.stdout.read()
+    if proc.returncode != 0:
+        raise WindowError(f"impg similarity failed for region {region}")
+    if parse_error is not None:
+        raise WindowError(f"Unable to parse impg similarity output for region {region}: {parse_error}")
+    return matrix
+
+
+def open_window_log(args, region, suffix, record, key):
+    """CalcLog for one calculation of a window.
+
+    Text goes to a per-window file when --log-dir was given; structured
+    values go to record[key] when --log-jsonl was given. Without either,
+    the log is disabled and costs nothing.
+    """
+    handle = None
+    if args.log_dir:
+        safe_region = re.sub(r'[^\w.-]', '_', region)
+        handle = open(os.path.join(args.log_dir, f"{safe_region}{suffix}.log"), 'w')
+        handle.write(f"Region: {region}\n\n")
+    fields = record.setdefault(key, {}) if args.log_jsonl else None
+    return CalcLog(handle, LEVELS[args.log_level], fields)
+
+
+def window_pi(args, matrix, region, length, label, record, indices=None):
+    """pica2.py pi per site for a window (optionally for a subset of its sequences)."""
+    log = open_window_log(args, region, f".{label}" if label else "", record, label or 'pi')
+    try:
+        _, pi_per_site = analyze_similarity_matrix(
+            matrix,
+            threshold=args.threshold,
+            sequence_length=length,
+            log_file=log,
+            round_digits=args.round_digits,
+            indices=indices,
+        )
+    finally:
+        log.close()
+    return pi_per_site
+
+
+# Per-mode window evaluation: each returns the output rows (lists of fields) for one region,
+# and fills record with the structured values of its calculations (--log-jsonl)
+
+def run_pi(args, chrom, start, end, record):
+    region = format_region(args.prefix, chrom, start, end)
+    length = args.length or (end - start)
+    if len(args.subsets) > 1:
+        return run_pi_subsets(args, region, length, record)
+    matrix = impg_similarity(args, region, args.subset)
+    pi_per_site = window_pi(args, matrix, region, length, None, record)
+
+    fields = [region]
+    if args.subset:
+        fields.append(os.path.basename(args.subset))
+    fields += [length, args.threshold, args.round_digits, pi_per_site]
+    fields += pi_resampling(args, matrix, region, length, 'PI', pi_per_site, np.arange(len(matrix)), record)
+    if args.coverage:
+        fields += pair_coverage(matrix, np.arange(len(matrix)))
+    return [fields]
+
+
+def pair_coverage(matrix, indices):
+    """Reported and missing pairs among indices (--coverage)."""
+    _, pairs, missing = diversity(matrix, indices)
+    return [pairs, missing]
+
+
+def run_pi_subsets(args, region, length, record):
+    """pi for every -u list, sliced out of one full-cohort matrix."""
+    matrix = impg_similarity(args, region)
+    fields = [region, length, args.threshold, args.round_digits]
+    for name, (positions, _) in args.resolver.resolve(matrix.ids).items():
+        if len(positions) < 2:
+            fields += [None] * (3 if args.bootstrap else 1)
+            if args.coverage:
+                fields += [0, 0]
+            continue
+        indices = np.array(positions, dtype=np.intp)
+        pi_per_site = window_pi(args, matrix, region, length, name, record, indices)
+        fields.append(pi_per_site)
+        fields += pi_resampling(args, matrix, region, length, f"PI_{name}", pi_per_site, indices, record)
+        if args.coverage:
+            fields += pair_coverage(matrix, indices)
+    return [fields]
+
+
+def run_fst(args, chrom, start, end, record):
+    region = format_region(args.prefix, chrom, start, end)
+    length = end - start
+    matrix = impg_similarity(args, region)
+
+    resolved = args.resolver.resolve(matrix.ids)
+    (idx_a, missing_a), (idx_b, missing_b) = resolved['A'], resolved['B']
+    pop_a, pop_b = set(matrix.names(idx_a)), set(matrix.names(idx_b))
+    if args.verbose:
+        for label, missing in (('A', missing_a), ('B', missing_b)):
+            if missing:
+                print(f"Warning: {len(missing)} identifiers from population {label} "
+                      f"did not match any sequences in {region}", file=sys.stderr)
+    if not pop_a or not pop_b:
+        raise WindowError(f"No valid sequences found in one or both populations for region {region}")
+
+    log = open_window_log(args, region, "_fst", record, 'fst')
+    try:
+        results = hfst.calculate_fst(matrix, pop_a, pop_b, sequence_length=length,
+                                     round_digits=args.round_digits, log_file=log)
+    finally:
+        log.close()
+
+    fields = [region, length] + [results[key] for key in ('fst', 'pi_a', 'pi_b', 'pi_xy', 'dxy', 'da')]
+    if args.bootstrap:
+        replicates = bootstrap_fst(matrix, idx_a, idx_b, args.bootstrap, window_seed(args, region), args.round_digits)
+        fields += list(percentile_interval(replicates, args.level))
+    if args.permutations:
+        observed, null = permutation_fst(matrix, idx_a, idx_b, args.permutations, window_seed(args, region),
+                                         args.round_digits)
+        fields.append(permutation_p_value(observed, null))
+    if args.jackknife:
+        # Hudson Fst over the scan is the ratio of summed Da and Dxy
+        record.setdefault('jackknife', {})['FST'] = [results['da'] * length, results['dxy'] * length, end - start]
+    if args.coverage:
+        fields += [results[column.lower()] for column in COVERAGE_COLUMNS]
+    return [fields]
+
+
+def window_seed(args, region):
+    """Bootstrap seed of a window: the same for a region whatever the BED order or -j."""
+    return [args.seed, zlib.crc32(region.encode())]
+
+
+def pi_resampling(args, matrix, region, length, label, pi_per_site, indices, record):
+    """Bootstrap interval fields of a pi value (--bootstrap) and its jackknife terms (--jackknife)."""
+    fields = []
+    if args.bootstrap:
+        replicates = bootstrap_pi(matrix, indices, args.threshold, args.bootstrap, window_seed(args, region),
+                                  args.round_digits, length)
+        fields = list(percentile_interval(replicates, args.level))
+    if args.jackknife:
+        # pi per site over the scan is total pi over total length
+        record.setdefault('jackknife', {})[label] = [pi_per_site * length, length, length]
+    return fields
+
+
+def run_fst_panel(args, chrom, start, end, record):
+    region = format_region(args.prefix, chrom, start, end)
+    length = end - start
+    matrix = impg_similarity(args, region)
+
+    populations = {}
+    for name, (positions, _) in args.resolver.resolve(matrix.ids).items():
+        if positions:
+            populations[name] = set(matrix.names(positions))
+        elif args.verbose:
+            print(f"Warning: No valid sequences found for population {name} in {region}", file=sys.stderr)
+    if len(populations) < 2:
+        raise WindowError(f"Fewer than two populations with valid sequences for region {region}")
+
+    log = open_window_log(args, region, "_fst_panel", record, 'fst_panel')
+    try:
+        results = hfst.calculate_panel_fst(matrix, populations, sequence_length=length,
+                                           round_digits=args.round_digits, log_file=log)
+    finally:
+        log.close()
+
+    return [[region, length, row['pop_a'], row['pop_b']]
+            + [row[key] for key in ('fst', 'pi_a', 'pi_b', 'pi_xy', 'dxy', 'da')]
+            + ([row[column.lower()] for column in COVERAGE_COLUMNS] if args.coverage else [])
+            for row in results]
+
+
+def run_pica_fst(args, chrom, start, end, record):
+    region = format_region(args.prefix, chrom, start, end)
+    length = end - start
+
+    # One impg run over the union list C; A and B are sliced out of it in memory
+    matrix = impg_similarity(args, region, args.union_list)
+    resolved = args.resolver.resolve(matrix.ids)
+    idx_a = np.array(resolved['A'][0], dtype=np.intp)
+    idx_b = np.array(resolved['B'][0], dtype=np.intp)
+
+    pi_a = window_pi(args, matrix, region, length, 'A', record, idx_a)
+    pi_b = window_pi(args, matrix, region, length, 'B', record, idx_b)
+    pi_c = window_pi(args, matrix, region, length, 'C', record)
+
+    pi_ab = 0.5 * (pi_a + pi_b)
+    fst = None if pi_c == 0 else (pi_c - pi_ab) / pi_c
+    return [[region, length, args.threshold, args.round_digits, pi_a, pi_b, pi_c, pi_ab, fst]]
+
+
+def count_segregating_sites(args, region):
+    """S for a window: variant sites of the impg query GFA, counted in process (gfa_sites.py)."""
+    query = subprocess.Popen(['impg', 'query', '-p', args.paf, '-r', region,
+                              '--sequence-files', args.sequence_files, '-o', 'gfa'],
+                             stdout=subprocess.PIPE, text=True)
+    error = None
+    with query:
+        try:
+            count = count_variant_sites(read_gfa_paths(query.stdout), args.reference)
+        except ValueError as e:
+            error = e
+        finally:
+            query.stdout.read()
+    # A failed query leaves an empty graph; report the query, not the missing reference
+    if query.returncode != 0:
+        raise WindowError(f"impg query failed for region {region}")
+    if error is not None:
+        raise WindowError(f"{error} for region {region}")
+    return count
+
+
+def count_segregating_sites_povu(args, region):
+    """S for a window: impg query -> odgi build/sort/view -> povu gfa2vcf, counting VCF records."""
+    # Each worker process gets its own scratch directory
+    workdir = os.path.join(args.workdir, str(os.getpid()))
+    os.makedirs(workdir, exist_ok=True)
+    raw_gfa = os.path.join(workdir, 'raw.gfa')
+    raw_og = os.path.join(workdir, 'raw.og')
+    sorted_gfa = os.path.join(workdir, 'sorted.gfa')
+
+    with open(raw_gfa, 'w') as out:
+        query = ['impg', 'query', '-p', args.paf, '-r', region, '--sequence-files', args.sequence_files, '-o', 'gfa']
+        if subprocess.run(query, stdout=out).returncode != 0:
+            raise WindowError(f"impg query failed for region {region}")
+
+    if subprocess.run(['odgi', 'build', '-g', raw_gfa, '-o', raw_og],
+                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+        raise WindowError(f"odgi build failed for region {region}")
+
+    with open(sorted_gfa, 'w') as out:
+        sort = subprocess.Popen(['odgi', 'sort', '-i', raw_og, '-o', '-'],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        view = subprocess.run(['odgi', 'view', '-i', '-', '-g'], stdin=sort.stdout, stdout=out)
+        sort.stdout.close()
+        if sort.wait() != 0 or view.returncode != 0:
+            raise WindowError(f"odgi sort/view failed for region {region}")
+
+    povu = subprocess.Popen(['povu', 'gfa2vcf', '-i', sorted_gfa, '--stdout', args.reference],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    with povu:
+        count = sum(1 for line in povu.stdout if not line.startswith('#'))
+    if povu.returncode != 0:
+        raise WindowError(f"Failed to determine segregating sites for {region}")
+    return count
+
+
+def run_tajd(args, chrom, start, end, record):
+    region = format_region(args.prefix, chrom, start, end)
+    length = end - start
+
+    if args.sites == 'povu':
+        s_count = count_segregating_sites_povu(args, region)
+    else:
+        s_count = count_segregating_sites(args, region)
+    matrix = impg_similarity(args, region, args.sample_list)
+    pi_per_site = window_pi(args, matrix, region, length, None, record)
+    # D from pi as printed with 8 decimals, as run_tajd.sh computed it
+    pi = float(f"{pi_per_site:.8f}")
+
+    d, parts = tajimas_d(args.sample_count, s_count, pi, return_components=True)
+    if args.log_jsonl:
+        record['tajd'] = {'samples': args.sample_count, 'segregating_sites': s_count, 'sites_method': args.sites,
+                          'pi': pi, 'tajimas_d': None if math.isnan(d) else d}
+    # THETA_W, D_NUMERATOR and D_DENOMINATOR go to the --table window table only
+    return [[region, length, args.sample_count, s_count, pi_per_site, None if math.isnan(d) else d,
+             s_count / parts.a1, parts.numerator, parts.denominator]]
+
+
+MODES = {
+    'pi': run_pi,
+    'fst': run_fst,
+    'fst-panel': run_fst_panel,
+    'pica-fst': run_pica_fst,
+    'tajd': run_tajd,
+}
+
+HEADERS = {
+    'fst': ['REGION', 'LENGTH', 'FST', 'PI_A', 'PI_B', 'PI_XY', 'DXY', 'DA'],
+    'fst-panel': ['REGION', 'LENGTH', 'POP_A', 'POP_B', 'FST', 'PI_A', 'PI_B', 'PI_XY', 'DXY', 'DA'],
+    'pica-fst': ['REGION', 'LENGTH', 'THRESHOLD', 'R_VALUE', 'PI_A', 'PI_B', 'PI_C', 'PI_AB_AVG', 'FST'],
+    'tajd': ['REGION', 'LENGTH', 'SAMPLES', 'SEGREGATING_SITES', 'PI', 'TAJIMAS_D'],
+}
+
+
+# Columns written to the --table window table after those of header_for()
+TABLE_ONLY_COLUMNS = {
+    'tajd': ['THETA_W', 'D_NUMERATOR', 'D_DENOMINATOR'],
+}
+
+# Text formats of float columns; other floats are printed with 8 decimals
+TEXT_FORMATS = {
+    'THRESHOLD': '{}',
+    'TAJIMAS_D': '{}',
+    'FST_P': '{:.6g}',
+}
+
+
+def format_field(name, value, row):
+    """Text of one output value; row (column -> value) supplies LENGTH for PICA_OUTPUT."""
+    if value is None:
+        return "NA"
+    if name == 'PICA_OUTPUT':
+        return f"{value:.8f} (sequence length: {row['LENGTH']})"
+    if isinstance(value, (float, np.floating)):
+        return TEXT_FORMATS.get(name, '{:.8f}').format(value)
+    return str(value)
+
+
+def format_row(header, fields):
+    """Text fields of one mode row (values follow header; table-only values are dropped)."""
+    row = dict(zip(header, fields))
+    return [format_field(name, value, row) for name, value in row.items()]
+
+
+def header_for(args):
+    bootstrap = getattr(args, 'bootstrap', None)
+    if args.mode == 'pi' and len(args.subsets) > 1:
+        columns = ['REGION', 'LENGTH', 'THRESHOLD', 'R_VALUE']
+        for name in args.resolver.populations:
+            columns += [f"PI_{name}", f"PI_{name}_LOW", f"PI_{name}_HIGH"] if bootstrap else [f"PI_{name}"]
+            if args.coverage:
+                columns += [f"PAIRS_{name}", f"MISSING_{name}"]
+        return columns
+    if args.mode == 'pi':
+        columns = ['REGION', 'LENGTH', 'THRESHOLD', 'R_VALUE', 'PICA_OUTPUT']
+        if args.subset:
+            columns.insert(1, 'SUBSET')
+        return columns + (['PI_LOW', 'PI_HIGH'] if bootstrap else []) + (['PAIRS', 'MISSING'] if args.coverage else [])
+    if args.mode == 'fst':
+        return (HEADERS['fst'] + (['FST_LOW', 'FST_HIGH'] if bootstrap else [])
+                + (['FST_P'] if args.permutations else []) + (COVERAGE_COLUMNS if args.coverage else []))
+    if args.mode == 'fst-panel':
+        return HEADERS['fst-panel'] + (COVERAGE_COLUMNS if args.coverage else [])
+    return HEADERS[args.mode]
+
+
+def write_jackknife(path, terms, level):
+    """Whole-scan weighted block jackknife of every statistic, one row each."""
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    with open(path, 'w') as out:
+        print("STATISTIC\tWINDOWS\tESTIMATE\tJACKKNIFE_ESTIMATE\tSE\tLEVEL\tLOW\tHIGH", file=out)
+        for label, rows in terms.items():
+            numerators, denominators, weights = zip(*rows)
+            estimate, jackknife, se = weighted_block_jackknife(numerators, denominators, weights)
+            print(label, len(rows), *(fmt_value(v) for v in (estimate, jackknife, se)), level,
+                  fmt_value(jackknife - z * se), fmt_value(jackknife + z * se), sep='\t', file=out)
+
+
+def fmt_value(value):
+    return "NA" if not math.isfinite(value) else f"{value:.8f}"
+
+
+def plain_values(value):
+    """JSON-ready copy of a record: NumPy scalars as Python numbers, NaN/inf as null."""
+    if isinstance(value, dict):
+        return {str(key): plain_values(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain_values(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def init_worker(args):
+    """Process-pool initializer: keep the scan options in each worker."""
+    global _worker_args
+    _worker_args = args
+
+
+def evaluate_window(args, window):
+    """Output rows and structured record of one window."""
+    record = {}
+    started = time.perf_counter()
+    rows = MODES[args.mode](args, *window, record)
+    record['seconds'] = round(time.perf_counter() - started, 6)
+    return rows, record
+
+
+def run_window_in_worker(window):
+    return evaluate_window(_worker_args, window)
+
+
+def collect(window, future):
+    try:
+        return window, future.result(), None
+    except Exception as e:
+        return window, None, e
+
+
+def evaluate_windows(args):
+    """Yield (window, (rows, record), error) for every BED window, in BED order.
+
+    With more than one worker, windows are fanned out to a process pool;
+    at most 4 windows per worker are in flight and results are yielded in
+    submission order, so the table stays in BED order.
+    """
+    windows = read_bed(args.bed)
+    if args.threads <= 1:
+        for window in windows:
+            # Same as collect(): any failure is the window's error, not the scan's
+            try:
+                result = evaluate_window(args, window)
+            except Exception as e:
+                yield window, None, e
+            else:
+                yield window, result, None
+        return
+
+    with ProcessPoolExecutor(max_workers=args.threads, initializer=init_worker, initargs=(args,)) as pool:
+        pending = deque()
+        for window in windows:
+            pending.append((window, pool.submit(run_window_in_worker, window)))
+            if len(pending) >= 4 * args.threads:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
+
+
+def scan(args, out):
+    """Evaluate every BED window, writing its rows to out (and --table) in BED order."""
+    header = header_for(args)
+    print('\t'.join(header), file=out)
+
+    table = WindowTableWriter(args.table, header + TABLE_ONLY_COLUMNS.get(args.mode, [])) if args.table else None
+    run_log = open(args.log_jsonl, 'w') if args.log_jsonl else None
+    jackknife = {}
+    success_count = 0
+    error_count = 0
+    try:
+        for (chrom, start, end), result, error in evaluate_windows(args):
+            entry = {'window': f"{chrom}:{start}-{end}", 'mode': args.mode}
+            if error is not None:
+                if isinstance(error, WindowError):
+                    print(f"Error: {error}", file=sys.stderr)
+                else:
+                    print(f"Warning: evaluation failed for region {chrom}:{start}-{end}: {error!r}", file=sys.stderr)
+                error_count += 1
+                if run_log:
+                    entry.update(status='error', error=str(error))
+                    print(json.dumps(entry), file=run_log)
+                continue
+            rows, record = result
+            for label, terms in record.get('jackknife', {}).items():
+                jackknife.setdefault(label, []).append(terms)
+            if args.verbose:
+                print(f"Processed region: {chrom}:{start}-{end}", file=sys.stderr)
+            for fields in rows:
+                print('\t'.join(format_row(header, fields)), file=out)
+                if table:
+                    table.write((chrom, start, end), fields)
+            out.flush()
+            if run_log:
+                entry.update(status='ok', rows=len(rows), seconds=record.pop('seconds'), values=record)
+                print(json.dumps(plain_values(entry)), file=run_log)
+            success_count += 1
+    finally:
+        if run_log:
+            run_log.close()
+        if table:
+            table.close()
+    if getattr(args, 'jackknife', None):
+        write_jackknife(args.jackknife, jackknife, args.level)
+
+    if args.verbose:
+        print("", file=sys.stderr)
+        print("Summary:", file=sys.stderr)
+        print(f"  Regions processed: {success_count}", file=sys.stderr)
+        print(f"  Regions failed: {error_count}", file=sys.stderr)
+
+
+def add_resampling_arguments(subparser):
+    subparser.add_argument('--bootstrap', type=int, metavar='N',
+                           help='Add a percentile interval from N haplotype-bootstrap replicates per window '
+                                '(resampled from the in-memory matrix, no extra impg run)')
+    subparser.add_argument('--jackknife', metavar='FILE',
+                           help='Write the whole-scan estimate with a weighted block-jackknife interval over windows to FILE')
+    subparser.add_argument('--level', type=float, default=0.95, help='Confidence level of the intervals (default: 0.95)')
+    subparser.add_argument('--seed', type=int, default=1, help='Bootstrap random seed (default: 1)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Evaluate pi, Fst or Tajima\'s D for every window of a BED file in one process',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Example usage:
+  %(prog)s pi -b regions.bed -t 0.999 -r 4 -u ../metadata/agc.EUR -o pi.eur.tsv
+  %(prog)s pi -b regions.bed -t 0.999 -r 4 -u agc.EUR -u agc.AFR -u agc.EAS -u agc.SAS -u agc.AMR
+  %(prog)s fst -b regions.bed -A ../metadata/agc.EUR -B ../metadata/agc.AFR -o eur.afr.fst
+  %(prog)s fst-panel -b regions.bed -g EUR=../metadata/agc.EUR -g AFR=../metadata/agc.AFR -g EAS=../metadata/agc.EAS
+  %(prog)s pica-fst -b regions.bed -A agc.EUR -B agc.AFR -t 0.999 -r 5
+  %(prog)s tajd -b regions.bed -l ../metadata/all.agc -j 32
+        """
+    )
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-b', '--bed', required=True, help='BED file containing genomic windows')
+    common.add_argument('-p', '--paf', default=PAF_FILE, help=f'PAF file for impg (default: {PAF_FILE})')
+    common.add_argument('-s', '--sequence-files', default=SEQUENCE_FILES,
+                        help=f'Sequence files for impg (default: {SEQUENCE_FILES})')
+    common.add_argument('-P', '--prefix', default=REGION_PREFIX,
+                        help=f'Region prefix prepended to BED coordinates (default: {REGION_PREFIX})')
+    common.add_argument('-o', '--output', help='Write output table to file (default: stdout)')
+    common.add_argument('-d', '--log-dir', help='Write a detailed log per window to this directory (default: no logs)')
+    common.add_argument('--log-level', choices=list(LEVELS), default='detail',
+                        help='Least important lines of the --log-dir logs: detail (every group and group pair), '
+                             'info (steps and totals) or warning (default: detail)')
+    common.add_argument('--table',
+                        help='Also write the rows as a typed window table (CHROM, START and END split out, '
+                             'PICA_OUTPUT as PI, numbers typed): Parquet for a .parquet path (needs pyarrow, '
+                             'TSV otherwise), TSV for any other path (wintable.py)')
+    common.add_argument('--log-jsonl',
+                        help='Write one JSON object per window (status, timing and the values behind each '
+                             'statistic) to this file')
+    common.add_argument('-j', '--threads', type=int, default=1,
+                        help='Number of windows evaluated in parallel worker processes (default: 1)')
+    common.add_argument('-c', '--cache-dir',
+                        help='Cache per-window similarity matrices in this directory and reuse them across runs')
+    common.add_argument('--cache-size', type=int, default=10240,
+                        help='Maximum cache size in MiB; least recently used windows are evicted (default: 10240)')
+    common.add_argument('--sparse', choices=list(SPARSE), default='never',
+                        help='Keep only the reported pairs of each window (simmatrix.SparseSimilarityMatrix): '
+                             'never, always, or auto when fewer than a quarter of the pairs were reported '
+                             '(default: never)')
+    common.add_argument('-v', '--verbose', action='store_true', help='Print progress and impg messages to stderr')
+
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    pi = subparsers.add_parser('pi', parents=[common], help='Nucleotide diversity per window (pica2.py)')
+    pi.add_argument('-t', '--threshold', type=float, required=True, help='Similarity threshold for pica2.py')
+    pi.add_argument('-r', '--round-digits', type=int, required=True, help='R value (rounding digits) for pica2.py')
+    pi.add_argument('-u', '--subset', dest='subsets', action='append', default=[],
+                    help='File with assemblies to subset (passed to --subset-sequence-list). '
+                         'Repeat to compute pi for several lists from one full-cohort impg run per window')
+    pi.add_argument('-l', '--length', type=int, help='Override sequence length passed to pica2.py')
+    add_resampling_arguments(pi)
+    pi.add_argument('--coverage', action='store_true',
+                    help='Add the reported and missing sequence pairs of each window (PAIRS, MISSING)')
+
+    fst = subparsers.add_parser('fst', parents=[common], help='Hudson Fst per window (h-fst.py)')
+    fst.add_argument('-A', '--pop-a', required=True, help='File with population A sequence IDs')
+    fst.add_argument('-B', '--pop-b', required=True, help='File with population B sequence IDs')
+    fst.add_argument('-r', '--round-digits', type=int, default=None, help='Round similarities to N decimal places')
+    add_resampling_arguments(fst)
+    fst.add_argument('--coverage', action='store_true',
+                     help='Add the reported and missing pairs within and between the populations '
+                          '(PAIRS_A ... MISSING_AB)')
+    fst.add_argument('--permutations', type=int, metavar='N',
+                     help='Add an empirical Fst p-value (FST_P) from N permutations of the A/B labels per window')
+
+    fst_panel = subparsers.add_parser('fst-panel', parents=[common],
+                                      help='Hudson Fst for every population pair of a panel (h-fst.py)')
+    fst_panel.add_argument('--panel', help='Sample -> population table (identifier and population per line)')
+    fst_panel.add_argument('-g', '--population', action='append', default=[], metavar='NAME=FILE',
+                           help='Add a population from a sequence ID list (repeatable)')
+    fst_panel.add_argument('-r', '--round-digits', type=int, default=None, help='Round similarities to N decimal places')
+    fst_panel.add_argument('--coverage', action='store_true',
+                           help='Add the reported and missing pairs within and between the populations '
+                                '(PAIRS_A ... MISSING_AB)')
+
+    pica_fst = subparsers.add_parser('pica-fst', parents=[common], help='Fst from pica2.py pi of A, B and A+B')
+    pica_fst.add_argument('-A', '--pop-a', required=True, help='File with subset list A')
+    pica_fst.add_argument('-B', '--pop-b', required=True, help='File with subset list B')
+    pica_fst.add_argument('-t', '--threshold', type=float, required=True, help='Similarity threshold for pica2.py')
+    pica_fst.add_argument('-r', '--round-digits', type=int, required=True, help='R value (rounding digits) for pica2.py')
+
+    tajd = subparsers.add_parser('tajd', parents=[common], help="Tajima's D per window")
+    tajd.add_argument('-l', '--sample-list', required=True, help='Sample list (one sequence ID per line)')
+    tajd.add_argument('-t', '--threshold', type=float, default=0.999, help='Threshold for pica2.py (default: 0.999)')
+    tajd.add_argument('-r', '--round-digits', type=int, default=5, help='R value for pica2.py (default: 5)')
+    tajd.add_argument('-R', '--reference', default='CHM13',
+                      help='Reference path name prefix (passed to povu gfa2vcf --stdout with --sites povu) (default: CHM13)')
+    tajd.add_argument('--sites', choices=['gfa', 'povu'], default='gfa',
+                      help='Count segregating sites from the impg GFA in process (gfa) or with '
+                           'odgi build/sort/view and povu gfa2vcf (povu) (default: gfa)')
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    for path in (args.bed, args.paf, args.sequence_files):
+        if not os.path.isfile(path):
+            print(f"Error: Required file '{path}' not found", file=sys.stderr)
+            sys.exit(1)
+    if args.threads < 1:
+        print("Error: Number of threads must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    if args.cache_size < 1:
+        print("Error: Cache size must be at least 1 MiB", file=sys.stderr)
+        sys.exit(1)
+    args.cache = MatrixCache(args.cache_dir, args.cache_size << 20) if args.cache_dir else None
+    if args.mode in ('pi', 'fst') and ((args.bootstrap is not None and args.bootstrap < 2)
+                                       or not 0 < args.level < 1):
+        print("Error: Need --bootstrap >= 2 and 0 < --level < 1", file=sys.stderr)
+        sys.exit(1)
+    if args.mode == 'fst' and args.permutations is not None and args.permutations < 1:
+        print("Error: Need --permutations >= 1", file=sys.stderr)
+        sys.exit(1)
+
+    cleanup = []
+    if args.mode == 'pi':
+        for path in args.subsets:
+            if not os.path.isfile(path):
+                print(f"Error: Subset list '{path}' not found", file=sys.stderr)
+                sys.exit(1)
+        args.subset = args.subsets[0] if len(args.subsets) == 1 else None
+        if len(args.subsets) > 1:
+            # Lists are named after their files (agc.EUR -> PI_agc.EUR)
+            subsets = {}
+            for path in args.subsets:
+                name = os.path.basename(path)
+                if name in subsets:
+                    print(f"Error: Subset lists must have distinct file names ({name} given twice)", file=sys.stderr)
+                    sys.exit(1)
+                subsets[name] = read_sample_list(path)
+            args.resolver = hfst.PopulationResolver(subsets)
+    elif args.mode == 'fst':
+        args.resolver = hfst.PopulationResolver({'A': read_sample_list(args.pop_a),
+                                                  'B': read_sample_list(args.pop_b)})
+    elif args.mode == 'fst-panel':
+        args.panel_ids = hfst.read_panel_file(args.panel) if args.panel else {}
+        for name, ids in hfst.read_population_lists(args.population).items():
+            args.panel_ids.setdefault(name, []).extend(ids)
+        if len(args.panel_ids) < 2:
+            print("Error: fst-panel needs at least two populations (--panel and/or -g NAME=FILE)", file=sys.stderr)
+            sys.exit(1)
+        args.resolver = hfst.PopulationResolver(args.panel_ids)
+    elif args.mode == 'pica-fst':
+        # Subset C is the union of both lists, written once for the whole scan
+        args.pop_a_ids = read_sample_list(args.pop_a)
+        args.pop_b_ids = read_sample_list(args.pop_b)
+        args.resolver = hfst.PopulationResolver({'A': args.pop_a_ids, 'B': args.pop_b_ids})
+        union = list(dict.fromkeys(args.pop_a_ids + args.pop_b_ids))
+        if not union:
+            print("Error: Union subset list is empty", file=sys.stderr)
+            sys.exit(1)
+        fd, args.union_list = tempfile.mkstemp(prefix='scan.union.')
+        with os.fdopen(fd, 'w') as handle:
+            handle.write('\n'.join(union) + '\n')
+        cleanup.append(args.union_list)
+    elif args.mode == 'tajd':
+        args.sample_count = len(read_sample_list(args.sample_list))
+        if args.sample_count < 2:
+            print(f"Error: Need at least two samples to compute Tajima's D (found {args.sample_count})",
+                  file=sys.stderr)
+            sys.exit(1)
+        if args.sites == 'povu':
+            args.workdir = tempfile.mkdtemp(prefix='scan.tajd.')
+            cleanup.append(args.workdir)
+
+    try:
+        if args.output:
+            with open(args.output, 'w') as out:
+                scan(args, out)
+        else:
+            scan(args, sys.stdout)
+    finally:
+        for path in cleanup:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
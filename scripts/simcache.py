@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+simcache.py - On-disk cache of per-window similarity matrices
+
+The same CHM13 windows are sent to `impg similarity` again and again, once
+per threshold, rounding, subset or statistic. The cache keeps each window's
+unrounded matrix in the binary format of simmatrix.write_matrix_file(), so
+later runs load it without calling impg or parsing TSV.
+
+Entries are content-addressed: the key hashes the PAF and sequence files
+(path, size and modification time), the region and the contents of the
+subset list. Hits refresh an entry's modification time, and the least
+recently used entries are evicted once the cache grows past its size bound.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from simmatrix import load_matrix_file, write_matrix_file
+
+SUFFIX = '.simx'
+
+
+def file_fingerprint(path):
+    """Identify a large input file by its absolute path, size and modification time."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cache_key(paf, sequence_files, region, subset=None):
+    """Content address of a window's impg similarity output."""
+    digest = hashlib.sha256()
+    digest.update(file_fingerprint(paf).encode())
+    digest.update(b'\0')
+    digest.update(file_fingerprint(sequence_files).encode())
+    digest.update(b'\0')
+    digest.update(region.encode())
+    digest.update(b'\0')
+    if subset:
+        with open(subset, 'rb') as handle:
+            digest.update(hashlib.sha256(handle.read()).digest())
+    return digest.hexdigest()
+
+
+class MatrixCache:
+    """Size-bounded LRU directory of binary similarity matrices.
+
+    Several processes may share a cache directory: entries are written to a
+    temporary file and renamed into place, and eviction tolerates entries
+    that another process already removed.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total = None  # bytes in the cache as last seen by this process
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + SUFFIX)
+
+    def get(self, key, sparse=False):
+        """Return the cached matrix for key, or None on a miss (sparse: see simmatrix.use_sparse)."""
+        path = self.path(key)
+        try:
+            matrix = load_matrix_file(path, sparse)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return matrix
+
+    def put(self, key, matrix):
+        """Store a matrix under key, evicting least recently used entries when over the bound."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            write_matrix_file(matrix, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self.entries())
+        else:
+            self._total += os.path.getsize(path)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """List (mtime, size, path) for every cache entry."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
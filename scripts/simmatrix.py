@@ -0,0 +1,739 @@
+#!/usr/bin/env python3
+"""
+simmatrix.py - Shared in-memory representation of impg similarity tables
+
+impg similarity reports one row per sequence pair:
+
+    group.a                                   group.b                                   estimated.identity
+    HG00097#1#CM094061.1:109468899-109469099  HG00099#2#CM094532.1:109470012-109470212  0.99950
+
+Instead of a dict keyed on (seq1, seq2) name tuples, the table is loaded into
+a SimilarityMatrix:
+- every sequence name is interned once and mapped to an integer index
+  (indices follow the sorted order of the names)
+- distances (1 - estimated.identity) live in a dense, symmetric float32 matrix
+- a boolean mask records which pairs were actually reported by impg
+
+Diversity, Dxy and grouping are then reductions over index arrays.
+
+impg leaves out pairs without alignment overlap, and in structurally
+variable windows most pairs can be missing. SparseSimilarityMatrix keeps
+only the reported pairs (CSR over the same indices); read it with
+read_similarity_matrix(..., sparse=True) or sparse='auto'. Diversity and
+Dxy are means over the reported pairs, each reported pair weighted
+equally and missing ones not at all, so both forms give the same values,
+and diversity() returns the reported and missing pair counts alongside.
+"""
+
+import gzip
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+REQUIRED_COLUMNS = ('group.a', 'group.b', 'estimated.identity')
+
+# Approximate number of bytes read from a similarity table per parsing chunk
+CHUNK_BYTES = 1 << 18
+
+# Most decimals of a printed identity that survive the float32 distance
+# round trip exactly (half a float32 ulp of a distance <= 1 is below 5e-8)
+MAX_EXACT_DECIMALS = 7
+
+# Fraction of reported pairs below which sparse='auto' builds a SparseSimilarityMatrix
+SPARSE_DENSITY = 0.25
+
+# Binary matrix file: magic, n, id table bytes, pair count, round digits, decimals
+MATRIX_MAGIC = b'IMPSIMX1'
+MATRIX_HEADER = struct.Struct('<8sQQQbb6x')
+
+
+class SimilarityMatrix:
+    """Symmetric pairwise distance matrix over interned sequence names.
+
+    Attributes:
+        ids: sequence names, position i holds the name of index i
+        index: mapping sequence name -> index
+        dist: float32 (n, n) array holding 1 - estimated.identity
+        present: bool (n, n) array, True where impg reported the pair
+        pair_count: number of rows the matrix was built from
+        round_digits: decimals identities were rounded to on load (None = unrounded)
+        decimals: decimals the identities were printed with, when at most
+            MAX_EXACT_DECIMALS (None otherwise); lets rounded() recover the
+            printed values exactly from the float32 distances
+    """
+
+    def __init__(self, ids, dist, present, pair_count=0, round_digits=None, decimals=None):
+        self.ids = list(ids)
+        self.index = {name: i for i, name in enumerate(self.ids)}
+        self.dist = dist
+        self.present = present
+        self.pair_count = pair_count
+        self.round_digits = round_digits
+        self.decimals = decimals
+
+    @classmethod
+    def from_pairs(cls, names_a, names_b, identity, round_digits=None):
+        """Build a matrix from parallel sequences of names and identities."""
+        ids = sorted(set(names_a) | set(names_b))
+        index = {name: i for i, name in enumerate(ids)}
+        rows = np.fromiter((index[name] for name in names_a), dtype=np.intp, count=len(names_a))
+        cols = np.fromiter((index[name] for name in names_b), dtype=np.intp, count=len(names_b))
+        return cls.from_indices(ids, rows, cols, identity, round_digits)
+
+    @classmethod
+    def from_indices(cls, ids, rows, cols, identity, round_digits=None):
+        """Build a matrix from interned index arrays (rows/cols index into ids).
+
+        Rounding is applied here, while identities are still float64, so
+        that it agrees with Python's round() on the values impg printed.
+        """
+        n = len(ids)
+        values, decimals = distances(identity, round_digits)
+        dist = np.zeros((n, n), dtype=np.float32)
+        present = np.zeros((n, n), dtype=bool)
+        dist[rows, cols] = values
+        dist[cols, rows] = values
+        present[rows, cols] = True
+        present[cols, rows] = True
+        return cls(ids, dist, present, pair_count=len(values), round_digits=round_digits, decimals=decimals)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indices(self, names):
+        """Return the sorted index array of the given names that are in the matrix."""
+        found = [self.index[name] for name in names if name in self.index]
+        return np.array(sorted(found), dtype=np.intp)
+
+    def names(self, idx):
+        """Return the sequence names for an index array."""
+        return [self.ids[i] for i in idx]
+
+    def rounded(self, digits):
+        """Return the matrix with identities rounded to the given number of decimals.
+
+        Matrices already loaded with the same rounding are returned as-is;
+        otherwise identities are reconstructed from the float32 distances
+        (snapped back to the printed decimals when those are known, so the
+        result matches rounding on load).
+        """
+        if digits == self.round_digits:
+            return self
+        identity = 1.0 - self.dist.astype(np.float64)
+        if self.decimals is not None:
+            identity = np.round(identity, self.decimals)
+        identity = round_identity(identity, digits)
+        dist = (1.0 - identity).astype(np.float32)
+        dist[~self.present] = 0.0
+        decimals = digits if self.decimals is None else min(digits, self.decimals)
+        return SimilarityMatrix(self.ids, dist, self.present, self.pair_count, round_digits=digits,
+                                decimals=decimals if decimals <= MAX_EXACT_DECIMALS else None)
+
+    def identity(self, rows, cols):
+        """Look up identities for paired index arrays; returns (values, present)."""
+        present = self.present[rows, cols]
+        values = 1.0 - self.dist[rows, cols].astype(np.float64)
+        return values, present
+
+    def block(self, idx_a, idx_b):
+        """Dense (distance, present) blocks of the pairs idx_a x idx_b."""
+        block = np.ix_(idx_a, idx_b)
+        return self.dist[block], self.present[block]
+
+    def _reported(self, idx_a, idx_b):
+        if idx_b is None:
+            block = np.ix_(idx_a, idx_a)
+            return block, np.triu(self.present[block], k=1)
+        block = np.ix_(idx_a, idx_b)
+        return block, self.present[block]
+
+    def pairs(self, idx_a, idx_b=None, below=None):
+        """Reported pairs of idx_a x idx_b, or i < j within idx_a when idx_b is None.
+
+        Returns (rows, cols, dist): positions into idx_a/idx_b and float32
+        distances, in row-major order of the block. With below, only pairs
+        at a distance < below are returned.
+        """
+        block, use = self._reported(idx_a, idx_b)
+        dist = self.dist[block]
+        if below is not None:
+            use &= dist < below
+        rows, cols = np.nonzero(use)
+        return rows, cols, dist[use]
+
+    def pair_distances(self, idx_a, idx_b=None):
+        """Distances of the reported pairs of pairs(), without their positions."""
+        block, use = self._reported(idx_a, idx_b)
+        return self.dist[block][use]
+
+    def upper_triangle(self):
+        """Upper triangle (diagonal included, row-major) of the distances, NaN where no pair was reported."""
+        rows, cols = np.triu_indices(len(self))
+        return np.where(self.present[rows, cols], self.dist[rows, cols], np.float32(np.nan))
+
+
+class SparseSimilarityMatrix:
+    """SimilarityMatrix with only the reported pairs stored, in CSR form.
+
+    For windows where impg reports few of the n^2 pairs (structurally
+    variable loci, distant haplotypes): memory and the cost of diversity,
+    Dxy and grouping scale with the number of reported pairs. Supports the
+    same module functions and methods as SimilarityMatrix, except that
+    dist and present are not materialised.
+
+    Attributes:
+        ids, index, pair_count, round_digits, decimals: as in SimilarityMatrix
+        indptr: int64 (n + 1,) row offsets into columns/dist
+        columns: intp column index of every stored pair, sorted within a row
+        dist: float32 1 - estimated.identity of every stored pair
+
+    Both orientations of a pair are stored, self pairs once.
+    """
+
+    def __init__(self, ids, indptr, columns, dist, pair_count=0, round_digits=None, decimals=None):
+        self.ids = list(ids)
+        self.index = {name: i for i, name in enumerate(self.ids)}
+        self.indptr = indptr
+        self.columns = columns
+        self.dist = dist
+        self.pair_count = pair_count
+        self.round_digits = round_digits
+        self.decimals = decimals
+
+    @classmethod
+    def from_indices(cls, ids, rows, cols, identity, round_digits=None):
+        """Build a sparse matrix from interned index arrays, as SimilarityMatrix.from_indices()."""
+        values, decimals = distances(identity, round_digits)
+        return cls.from_distances(ids, rows, cols, values, len(values), round_digits, decimals)
+
+    @classmethod
+    def from_distances(cls, ids, rows, cols, dist, pair_count, round_digits=None, decimals=None):
+        """Build a sparse matrix from float32 distances of (rows, cols) pairs.
+
+        A pair reported more than once keeps its last value, with the same
+        precedence as the assignments of SimilarityMatrix.from_indices().
+        """
+        n = len(ids)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        keys = np.concatenate((rows * n + cols, cols * n + rows))
+        values = np.concatenate((dist, dist)).astype(np.float32)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        row, column = np.divmod(keys[last], max(n, 1))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row, minlength=n), out=indptr[1:])
+        return cls(ids, indptr, column.astype(np.intp), values[order][last], pair_count, round_digits, decimals)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indices(self, names):
+        """Return the sorted index array of the given names that are in the matrix."""
+        found = [self.index[name] for name in names if name in self.index]
+        return np.array(sorted(found), dtype=np.intp)
+
+    def names(self, idx):
+        """Return the sequence names for an index array."""
+        return [self.ids[i] for i in idx]
+
+    @property
+    def reported(self):
+        """Number of distinct pairs reported, self pairs included."""
+        self_pairs = np.count_nonzero(self.columns == np.repeat(np.arange(len(self)), np.diff(self.indptr)))
+        return (len(self.columns) + self_pairs) // 2
+
+    def rounded(self, digits):
+        """Return the matrix with identities rounded to the given number of decimals (see SimilarityMatrix.rounded)."""
+        if digits == self.round_digits:
+            return self
+        identity = 1.0 - self.dist.astype(np.float64)
+        if self.decimals is not None:
+            identity = np.round(identity, self.decimals)
+        dist = (1.0 - round_identity(identity, digits)).astype(np.float32)
+        decimals = digits if self.decimals is None else min(digits, self.decimals)
+        return SparseSimilarityMatrix(self.ids, self.indptr, self.columns, dist, self.pair_count, round_digits=digits,
+                                      decimals=decimals if decimals <= MAX_EXACT_DECIMALS else None)
+
+    def _keys(self):
+        rows = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+        return rows * len(self) + self.columns
+
+    def identity(self, rows, cols):
+        """Look up identities for paired index arrays; returns (values, present)."""
+        keys = self._keys()
+        wanted = np.asarray(rows, dtype=np.int64) * len(self) + np.asarray(cols, dtype=np.int64)
+        if len(keys) == 0:
+            return np.ones(wanted.shape), np.zeros(wanted.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        present = keys[pos] == wanted
+        values = np.where(present, 1.0 - self.dist[pos].astype(np.float64), 1.0)
+        return values, present
+
+    def pairs(self, idx_a, idx_b=None, below=None):
+        """Reported pairs of idx_a x idx_b, or i < j within idx_a (see SimilarityMatrix.pairs).
+
+        Reads only the stored entries of the rows in idx_a; idx_b must not
+        repeat an index.
+        """
+        idx_a = np.asarray(idx_a, dtype=np.intp)
+        within = idx_b is None
+        idx_b = idx_a if within else np.asarray(idx_b, dtype=np.intp)
+        starts = self.indptr[idx_a]
+        lengths = self.indptr[idx_a + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        entries = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+        rows = np.repeat(np.arange(len(idx_a)), lengths)
+        position = np.full(len(self), -1, dtype=np.intp)
+        position[idx_b] = np.arange(len(idx_b))
+        cols = position[self.columns[entries]]
+        keep = cols > rows if within else cols >= 0
+        if below is not None:
+            keep &= self.dist[entries] < below
+        rows, cols, entries = rows[keep], cols[keep], entries[keep]
+        if len(idx_b) > 1 and not np.all(idx_b[1:] > idx_b[:-1]):
+            order = np.lexsort((cols, rows))
+            rows, cols, entries = rows[order], cols[order], entries[order]
+        return rows, cols, self.dist[entries]
+
+    def pair_distances(self, idx_a, idx_b=None):
+        """Distances of the reported pairs of pairs(), without their positions."""
+        return self.pairs(idx_a, idx_b)[2]
+
+    def block(self, idx_a, idx_b):
+        """Dense (distance, present) blocks of the pairs idx_a x idx_b."""
+        rows, cols, values = self.pairs(idx_a, idx_b)
+        dist = np.zeros((len(idx_a), len(idx_b)), dtype=np.float32)
+        present = np.zeros((len(idx_a), len(idx_b)), dtype=bool)
+        dist[rows, cols] = values
+        present[rows, cols] = True
+        return dist, present
+
+    def upper_triangle(self):
+        """Upper triangle (diagonal included, row-major) of the distances, NaN where no pair was reported."""
+        n = len(self)
+        rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        upper = self.columns >= rows
+        rows, cols = rows[upper], self.columns[upper]
+        triangle = np.full(n * (n + 1) // 2, np.nan, dtype=np.float32)
+        triangle[rows * n - rows * (rows - 1) // 2 + cols - rows] = self.dist[upper]
+        return triangle
+
+    def to_dense(self):
+        """The same matrix as a dense SimilarityMatrix."""
+        idx = np.arange(len(self))
+        dist, present = self.block(idx, idx)
+        return SimilarityMatrix(self.ids, dist, present, self.pair_count, self.round_digits, self.decimals)
+
+
+def distances(identity, round_digits=None):
+    """float32 distances of printed identities (optionally rounded) and the decimals they keep.
+
+    Rounding is applied while identities are still float64, so that it
+    agrees with Python's round() on the values impg printed. decimals is
+    None when the identities need more than MAX_EXACT_DECIMALS.
+    """
+    identity = np.asarray(identity, dtype=np.float64)
+    decimals = printed_decimals(identity)
+    if round_digits is not None:
+        identity = round_identity(identity, round_digits)
+        decimals = round_digits if decimals is None else min(decimals, round_digits)
+    return (1.0 - identity).astype(np.float32), decimals if decimals is not None and decimals <= MAX_EXACT_DECIMALS else None
+
+
+def use_sparse(sparse, n, reported):
+    """Whether to build a SparseSimilarityMatrix: sparse is True, False or 'auto'.
+
+    'auto' picks the sparse form when fewer than SPARSE_DENSITY of the
+    n (n + 1) / 2 pairs were reported.
+    """
+    if sparse == 'auto':
+        return reported < SPARSE_DENSITY * n * (n + 1) / 2
+    return bool(sparse)
+
+
+def printed_decimals(values):
+    """Smallest number of decimals (up to MAX_EXACT_DECIMALS) that represents every value, or None."""
+    for decimals in range(MAX_EXACT_DECIMALS + 1):
+        if np.array_equal(np.round(values, decimals), values):
+            return decimals
+    return None
+
+
+def round_identity(values, digits):
+    """Round identities like Python's round(), vectorised.
+
+    np.round scales by 10**digits and rounds half to even, which disagrees
+    with round() on decimal ties such as 0.993215 -> 5 digits; those few
+    values are rounded individually.
+    """
+    rounded = np.round(values, digits)
+    scaled = values * 10.0 ** digits
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(value, digits) for value in values[ties].tolist()]
+    return rounded
+
+
+def open_table(source):
+    """Open a similarity table for reading: '-' is stdin, gzip is detected by its magic bytes."""
+    if source == '-':
+        return sys.stdin
+    with open(source, 'rb') as probe:
+        magic = probe.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(source, 'rt', newline='')
+    return open(source, newline='')
+
+
+def write_matrix_file(matrix, path):
+    """Write a matrix in the binary format read back by load_matrix_file().
+
+    Layout: a fixed header (MATRIX_HEADER), the newline-separated sequence
+    names padded to 8 bytes, then the upper triangle (diagonal included,
+    row-major) of the distances as little-endian float32, NaN where impg
+    reported no pair.
+    """
+    n = len(matrix)
+    id_table = '\n'.join(matrix.ids).encode()
+    padding = -len(id_table) % 8
+    triangle = matrix.upper_triangle()
+    with open(path, 'wb') as handle:
+        handle.write(MATRIX_HEADER.pack(
+            MATRIX_MAGIC, n, len(id_table), matrix.pair_count,
+            -1 if matrix.round_digits is None else matrix.round_digits,
+            -1 if matrix.decimals is None else matrix.decimals,
+        ))
+        handle.write(id_table + b'\0' * padding)
+        handle.write(triangle.astype('<f4').tobytes())
+
+
+def is_matrix_file(path):
+    """True when path starts with the binary matrix magic."""
+    with open(path, 'rb') as probe:
+        return probe.read(len(MATRIX_MAGIC)) == MATRIX_MAGIC
+
+
+def load_matrix_file(path, sparse=False):
+    """Load a binary matrix file; the distance triangle is memory-mapped, not parsed.
+
+    sparse (True, False or 'auto', see use_sparse()) returns a
+    SparseSimilarityMatrix built from the reported entries of the triangle.
+    """
+    with open(path, 'rb') as handle:
+        magic, n, id_bytes, pair_count, round_digits, decimals = MATRIX_HEADER.unpack(
+            handle.read(MATRIX_HEADER.size))
+        if magic != MATRIX_MAGIC:
+            raise ValueError(f"File {path} is not a binary similarity matrix")
+        ids = handle.read(id_bytes).decode().split('\n') if n else []
+
+    offset = MATRIX_HEADER.size + id_bytes + (-id_bytes % 8)
+    triangle = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(n * (n + 1) // 2,)) if n else \
+        np.zeros(0, dtype=np.float32)
+    round_digits = None if round_digits < 0 else round_digits
+    decimals = None if decimals < 0 else decimals
+    reported = np.flatnonzero(~np.isnan(triangle))
+    if use_sparse(sparse, n, len(reported)):
+        # Row r of the triangle starts at r n - r (r - 1) / 2
+        starts = np.arange(n, dtype=np.int64)
+        starts = starts * n - starts * (starts - 1) // 2
+        rows = np.searchsorted(starts, reported, side='right') - 1
+        cols = reported - starts[rows] + rows
+        return SparseSimilarityMatrix.from_distances(ids, rows, cols, triangle[reported], pair_count,
+                                                     round_digits, decimals)
+
+    rows, cols = np.triu_indices(n)
+    dist = np.zeros((n, n), dtype=np.float32)
+    dist[rows, cols] = triangle
+    dist[cols, rows] = triangle
+    present = ~np.isnan(dist)
+    dist[~present] = 0.0
+    return SimilarityMatrix(ids, dist, present, pair_count, round_digits=round_digits, decimals=decimals)
+
+
+def read_similarity_matrix(source, round_digits=None, skip_invalid=False, sparse=False):
+    """Read an impg similarity table into a SimilarityMatrix.
+
+    source is an open text handle, '-' for stdin, a path to a plain or
+    gzip-compressed table, or a binary matrix file (write_matrix_file),
+    which is loaded without parsing. Identities are optionally rounded to
+    round_digits decimals on load. Raises ValueError on a missing header,
+    missing columns or (unless skip_invalid is set) a non-numeric
+    estimated.identity value. With skip_invalid, offending rows are
+    reported on stderr and dropped. sparse (True, False or 'auto', see
+    use_sparse()) selects a SparseSimilarityMatrix.
+    """
+    if hasattr(source, 'read'):
+        return _parse_similarity_table(source, getattr(source, 'name', '<stream>'), round_digits, skip_invalid,
+                                       sparse)
+    if source != '-' and is_matrix_file(source):
+        matrix = load_matrix_file(source, sparse)
+        return matrix if round_digits is None else matrix.rounded(round_digits)
+    handle = open_table(source)
+    try:
+        return _parse_similarity_table(handle, source, round_digits, skip_invalid, sparse)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def _parse_similarity_table(handle, label, round_digits, skip_invalid, sparse=False):
+    """Stream the table in chunks, keeping only the three required columns.
+
+    Names are interned as they appear and every row is stored as two
+    integer indices and one float in compact arrays; no per-row dict,
+    tuple or list of names is kept.
+    """
+    header = handle.readline().rstrip('\r\n').split('\t')
+    if header == ['']:
+        raise ValueError(f"File {label} is empty or missing a header")
+
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in header]
+    if missing_cols:
+        raise ValueError(f"File must contain columns: {sorted(REQUIRED_COLUMNS)} (found: {header})")
+    columns = tuple(header.index(col) for col in REQUIRED_COLUMNS)
+
+    index = {}
+    rows = array('q')
+    cols = array('q')
+    identity = array('d')
+    line_number = 1
+    while True:
+        lines = handle.readlines(CHUNK_BYTES)
+        if not lines:
+            break
+        chunk = _split_chunk(lines, len(header), columns)
+        if chunk is None:
+            chunk = _split_lines(lines, line_number, columns, label, skip_invalid)
+        line_number += len(lines)
+
+        names_a, names_b, values = chunk
+        for name in set(names_a).union(names_b).difference(index):
+            index[name] = len(index)
+        rows.extend(map(index.__getitem__, names_a))
+        cols.extend(map(index.__getitem__, names_b))
+        identity.frombytes(np.asarray(values, dtype=np.float64).tobytes())
+
+    # Renumber from first-seen to sorted name order
+    names = list(index)
+    order = sorted(range(len(names)), key=names.__getitem__)
+    remap = np.empty(len(names), dtype=np.intp)
+    remap[order] = np.arange(len(names), dtype=np.intp)
+    ids = [names[i] for i in order]
+    matrix_class = SparseSimilarityMatrix if use_sparse(sparse, len(ids), len(identity)) else SimilarityMatrix
+    return matrix_class.from_indices(
+        ids,
+        remap[np.frombuffer(rows, dtype=np.int64)],
+        remap[np.frombuffer(cols, dtype=np.int64)],
+        np.frombuffer(identity, dtype=np.float64),
+        round_digits,
+    )
+
+
+def _split_chunk(lines, n_columns, columns):
+    """Fast path: split a chunk of well-formed rows in one go.
+
+    Returns (names_a, names_b, identities), or None when the chunk has
+    blank, short or non-numeric rows and must be parsed line by line.
+    """
+    tokens = ''.join(lines).split()
+    if len(tokens) != len(lines) * n_columns:
+        return None
+    pos_a, pos_b, pos_id = columns
+    try:
+        values = np.array(tokens[pos_id::n_columns], dtype=np.float64)
+    except ValueError:
+        return None
+    return tokens[pos_a::n_columns], tokens[pos_b::n_columns], values
+
+
+def _split_lines(lines, line_number, columns, label, skip_invalid):
+    """Slow path: parse rows one by one, skipping blank lines and reporting invalid values."""
+    pos_a, pos_b, pos_id = columns
+    last = max(columns)
+    names_a = []
+    names_b = []
+    values = []
+    for row_number, line in enumerate(lines, start=line_number + 1):
+        fields = line.rstrip('\r\n').split('\t')
+        if fields == ['']:
+            continue
+        try:
+            value = float(fields[pos_id])
+        except (IndexError, ValueError):
+            raw = fields[pos_id] if len(fields) > pos_id else ''
+            if skip_invalid:
+                print(f"Warning: Invalid similarity value: {raw}", file=sys.stderr)
+                continue
+            raise ValueError(f"Invalid similarity value on line {row_number}: {raw}")
+        if len(fields) <= last:
+            raise ValueError(f"Missing columns on line {row_number} of {label}")
+        names_a.append(fields[pos_a])
+        names_b.append(fields[pos_b])
+        values.append(value)
+    return names_a, names_b, values
+
+
+def diversity(matrix, idx_a, idx_b=None):
+    """Average pairwise distance within idx_a, or between idx_a and idx_b.
+
+    Returns (mean, pairs_with_data, missing_pairs); mean is 0.0 without data.
+    """
+    idx_a = np.asarray(idx_a, dtype=np.intp)
+    if idx_b is None:
+        total = len(idx_a) * (len(idx_a) - 1) // 2
+    else:
+        idx_b = np.asarray(idx_b, dtype=np.intp)
+        total = len(idx_a) * len(idx_b)
+    # Pairs impg did not report carry no weight: only reported pairs are read
+    values = matrix.pair_distances(idx_a, idx_b)
+
+    count = len(values)
+    missing = total - count
+    if count == 0:
+        return 0.0, 0, missing
+    value_sum = values.sum(dtype=np.float64)
+    return float(value_sum / count), count, missing
+
+
+def connected_components(n, rows, cols):
+    """Label the connected components of an undirected graph on nodes 0..n-1.
+
+    rows/cols are the edge endpoints. A vectorised union-find: every round
+    hooks the root of each edge onto the smaller root, then compresses the
+    pointers by jumping until every node points at its root. Each node ends
+    up labelled with the smallest node index of its component, so the result
+    does not depend on edge order.
+    """
+    labels = np.arange(n, dtype=np.intp)
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    while True:
+        root_a, root_b = labels[rows], labels[cols]
+        unlinked = root_a != root_b
+        if not unlinked.any():
+            return labels
+        root_a, root_b = root_a[unlinked], root_b[unlinked]
+        low = np.minimum(root_a, root_b)
+        np.minimum.at(labels, root_a, low)
+        np.minimum.at(labels, root_b, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def split_components(labels):
+    """Split component labels into sorted member arrays, ordered by smallest member."""
+    order = np.argsort(labels, kind='stable')
+    _, starts = np.unique(labels[order], return_index=True)
+    return np.split(order, starts[1:])
+
+
+def group_indices(matrix, idx, threshold):
+    """Group sequences into connected components of identity > threshold.
+
+    Two sequences share a group when they are linked by a chain of pairs
+    reported by impg with identity above threshold. Returns a list of
+    sorted index arrays, ordered by their smallest index.
+    """
+    idx = np.sort(np.asarray(idx, dtype=np.intp))
+    rows, cols, _ = matrix.pairs(idx, below=np.float32(1.0 - threshold))
+    labels = connected_components(len(idx), rows, cols)
+    return [idx[members] for members in split_components(labels)]
+
+
+def representative_identity(matrix, groups):
+    """Identity between group representatives (first member of each group).
+
+    Returns (rows, cols, identity, present) for every group pair i < j,
+    where rows/cols are group positions.
+    """
+    reps = np.array([group[0] for group in groups], dtype=np.intp)
+    rows, cols = np.triu_indices(len(groups), k=1)
+    values, present = matrix.identity(reps[rows], reps[cols])
+    return rows, cols, values, present
+
+
+def group_pair_identity(matrix, groups):
+    """Identity of the first reported member pair for every ordered pair of groups.
+
+    Returns (identity, present), two (k, k) arrays: where present[g, h],
+    identity[g, h] is the identity of the first pair of groups[g] x groups[h]
+    reported by impg, in row-major member order. One pass reads
+    each group's rows against all members: the first reported row of every
+    column, its minimum per column group, and the first column reaching it.
+    """
+    k = len(groups)
+    identity = np.zeros((k, k))
+    present = np.zeros((k, k), dtype=bool)
+    if k == 0:
+        return identity, present
+    members = np.concatenate(groups)
+    sizes = np.array([len(group) for group in groups])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    positions = np.arange(len(members))
+    for g, group in enumerate(groups):
+        dist, block = matrix.block(group, members)
+        first_row = np.where(block.any(axis=0), block.argmax(axis=0), len(group))
+        row = np.minimum.reduceat(first_row, starts)
+        column = np.minimum.reduceat(np.where(first_row == np.repeat(row, sizes), positions, len(members)), starts)
+        found = row < len(group)
+        identity[g, found] = 1.0 - dist[row[found], column[found]].astype(np.float64)
+        present[g, found] = True
+    return identity, present
+
+
+def block_sums(matrix, labels, n_blocks):
+    """Sum distances and count reported pairs for every pair of index blocks.
+
+    labels assigns each matrix index to a block 0..n_blocks-1, or -1 to
+    leave it out. Returns (sums, counts) as (n_blocks, n_blocks) float64
+    arrays: off-diagonal entries cover all pairs between two blocks,
+    diagonal entries the pairs i < j within one block.
+    """
+    labels = np.asarray(labels, dtype=np.intp)
+    keep = np.flatnonzero(labels >= 0)
+    keep_labels = labels[keep]
+    if isinstance(matrix, SparseSimilarityMatrix):
+        return _sparse_block_sums(matrix, keep, keep_labels, n_blocks)
+    onehot = np.zeros((n_blocks, len(keep)))
+    onehot[keep_labels, np.arange(len(keep))] = 1.0
+
+    block = np.ix_(keep, keep)
+    present = matrix.present[block].astype(np.float64)
+    dist = np.where(matrix.present[block], matrix.dist[block], 0).astype(np.float64)
+    sums = onehot @ dist @ onehot.T
+    counts = onehot @ present @ onehot.T
+
+    # Within a block every unordered pair was counted twice, plus the self pairs
+    self_dist = np.bincount(keep_labels, weights=np.diagonal(dist), minlength=n_blocks)
+    self_present = np.bincount(keep_labels, weights=np.diagonal(present), minlength=n_blocks)
+    diag = np.arange(n_blocks)
+    sums[diag, diag] = (sums[diag, diag] - self_dist) / 2
+    counts[diag, diag] = (counts[diag, diag] - self_present) / 2
+    return sums, counts
+
+
+def _sparse_block_sums(matrix, keep, keep_labels, n_blocks):
+    """block_sums() from the reported pairs i < j alone."""
+    rows, cols, dist = matrix.pairs(keep)
+    cell = keep_labels[rows] * n_blocks + keep_labels[cols]
+    size = n_blocks * n_blocks
+    # bincount of no pairs is int64 whatever the weights; the halving below needs float64
+    sums = np.bincount(cell, weights=dist.astype(np.float64), minlength=size).astype(np.float64)
+    counts = np.bincount(cell, minlength=size).astype(np.float64)
+    sums = sums.reshape(n_blocks, n_blocks)
+    counts = counts.reshape(n_blocks, n_blocks)
+    # Pairs between two blocks may have landed in either orientation
+    diag = np.arange(n_blocks)
+    sums = sums + sums.T
+    counts = counts + counts.T
+    sums[diag, diag] /= 2
+    counts[diag, diag] /= 2
+    return sums, counts
@@ -18,12 +18,21 @@ Note:
 - n must be >= 2.
 - S and pi must be >= 0.
 - If the denominator is zero (e.g., S == 0), D returns NaN.
+
+The constants depend on n only and are cached per n. tajimas_d_batch()
+scores arrays of windows at once with NumPy (n may vary per window), and
+--table does the same for a TSV with n, S and pi columns (e.g. the
+output of `scan.py tajd`).
 """
 
 from __future__ import annotations
 import argparse
 import math
+import sys
 from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
 
 @dataclass
 class TajimaComponents:
@@ -44,12 +53,9 @@ def _harmonic(n: int) -> float:
 def _harmonic2(n: int) -> float:
     return sum(1.0 / (i * i) for i in range(1, n))
 
-def tajimas_d(n: int, S: float, pi: float, return_components: bool = False):
-    if n < 2:
-        raise ValueError("n must be >= 2")
-    if S < 0 or pi < 0:
-        raise ValueError("S and pi must be non-negative")
-
+@lru_cache(maxsize=None)
+def tajima_constants(n: int) -> tuple:
+    """(a1, a2, b1, b2, c1, c2, e1, e2) for n sequences, computed once per n."""
     a1 = _harmonic(n)
     a2 = _harmonic2(n)
     b1 = (n + 1.0) / (3.0 * (n - 1.0))
@@ -58,6 +64,15 @@ def tajimas_d(n: int, S: float, pi: float, return_components: bool = False):
     c2 = b2 - ((n + 2.0) / (a1 * n)) + (a2 / (a1 * a1))
     e1 = c1 / a1
     e2 = c2 / (a1 * a1 + a2)
+    return a1, a2, b1, b2, c1, c2, e1, e2
+
+def tajimas_d(n: int, S: float, pi: float, return_components: bool = False):
+    if n < 2:
+        raise ValueError("n must be >= 2")
+    if S < 0 or pi < 0:
+        raise ValueError("S and pi must be non-negative")
+
+    a1, a2, b1, b2, c1, c2, e1, e2 = tajima_constants(int(n))
 
     numerator = pi - (S / a1)
     denominator = math.sqrt(e1 * S + e2 * S * (S - 1.0)) if (S > 0) else float("nan")
@@ -68,14 +83,96 @@ def tajimas_d(n: int, S: float, pi: float, return_components: bool = False):
         return D, TajimaComponents(a1, a2, b1, b2, c1, c2, e1, e2, numerator, denominator)
     return D
 
+def tajimas_d_batch(n, S, pi):
+    """Tajima's D for arrays of windows; n is a scalar or one value per window.
+
+    Constants are looked up once per distinct n. Windows with n < 2,
+    negative S or pi, or S == 0 get NaN instead of raising.
+    """
+    S = np.asarray(S, dtype=np.float64)
+    pi = np.asarray(pi, dtype=np.float64)
+    n = np.broadcast_to(np.asarray(n, dtype=np.int64), S.shape)
+
+    values, inverse = np.unique(n, return_inverse=True)
+    table = np.array([tajima_constants(int(v)) if v >= 2 else (np.nan,) * 8 for v in values]).reshape(len(values), 8)
+    a1, e1, e2 = (table[inverse.reshape(S.shape), k] for k in (0, 6, 7))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        numerator = pi - S / a1
+        denominator = np.sqrt(e1 * S + e2 * S * (S - 1.0))
+        D = numerator / denominator
+    valid = (n >= 2) & (S > 0) & (pi >= 0) & (denominator != 0)
+    return np.where(valid, D, np.nan)
+
+def score_table(handle, out, n=None, n_column="SAMPLES", s_column="SEGREGATING_SITES",
+                pi_column="PI", d_column="TAJIMAS_D"):
+    """Append (or overwrite) a Tajima's D column on a tab-separated table with a header line."""
+    header = handle.readline().rstrip("\n").split("\t")
+    needed = [s_column, pi_column] + ([] if n is not None else [n_column])
+    missing = [column for column in needed if column not in header]
+    if missing:
+        raise ValueError(f"Missing column(s) {', '.join(missing)} in table header")
+    rows = [line.rstrip("\n").split("\t") for line in handle if line.strip()]
+
+    def column(name):
+        index = header.index(name)
+        return np.array([_parse_float(row[index]) for row in rows], dtype=np.float64)
+
+    sizes = n if n is not None else np.nan_to_num(column(n_column), nan=0).astype(np.int64)
+    D = tajimas_d_batch(sizes, column(s_column), column(pi_column)) if rows else []
+
+    if d_column in header:
+        index = header.index(d_column)
+        for row, value in zip(rows, D):
+            row[index:index + 1] = ["NA" if math.isnan(value) else repr(float(value))]
+    else:
+        header.append(d_column)
+        for row, value in zip(rows, D):
+            row.append("NA" if math.isnan(value) else repr(float(value)))
+    out.write("\t".join(header) + "\n")
+    for row in rows:
+        out.write("\t".join(row) + "\n")
+    return len(rows)
+
+def _parse_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
 def main():
-    parser = argparse.ArgumentParser(description="Compute Tajima's D from n, S, and pi.")
-    parser.add_argument("-n", "--sample-size", type=int, required=True, help="Number of sequences (n >= 2)")
-    parser.add_argument("-S", "--segregating-sites", type=float, required=True, help="Number of segregating sites S (>= 0)")
-    parser.add_argument("-p", "--pi", type=float, required=True, help="Mean pairwise differences pi (>= 0)")
+    parser = argparse.ArgumentParser(description="Compute Tajima's D from n, S, and pi, for one window or a table of windows.")
+    parser.add_argument("-n", "--sample-size", type=int, help="Number of sequences (n >= 2); with --table, overrides the n column")
+    parser.add_argument("-S", "--segregating-sites", type=float, help="Number of segregating sites S (>= 0)")
+    parser.add_argument("-p", "--pi", type=float, help="Mean pairwise differences pi (>= 0)")
     parser.add_argument("--show-components", action="store_true", help="Print intermediate constants (a1, a2, e1, e2, etc.)")
+    parser.add_argument("--table", help="Tab-separated table with a header and one window per row ('-' for stdin); "
+                                        "writes it back with a Tajima's D column")
+    parser.add_argument("--n-column", default="SAMPLES", help="Column with n in --table (default: SAMPLES)")
+    parser.add_argument("--s-column", default="SEGREGATING_SITES", help="Column with S in --table (default: SEGREGATING_SITES)")
+    parser.add_argument("--pi-column", default="PI", help="Column with pi in --table (default: PI)")
+    parser.add_argument("--d-column", default="TAJIMAS_D", help="Output column for D in --table (default: TAJIMAS_D)")
+    parser.add_argument("-o", "--output", help="Output file for --table (default: stdout)")
     args = parser.parse_args()
 
+    if args.table:
+        handle = sys.stdin if args.table == "-" else open(args.table)
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            score_table(handle, out, args.sample_size, args.n_column, args.s_column, args.pi_column, args.d_column)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+            if out is not sys.stdout:
+                out.close()
+        return
+
+    if args.sample_size is None or args.segregating_sites is None or args.pi is None:
+        parser.error("-n, -S and -p are required without --table")
+
     D, comps = tajimas_d(args.sample_size, args.segregating_sites, args.pi, return_components=True)
 
     print(f"Tajima's D: {D}")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+wintable.py - Typed window tables for scan.py results (Parquet, or TSV)
+
+The scan output mirrors the wrappers' TSVs: REGION packs the prefix,
+chromosome and coordinates, pi mode writes PICA_OUTPUT as
+"0.00000721 (sequence length: 200)" and statistics are rounded to 8
+decimals. A window table holds the values the modes computed, unrounded,
+with one typed column per value:
+
+    REGION CHROM START END [SUBSET] ... PI ... FST PI_A ... PAIRS_A MISSING_A ...
+
+CHROM/START/END come from the BED line, PICA_OUTPUT becomes PI, counts
+are int64, statistics float64 and NA (or NaN) is null. Modes may add
+columns that the text output leaves out (tajd: THETA_W, D_NUMERATOR,
+D_DENOMINATOR). Rows are buffered and
+written in batches of BATCH_ROWS; a .parquet path writes one Parquet row
+group per batch (pyarrow), so plots and genome-wide aggregation can load
+just the columns they need. Any other path, or a .parquet path without
+pyarrow installed, writes a TSV of the same columns.
+
+Usage (through scan.py):
+    python3 scan.py pi -b regions.bed -t 0.999 -r 4 --table pi.parquet
+    python3 wintable.py pi.parquet -c CHROM START PI
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows buffered per record batch / Parquet row group
+BATCH_ROWS = 65536
+
+STRING_COLUMNS = ('REGION', 'CHROM', 'SUBSET', 'POP_A', 'POP_B')
+INT_COLUMNS = ('START', 'END', 'LENGTH', 'R_VALUE', 'SAMPLES', 'SEGREGATING_SITES')
+# Every column starting with one of these is a pair count
+INT_PREFIXES = ('PAIRS', 'MISSING')
+
+
+def column_type(name):
+    """'string', 'int64' or 'float64' for a window table column."""
+    if name in STRING_COLUMNS:
+        return 'string'
+    if name in INT_COLUMNS or name.startswith(INT_PREFIXES):
+        return 'int64'
+    return 'float64'
+
+
+def table_columns(header):
+    """Window table columns of a scan.py header: CHROM/START/END after REGION, PICA_OUTPUT as PI."""
+    columns = []
+    for name in header:
+        columns.append('PI' if name == 'PICA_OUTPUT' else name)
+        if name == 'REGION':
+            columns += ['CHROM', 'START', 'END']
+    return columns
+
+
+def parse_value(text, kind):
+    """Typed value of one TSV field."""
+    if kind == 'string':
+        return text
+    if text in ('NA', 'nan', ''):
+        return None
+    return int(text) if kind == 'int64' else float(text)
+
+
+def typed_value(value, kind):
+    """Python value of a column type for one raw mode value (None or NaN is null)."""
+    if value is None:
+        return None
+    if kind == 'string':
+        return str(value)
+    if kind == 'int64':
+        return int(value)
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def table_row(header, window, fields):
+    """Typed values of one scan.py mode row (raw values following header) of a BED window (chrom, start, end)."""
+    chrom, start, end = window
+    row = []
+    for name, field in zip(header, fields):
+        row.append(typed_value(field, column_type('PI' if name == 'PICA_OUTPUT' else name)))
+        if name == 'REGION':
+            row += [chrom, int(start), int(end)]
+    return row
+
+
+def format_value(value):
+    """TSV text of a typed value; floats keep every digit (repr)."""
+    return 'NA' if value is None else str(value)
+
+
+class WindowTableWriter:
+    """Write typed window rows to Parquet (pyarrow) or TSV, BATCH_ROWS at a time."""
+
+    def __init__(self, path, header, batch_rows=BATCH_ROWS):
+        self.header = list(header)
+        self.columns = table_columns(header)
+        self.types = [column_type(name) for name in self.columns]
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.parquet = None
+        self.handle = None
+        if path.endswith('.parquet') and pq is None:
+            fallback = path[:-len('.parquet')] + '.tsv'
+            print(f"Warning: pyarrow is not installed, writing the window table to {fallback} as TSV",
+                  file=sys.stderr)
+            path = fallback
+        self.path = path
+        if path.endswith('.parquet'):
+            self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in zip(self.columns, self.types)])
+            self.parquet = pq.ParquetWriter(path, self.schema)
+        else:
+            self.handle = open(path, 'w')
+            print('\t'.join(self.columns), file=self.handle)
+
+    def write(self, window, fields):
+        """Add one scan.py output row of the BED window (chrom, start, end)."""
+        self.rows.append(table_row(self.header, window, fields))
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.parquet is not None:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*self.rows), self.schema)]
+            self.parquet.write_table(pa.Table.from_batches([pa.RecordBatch.from_arrays(arrays, schema=self.schema)]))
+        else:
+            self.handle.writelines('\t'.join(map(format_value, row)) + '\n' for row in self.rows)
+            self.handle.flush()
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.parquet is not None:
+            self.parquet.close()
+        else:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_window_table(path, columns=None):
+    """Load a window table (Parquet or TSV) as a dict column -> list of values, optionally only some columns."""
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ValueError(f"pyarrow is needed to read {path}")
+        return pq.read_table(path, columns=columns).to_pydict()
+    with open(path, newline='') as handle:
+        reader = csv.reader(handle, delimiter='\t')
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"File {path} is empty or missing a header")
+        wanted = header if columns is None else list(columns)
+        missing = [name for name in wanted if name not in header]
+        if missing:
+            raise ValueError(f"File {path} has no column(s): {', '.join(missing)}")
+        positions = [header.index(name) for name in wanted]
+        kinds = [column_type(name) for name in wanted]
+        table = {name: [] for name in wanted}
+        for fields in reader:
+            for name, pos, kind in zip(wanted, positions, kinds):
+                table[name].append(parse_value(fields[pos], kind))
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print columns of a scan.py window table (Parquet or TSV)')
+    parser.add_argument('table', help='window table written by scan.py --table')
+    parser.add_argument('-c', '--columns', nargs='+', help='columns to print (default: all)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.table):
+        print(f"Error: File not found: {args.table}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        table = read_window_table(args.table, args.columns)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print('\t'.join(table))
+    for row in zip(*table.values()):
+        print('\t'.join(map(format_value, row)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,371 @@
 import argparse
 import numpy as np 
 import gzip
+import os
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from hapbits import PackedHaplotypes, convert_text, is_packed, read_packed
+
+# Focal sites handed to one scan worker at a time
+CHUNK_SITES = 2000
+
+def homozygous_pairs(haplotypes):
+    """Number of haplotype pairs identical over columns 0..i, for every i.
+
+    The haplotypes are partitioned by their prefix and the partition is
+    refined one column at a time: each group splits on the new column's
+    value, and identical pairs are Σ C(size, 2) over the groups. Each step
+    is a sort of n labels instead of a comparison of all n² pairs, and the
+    scan stops once every haplotype is alone in its group.
+    """
+    num_haplotypes, length = haplotypes.shape
+    pairs = np.zeros(length, dtype=np.int64)
+    labels = np.zeros(num_haplotypes, dtype=np.int64)
+    for i in range(length):
+        _, values = np.unique(haplotypes[:, i], return_inverse=True)
+        _, labels = np.unique(labels * (values.max() + 1) + values.ravel(), return_inverse=True)
+        sizes = np.bincount(labels.ravel())
+        pairs[i] = (sizes * (sizes - 1) // 2).sum()
+        if pairs[i] == 0:
+            break
+    return pairs
+
 
 def calc_EHH(haplotypes):
     num_haplotypes = haplotypes.shape[0]
     EHH = np.zeros(haplotypes.shape[1])
+    if haplotypes.shape[1] == 0:
+        return EHH
+    if num_haplotypes < 2:
+        return np.full(haplotypes.shape[1], fill_value=500)
 
-    for i in range(haplotypes.shape[1]):
-        homozygous_pairs = 0
-        for j in range(num_haplotypes):
-            for k in range(j+1, num_haplotypes):
-                if np.all(haplotypes[j,:i+1] == haplotypes[k,:i+1]):
-                    homozygous_pairs += 1
-
-        if num_haplotypes < 2:
-            return np.full(haplotypes.shape[1], fill_value=500)
-        else: 
-            EHH[i] = round(homozygous_pairs / (num_haplotypes * (num_haplotypes - 1) / 2), 3) 
+    total_pairs = num_haplotypes * (num_haplotypes - 1) / 2
+    for i, pairs in enumerate(homozygous_pairs(haplotypes).tolist()):
+        EHH[i] = round(pairs / total_pairs, 3)
     return EHH
 
 
+def pbwt_sweep(haplotypes):
+    """Positional prefix sort of binary haplotypes, one column at a time.
+
+    Yields (k, lcp, n_zero) for every column k: after column k the
+    haplotypes are ordered by their reversed prefix (column k, k-1, ...),
+    so the carriers of allele 0 at k come first (n_zero of them) and those
+    of allele 1 after. lcp[i] is the number of columns, ending at k, over
+    which the i-th haplotype of that order matches the (i-1)-th. Each
+    column updates the previous order and lcp in O(n), so neighbouring
+    focal sites share all the work.
+    """
+    num_haplotypes = haplotypes.shape[0]
+    order = np.arange(num_haplotypes)
+    lcp = np.zeros(num_haplotypes, dtype=np.int64)
+    for k in range(haplotypes.shape[1]):
+        column = haplotypes[order, k]
+        zeros = np.flatnonzero(column == 0)
+        ones = np.flatnonzero(column != 0)
+        new_lcp = np.zeros(num_haplotypes, dtype=np.int64)
+        for start, members in ((0, zeros), (len(zeros), ones)):
+            if len(members) > 1:
+                # Match with the previous member = shortest match over the haplotypes in between, plus column k
+                new_lcp[start + 1:start + len(members)] = \
+                    np.minimum.reduceat(lcp[:members[-1] + 1], members[:-1] + 1) + 1
+        order = np.concatenate((order[zeros], order[ones]))
+        lcp = new_lcp
+        yield k, lcp, len(zeros)
+
+
+def integrate_ehh(links, max_length, cutoff):
+    """iHH of a set of haplotypes from the match lengths of consecutive members.
+
+    links are the match lengths between neighbours in prefix-sorted order;
+    a pair matches over l sites exactly when every link between them is at
+    least l. EHH(l) is integrated (one term per site, as in calc_EHH) up to
+    max_length sites, stopping where EHH drops below cutoff.
+    """
+    total_pairs = (len(links) + 1) * len(links) / 2
+    links = np.minimum(links, max_length)
+    levels = np.unique(links[links > 0])
+    if total_pairs == 0 or len(levels) == 0:
+        return 0.0
+    # Pairs matching over >= level sites: sum of C(run + 1, 2) over runs of links >= level,
+    # with the runs of every level found at once from the edges of a padded 0/1 matrix
+    width = len(links) + 1
+    above = np.zeros((len(levels), width + 1), dtype=np.int8)
+    above[:, 1:-1] = links[None, :] >= levels[:, None]
+    edges = np.diff(above, axis=1).ravel()
+    starts = np.flatnonzero(edges == 1)
+    runs = np.flatnonzero(edges == -1) - starts
+    pairs = np.bincount(starts // width, weights=runs * (runs + 1) / 2, minlength=len(levels))
+    ehh = pairs / total_pairs
+    keep = ehh >= cutoff
+    return float((np.diff(levels, prepend=0) * ehh)[keep].sum())
+
+
+def _sweep_ihh(lcp, n_zero, reach, cutoff, carriers):
+    if not carriers:
+        return [integrate_ehh(lcp[1:], reach, cutoff)]
+    ihh = []
+    for start, end in ((0, n_zero), (n_zero, len(lcp))):
+        # Carriers match at the focal site itself; EHH is measured beyond it
+        ihh.append(integrate_ehh(lcp[start + 1:end] - 1, reach, cutoff) if end - start > 1 else np.nan)
+    return ihh
+
+
+def focal_ihh(haplotypes, focal_start, focal_end, max_ext, cutoff, carriers=True):
+    """iHH at every focal column in [focal_start, focal_end).
+
+    EHH is extended up to max_ext sites to the left and to the right and
+    the two integrals are summed. With carriers, returns an (n_sites, 2)
+    array with the iHH of the allele 0 and allele 1 carriers (EHH beyond
+    the focal site, NaN with fewer than two carriers); otherwise an
+    (n_sites, 1) array for all haplotypes (EHH including the focal site).
+    """
+    n_cols = haplotypes.shape[1]
+    skip = 1 if carriers else 0
+    ihh = np.zeros((focal_end - focal_start, 2 if carriers else 1))
+
+    left = max(0, focal_start - max_ext - 1)
+    for k, lcp, n_zero in pbwt_sweep(haplotypes[:, left:focal_end]):
+        focal = left + k
+        if focal >= focal_start:
+            reach = min(max_ext, focal + 1 - skip)
+            ihh[focal - focal_start] += _sweep_ihh(lcp, n_zero, reach, cutoff, carriers)
+
+    right = min(n_cols, focal_end + max_ext + 1)
+    for k, lcp, n_zero in pbwt_sweep(haplotypes[:, focal_start:right][:, ::-1]):
+        focal = right - 1 - k
+        if focal < focal_end:
+            reach = min(max_ext, n_cols - focal - skip)
+            ihh[focal - focal_start] += _sweep_ihh(lcp, n_zero, reach, cutoff, carriers)
+    return ihh
+
+
+def _scan_chunk(task):
+    blocks, focal_start, focal_end, max_ext, cutoff, carriers = task
+    return [focal_ihh(block, focal_start, focal_end, max_ext, cutoff, carriers) for block in blocks]
+
+
+def scan_ihh(matrices, max_ext, cutoff, carriers, threads):
+    """focal_ihh over every column, in chunks of CHUNK_SITES evaluated by a process pool.
+
+    matrices are PackedHaplotypes; each chunk unpacks only its focal
+    columns plus max_ext + 1 flanking columns on both sides, and at most
+    two chunks per worker are in flight. Returns one array per input matrix.
+    """
+    n_cols = matrices[0].shape[1]
+
+    def tasks():
+        for start in range(0, n_cols, CHUNK_SITES):
+            end = min(n_cols, start + CHUNK_SITES)
+            lo = max(0, start - max_ext - 1)
+            hi = min(n_cols, end + max_ext + 1)
+            yield [m.block(lo, hi) for m in matrices], start - lo, end - lo, max_ext, cutoff, carriers
+
+    if threads > 1:
+        chunks = []
+        with ProcessPoolExecutor(max_workers=threads) as pool:
+            pending = deque()
+            for task in tasks():
+                pending.append(pool.submit(_scan_chunk, task))
+                if len(pending) >= 2 * threads:
+                    chunks.append(pending.popleft().result())
+            chunks.extend(future.result() for future in pending)
+    else:
+        chunks = [_scan_chunk(task) for task in tasks()]
+    if not chunks:
+        return [np.zeros((0, 2 if carriers else 1)) for _ in matrices]
+    return [np.concatenate([chunk[i] for chunk in chunks]) for i in range(len(matrices))]
+
+
+def standardize(values, bins=None):
+    """(x - mean) / sd, within bins when given; NaN where undefined."""
+    out = np.full(len(values), np.nan)
+    groups = np.zeros(len(values), dtype=int) if bins is None else bins
+    for group in np.unique(groups):
+        members = (groups == group) & np.isfinite(values)
+        if members.sum() < 2:
+            continue
+        sd = values[members].std()
+        if sd > 0:
+            out[members] = (values[members] - values[members].mean()) / sd
+    return out
+
+
+def log_ratio(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.log(a / b)
+    ratio[~np.isfinite(ratio)] = np.nan
+    return ratio
+
+
+def fmt(value):
+    return "NA" if not np.isfinite(value) else f"{value:.6f}"
+
+
+def scan_ihs(haplotypes, ref_row, max_ext, cutoff, threads, n_bins, out):
+    """iHS at every site where both alleles have at least two carriers."""
+    ihh, = scan_ihh([haplotypes], max_ext, cutoff, True, threads)
+    n = haplotypes.shape[0]
+    if ref_row is not None:
+        ref = haplotypes.row(ref_row)
+        alt_count = haplotypes.count_differing(ref_row)
+    else:
+        ref = np.zeros(haplotypes.shape[1], dtype=np.uint8)
+        alt_count = haplotypes.allele_counts()
+    ihh_ref = np.where(ref == 0, ihh[:, 0], ihh[:, 1])
+    ihh_alt = np.where(ref == 0, ihh[:, 1], ihh[:, 0])
+    alt_freq = alt_count / n
+
+    sites = np.flatnonzero((alt_count >= 2) & (n - alt_count >= 2))
+    unstd = log_ratio(ihh_ref[sites], ihh_alt[sites])
+    bins = np.minimum((alt_freq[sites] * n_bins).astype(int), n_bins - 1)
+    ihs = standardize(unstd, bins)
+
+    print("SITE\tREF\tALT_FREQ\tIHH_REF\tIHH_ALT\tIHS_UNSTD\tIHS", file=out)
+    for i, site in enumerate(sites):
+        print(site + 1, ref[site], f"{alt_freq[site]:.6f}", fmt(ihh_ref[site]), fmt(ihh_alt[site]),
+              fmt(unstd[i]), fmt(ihs[i]), sep='\t', file=out)
+
+
+def scan_xpehh(pop_a, pop_b, max_ext, cutoff, threads, out):
+    """XP-EHH between two populations at every site."""
+    ihh_a, ihh_b = scan_ihh([pop_a, pop_b], max_ext, cutoff, False, threads)
+    unstd = log_ratio(ihh_a[:, 0], ihh_b[:, 0])
+    xpehh = standardize(unstd)
+
+    print("SITE\tIHH_A\tIHH_B\tXPEHH_UNSTD\tXPEHH", file=out)
+    for site in range(len(unstd)):
+        print(site + 1, fmt(ihh_a[site, 0]), fmt(ihh_b[site, 0]), fmt(unstd[site]), fmt(xpehh[site]),
+              sep='\t', file=out)
+
+
+def load_haplotypes(path, workdir=None):
+    """Load a haplotype matrix as PackedHaplotypes, with non-zero entries recoded as allele 1.
+
+    Packed files (hapbits.py) are memory-mapped. Text matrices are packed
+    into workdir and memory-mapped from there when it is given, otherwise
+    packed in memory.
+    """
+    if is_packed(path):
+        return read_packed(path)
+    if workdir is None:
+        return PackedHaplotypes.from_dense(np.loadtxt(path, ndmin=2))
+    fd, packed = tempfile.mkstemp(dir=workdir, suffix='.hapbits')
+    os.close(fd)
+    convert_text(path, packed)
+    return read_packed(packed)
+
+
+def sliding_windows(haplotypes, size, step):
+    """Yield (start, window) for windows of size sites starting every step sites.
+
+    The columns live in a ring buffer of size columns: each window only
+    unpacks the step sites it adds (all size sites when step >= size), so
+    memory stays bounded by the window, not by the number of sites. The
+    last window may be narrower than size; windows are float64 copies the
+    caller may modify.
+    """
+    n_haplotypes, n_sites = haplotypes.shape
+    ring = np.zeros((n_haplotypes, size), dtype=np.float64)
+    head = 0  # ring column holding the window's first site
+    loaded = 0  # sites [loaded - size, loaded) are in the ring
+    for start in range(0, n_sites, step):
+        end = min(n_sites, start + size)
+        lo = max(start, loaded)
+        if lo < end:
+            block = haplotypes.block(lo, end)
+            slots = np.arange(lo, end) % size
+            ring[:, slots] = block
+            loaded = end
+        head = start % size
+        width = end - start
+        if head + width <= size:
+            yield start, ring[:, head:head + width].copy()
+        else:
+            yield start, np.concatenate((ring[:, head:], ring[:, :head + width - size]), axis=1)
+
+
+def run_scan(args):
+    if args.maxext < 1:
+        print("Error: -maxext must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    workdir = tempfile.TemporaryDirectory(prefix='ehhgfa.')
+    haplotypes = load_haplotypes(args.i, workdir.name)
+    out = open(args.o, "w") if args.o else sys.stdout
+    try:
+        if args.scan == 'ihs':
+            ref_row = args.refpos - 1 if args.refpos else None
+            if ref_row is not None and not 0 <= ref_row < haplotypes.shape[0]:
+                print(f"Error: -refpos must be between 1 and {haplotypes.shape[0]}", file=sys.stderr)
+                sys.exit(1)
+            scan_ihs(haplotypes, ref_row, args.maxext, args.cutoff, args.t, args.bins, out)
+        else:
+            if not args.xp:
+                print("Error: -scan xpehh needs the second population's matrix (-xp)", file=sys.stderr)
+                sys.exit(1)
+            pop_b = load_haplotypes(args.xp, workdir.name)
+            if pop_b.shape[1] != haplotypes.shape[1]:
+                print("Error: -i and -xp matrices must have the same sites (columns)", file=sys.stderr)
+                sys.exit(1)
+            scan_xpehh(haplotypes, pop_b, args.maxext, args.cutoff, args.t, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        workdir.cleanup()
+
+
 def main():
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser()
 
     # Add command-line arguments
-    parser.add_argument("-i", help="Path to the input file, matrix of haplotypes, no header")
+    parser.add_argument("-i", help="Path to the input file, matrix of haplotypes, no header, or a packed matrix from hapbits.py")
     parser.add_argument("-p",  type=int, help="Position of the test SNP in the haplotype window")
     parser.add_argument("-w",  type=int, help="Window size")
+    parser.add_argument("-step", type=int, help="sites between consecutive window starts; smaller than -w gives overlapping windows (default: -w)")
     #parser.add_argument("-rwn",  type=str, help="file with row names ")
     parser.add_argument("-refpos",  type=int, help="reference position ")
     parser.add_argument("-o",  type=str, help="outputfile  ")
+    parser.add_argument("-scan", choices=["ihs", "xpehh"],
+                        help="scan every site as focal SNP: iHS (REF vs ALT carriers, REF from -refpos, "
+                             "else allele 0) or XP-EHH between -i and -xp")
+    parser.add_argument("-xp", type=str, help="haplotype matrix of the second population (XP-EHH, text or packed), same sites as -i")
+    parser.add_argument("-maxext", type=int, default=1000, help="maximum EHH extension in sites on each side (default: 1000)")
+    parser.add_argument("-cutoff", type=float, default=0.05, help="stop integrating once EHH drops below this (default: 0.05)")
+    parser.add_argument("-bins", type=int, default=20, help="ALT frequency bins used to standardise iHS (default: 20)")
+    parser.add_argument("-t", type=int, default=1, help="worker processes for -scan (default: 1)")
     # Parse the command-line arguments
     args = parser.parse_args()
+    if args.scan:
+        run_scan(args)
+        return
+
+    if args.w is None or args.p is None or args.refpos is None:
+        print("Error: window mode needs -w, -p and -refpos", file=sys.stderr)
+        sys.exit(1)
+    if not 1 <= args.p <= args.w:
+        print("Error: -p must be between 1 and the window size (-w)", file=sys.stderr)
+        sys.exit(1)
+    step = args.step if args.step is not None else args.w
+    if step < 1:
+        print("Error: -step must be at least 1", file=sys.stderr)
+        sys.exit(1)
 
     #actions 
     sys.stdout = open(args.o, "w") 
 
-    whole = np.loadtxt(args.i)  # load haplotype matrix 
+    workdir = tempfile.TemporaryDirectory(prefix='ehhgfa.')
+    whole = load_haplotypes(args.i, workdir.name)  # packed haplotype matrix, streamed window by window
     testSNP=args.p-1     # 0-based position of test SNP in the window 
     window_size=args.w
     window_name=1 
-    colstart=0
-    colend=colstart+window_size
-    for i in range (whole.shape[1]): 
+    for colstart, window in sliding_windows(whole, window_size, step):
+        colend=colstart+window_size
         #print ('check',  window_name)
-        window=whole[0:, colstart:colend]
-        window[window != 0] = 1 # replace non zero  non one with one  (see exampple DARC ) 
-        #print ('nonzero')
-        if window.shape[1]==0: continue   # skip empty windows 
+        if window.shape[1] <= testSNP + 1: break   # last window ends at or before the test SNP 
         testAlleles= np.unique(window[:, testSNP])
         refall=window[args.refpos-1 ,testSNP]
         #if len(testAlleles)==1: continue  # skip monomorphic sites 
@@ -65,8 +381,7 @@ def main():
             #print( window_name, colstart, colend, al, integral, " ".join(map (str, ehhvec)))  # flip again teh revers to rpvide results in order of position 
             typeal='REF' if  al==refall else  'ALT'
             print (window_name, colstart, colend, al ,typeal,  area , flush=True)
-        colstart=colend
-        colend=colstart+window_size
         window_name+=1 
+    workdir.cleanup()
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+hapbits.py - Bit-packed haplotype matrices for the EHH tools
+
+The text input of ehhgfa.py has one haplotype per line and one
+whitespace-separated allele per site (non-zero = allele 1). Loaded with
+np.loadtxt that is 8 bytes per allele: ~3.5 GB for 446 haplotypes x 1M sites.
+
+The packed format keeps one bit per allele, column-major:
+
+    'HAPBITS1' | n_haplotypes (uint64) | n_sites (uint64) | words
+
+words holds n_sites rows of ceil(n_haplotypes / 64) little-endian uint64;
+the allele of haplotype h at site k is bit h % 64 of word h // 64 in row k.
+Files are memory-mapped, so a site costs n_haplotypes / 8 bytes and only
+the sites being scanned are read.
+
+Usage:
+    python3 hapbits.py haplotypes.txt haplotypes.hapbits
+"""
+
+import argparse
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'HAPBITS1'
+HEADER = struct.Struct('<8sQQ')
+
+
+def words_per_site(n_haplotypes):
+    return max(1, -(-n_haplotypes // 64))
+
+
+def popcount(words):
+    """Number of set bits in every uint64 of words."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=-1)
+    return bits.reshape(words.shape + (64,)).sum(axis=-1)
+
+
+class PackedHaplotypes:
+    """Haplotypes x sites binary matrix stored as column-major 64-bit words."""
+
+    def __init__(self, words, n_haplotypes):
+        self.words = words
+        self.n_haplotypes = n_haplotypes
+
+    @property
+    def shape(self):
+        return (self.n_haplotypes, self.words.shape[0])
+
+    @classmethod
+    def from_dense(cls, haplotypes):
+        """Pack a (haplotypes, sites) array; non-zero entries become allele 1."""
+        n_haplotypes, n_sites = haplotypes.shape
+        packed = np.packbits(np.asarray(haplotypes).T != 0, axis=1, bitorder='little')
+        words = np.zeros((n_sites, words_per_site(n_haplotypes) * 8), dtype=np.uint8)
+        words[:, :packed.shape[1]] = packed
+        return cls(words.view('<u8'), n_haplotypes)
+
+    def block(self, start, end):
+        """Dense uint8 (haplotypes, end - start) array of sites start..end-1."""
+        words = np.ascontiguousarray(self.words[start:end])
+        bits = np.unpackbits(words.view(np.uint8), axis=1, count=self.n_haplotypes, bitorder='little')
+        return np.ascontiguousarray(bits.T)
+
+    def row(self, haplotype):
+        """Alleles of one haplotype at every site."""
+        word = self.words[:, haplotype // 64]
+        return ((word >> np.uint64(haplotype % 64)) & np.uint64(1)).astype(np.uint8)
+
+    def allele_counts(self):
+        """Number of allele-1 carriers at every site."""
+        return popcount(self.words).sum(axis=1)
+
+    def count_differing(self, haplotype):
+        """Number of haplotypes whose allele differs from haplotype's, at every site.
+
+        Each site's words are XORed with the haplotype's allele broadcast over
+        all valid bits, so 64 equality tests run per word operation.
+        """
+        ones = np.full(self.words.shape[1], np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+        tail = self.n_haplotypes % 64
+        if tail:
+            ones[-1] = np.uint64((1 << tail) - 1)
+        flip = self.row(haplotype).astype(bool)
+        differing = np.where(flip[:, None], self.words ^ ones, self.words)
+        return popcount(differing).sum(axis=1)
+
+
+def is_packed(path):
+    with open(path, 'rb') as handle:
+        return handle.read(len(MAGIC)) == MAGIC
+
+
+def read_packed(path):
+    """Memory-map a packed haplotype file."""
+    with open(path, 'rb') as handle:
+        magic, n_haplotypes, n_sites = HEADER.unpack(handle.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a packed haplotype file")
+    words = np.memmap(path, dtype='<u8', mode='r', offset=HEADER.size,
+                      shape=(n_sites, words_per_site(n_haplotypes)))
+    return PackedHaplotypes(words, n_haplotypes)
+
+
+def convert_text(text_path, packed_path):
+    """Convert a whitespace haplotype matrix to the packed format.
+
+    The text is read twice, one haplotype line at a time (sizes first,
+    then the bits), so memory is bounded by a single line.
+    """
+    n_haplotypes = 0
+    n_sites = None
+    with open(text_path) as handle:
+        for line in handle:
+            if line.strip():
+                if n_sites is None:
+                    n_sites = len(line.split())
+                n_haplotypes += 1
+    if n_haplotypes == 0:
+        raise ValueError(f"{text_path} has no haplotypes")
+
+    with open(packed_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, n_haplotypes, n_sites))
+        out.truncate(HEADER.size + n_sites * words_per_site(n_haplotypes) * 8)
+    words = np.memmap(packed_path, dtype='<u8', mode='r+', offset=HEADER.size,
+                      shape=(n_sites, words_per_site(n_haplotypes)))
+
+    with open(text_path) as handle:
+        h = 0
+        for line in handle:
+            if not line.strip():
+                continue
+            alleles = np.array(line.split(), dtype=np.float64) != 0
+            if len(alleles) != n_sites:
+                raise ValueError(f"Haplotype {h + 1} has {len(alleles)} sites, expected {n_sites}")
+            words[:, h // 64] |= alleles.astype(np.uint64) << np.uint64(h % 64)
+            h += 1
+    words.flush()
+    del words
+    return n_haplotypes, n_sites
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a whitespace haplotype matrix to the packed format')
+    parser.add_argument('input', help='haplotype matrix: one haplotype per line, one allele per site, no header')
+    parser.add_argument('output', help='packed haplotype file to write')
+    args = parser.parse_args()
+
+    try:
+        n_haplotypes, n_sites = convert_text(args.input, args.output)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Packed {n_haplotypes} haplotypes x {n_sites} sites into {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,250 @@
 #!/usr/bin/env python3
-import pandas as pd
+"""
+op-afs.py - Allele-frequency spectra and neutrality statistics
+
+Input is a tab-separated matrix with a header line: one row per haplotype,
+three leading annotation columns (the first is the haplotype identifier)
+and one integer-coded column per site. Codes >= 0 are alleles; negative or
+non-numeric entries are missing, and a site with missing calls in a
+population is left out of that population's spectrum.
+
+Allele counts for every site and every allele come from one np.bincount
+over the coded matrix. For each population (all rows, or -g NAME=FILE
+sample lists) the script builds:
+  - the unfolded SFS: counts of every allele other than the ancestral one
+    (code 0, or the allele of the --ancestral row);
+  - the folded SFS: counts of every allele other than the most frequent,
+    folded to min(count, n - count).
+and reports θW, θπ, θH, θL, Tajima's D and Fay & Wu's H (raw and
+normalised as in Zeng et al. 2006) computed from the spectrum. S counts
+segregating sites: a multi-allelic site adds every derived allele to the
+spectrum but one site to S. Sample lists are matched to the row
+identifiers (impg names such as HG00097#1#...) as h-fst.py does.
+
+Usage:
+    python3 op-afs.py matrix.tsv -g EUR=agc.EUR -g AFR=agc.AFR --sfs afs.sfs.tsv --npz afs.npz
+"""
+
+import argparse
+import importlib
+import math
+import os
 import sys
-import matplotlib.pyplot as plt
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tj_d import tajimas_d  # noqa: E402
+
+hfst = importlib.import_module('h-fst')
 
 
 def read_file_to_matrix(file_path):
+    """Read the haplotype matrix; returns (row identifiers, site labels, int64 codes with -1 for missing)."""
     try:
-        df = pd.read_csv(file_path, sep='\t') #, index_col=0)
-        return df
-    except Exception as e:
-        print(f"Failed to read file {file_path}: {e}")
+        with open(file_path) as f:
+            header = f.readline().rstrip('\n').split('\t')
+            ids = []
+            rows = []
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 2:
+                    continue
+                ids.append(fields[0])
+                rows.append(fields[3:])
+    except OSError as e:
+        print(f"Error: Failed to read file {file_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    sites = header[3:]
+    if any(len(row) != len(sites) for row in rows):
+        print(f"Error: Rows of {file_path} do not all have {len(sites)} site columns", file=sys.stderr)
         sys.exit(1)
 
-def are_elements_equal(vector):
-    """
-    Check if all elements in the vector are equal.
-    Args: - vector: A list or vector of elements.
-    Returns:- True if all elements are equal, False otherwise.
-    """
-    if not vector:  # Check if the vector is empty
-        return True  # Can decide based on context; here, an empty vector is considered to have "equal" elements
-    # Check if all elements in the vector are equal to the first element
-    return all(element == vector[0] for element in vector)
+    try:
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), len(sites))
+    except ValueError:
+        values = np.array([[_parse_code(v) for v in row] for row in rows], dtype=np.float64).reshape(len(rows), len(sites))
+    called = np.isfinite(values) & (values >= 0)
+    codes = np.where(called, np.nan_to_num(values), -1).astype(np.int64)
+    return ids, sites, codes
 
-def allele_freq(values, label):
-    """
-    Process a list of values to count occurrences of each unique value.does not consider lists in which all elements are equal 
-    Args: - values: A list of values; - label: A label associated with the values.
-    Returns: - None, but prints counts of each unique value prefixed by the label.
-    """
-    if not are_elements_equal(values): 
-        total_values = len(values)
-        value_counts = {}
-        for value in values:
-            if value not in value_counts:
-                value_counts[value] = 1
-            else:
-                value_counts[value] += 1
-        # Format the output
-        for value, count in value_counts.items():
-            #print(f"{label} {value} {count}")
-            freq=count/total_values
-            return label, value, count, freq 
-    else: pass 
-
-def plot_histogram(vector, bins='auto', title='Histogram', xlabel='Values', ylabel='Frequency',  save_path='histogram.png'):
-    """
-    Plots a histogram from a vector of values.
-
-    Args:
-    - vector: A list or array of values to plot.
-    - bins: The number of bins or the binning strategy (default 'auto').
-    - title: Title of the histogram (default 'Histogram').
-    - xlabel: Label for the X-axis (default 'Values').
-    - ylabel: Label for the Y-axis (default 'Frequency').
-    """
-    plt.figure(figsize=(8, 6))  # Optional: Adjust figure size
-    plt.hist(vector, bins=bins, color='skyblue', edgecolor='black', alpha=0.7)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.grid(axis='y', alpha=0.75)  # Optional: Add grid lines for better readability
-  # Save the figure to a PNG file
-    plt.savefig(save_path)
-    plt.close()  # Close the figure to free memory
-
-def plot_histograms_from_dict(data_dict, bins='auto', title='Histograms from Vectors', xlabel='Values', ylabel='Frequency', save_path='histograms.png'):
-    """
-    Plots multiple histograms from vectors stored in a dictionary. Each vector is plotted in a separate panel.
-    
-    Args:
-    - data_dict: A dictionary where each key-value pair corresponds to a label and its associated vector of values.
-    - bins: The number of bins or the binning strategy for the histograms (default 'auto').
-    - title: Overall title for the plot (default 'Histograms from Vectors').
-    - xlabel: Label for the X-axis (default 'Values').
-    - ylabel: Label for the Y-axis (default 'Frequency').
-    - save_path: Path where the plot will be saved as a PNG file (default 'histograms.png').
+
+def _parse_code(value):
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def allele_counts(codes, n_alleles):
+    """(sites, n_alleles) counts of every allele code at every site, from one bincount."""
+    n_sites = codes.shape[1]
+    called = codes >= 0
+    site_index = np.broadcast_to(np.arange(n_sites), codes.shape)[called]
+    flat = np.bincount(site_index * n_alleles + codes[called], minlength=n_sites * n_alleles)
+    return flat.reshape(n_sites, n_alleles)
+
+
+def unfolded_sfs(counts, n, ancestral):
+    """Unfolded SFS (length n + 1) from complete sites; ancestral is the ancestral code per site (-1: unknown)."""
+    derived = counts.copy()
+    known = ancestral >= 0
+    derived[np.flatnonzero(known), ancestral[known]] = 0
+    derived = derived[known]
+    return np.bincount(derived[derived > 0], minlength=n + 1)[:n + 1]
+
+
+def folded_sfs(counts, n):
+    """Folded SFS (length n // 2 + 1): every allele but the most frequent, folded to min(c, n - c)."""
+    minor = counts.copy()
+    minor[np.arange(len(minor)), minor.argmax(axis=1)] = 0
+    minor = np.minimum(minor[minor > 0], n - minor[minor > 0])
+    return np.bincount(minor, minlength=n // 2 + 1)[:n // 2 + 1]
+
+
+def segregating_sites(counts):
+    """Number of sites (rows of allele counts) with more than one allele."""
+    return int((np.count_nonzero(counts, axis=1) > 1).sum())
+
+
+def spectrum_statistics(sfs, n, S):
+    """θ estimators, Tajima's D and Fay & Wu's H from an unfolded SFS of n haplotypes and S segregating sites.
+
+    Only the segregating classes 1..n-1 are used. With a folded spectrum,
+    θW, θπ and Tajima's D are still valid; θH, θL and H are not.
     """
-    num_vectors = len(data_dict)
-    fig, axs = plt.subplots(num_vectors, 1, figsize=(8, 6 * num_vectors))  # Adjust the figure size as needed
-    
-    if num_vectors == 1:
-        axs = [axs]  # Make sure axs is iterable for a single subplot
-    
-    for ax, (label, vector) in zip(axs, data_dict.items()):
-        ax.hist(vector, bins=bins, color='skyblue', edgecolor='black', alpha=0.7)
-        ax.set_title(f'{label}')
-        ax.set_xlabel(xlabel)
-        ax.set_ylabel(ylabel)
+    i = np.arange(len(sfs))
+    xi = np.where((i > 0) & (i < n), sfs, 0).astype(np.float64)
+    pairs = n * (n - 1) / 2
+    a1 = (1.0 / np.arange(1, n)).sum()
+    b1 = (1.0 / np.arange(1, n) ** 2).sum()
+    theta_w = S / a1
+    theta_pi = (i * (n - i) * xi).sum() / pairs
+    theta_h = (i * i * xi).sum() / pairs
+    theta_l = (i * xi).sum() / (n - 1)
+
+    D = tajimas_d(n, S, theta_pi) if S > 0 else math.nan
+    fay_wu_h = theta_pi - theta_h
+    theta_sq = S * (S - 1) / (a1 * a1 + b1)
+    b1_next = b1 + 1.0 / (n * n)
+    var = (n - 2) / (6 * (n - 1)) * theta_w \
+        + (18 * n * n * (3 * n + 2) * b1_next - (88 * n ** 3 + 9 * n * n - 13 * n + 6)) / (9 * n * (n - 1) ** 2) * theta_sq
+    fay_wu_h_norm = (theta_pi - theta_l) / math.sqrt(var) if var > 0 else math.nan
+    return {
+        'segregating_sites': int(S), 'theta_w': theta_w, 'theta_pi': theta_pi, 'theta_h': theta_h,
+        'theta_l': theta_l, 'tajima_d': D, 'fay_wu_h': fay_wu_h, 'fay_wu_h_norm': fay_wu_h_norm,
+    }
+
+
+def fmt(value):
+    return "NA" if value is None or not np.isfinite(value) else f"{value:.6f}"
+
+
+def plot_spectra(spectra, save_path):
+    """Bar chart of every population's spectrum (needs matplotlib)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axs = plt.subplots(len(spectra), 1, figsize=(8, 4 * len(spectra)), squeeze=False)
+    for ax, (label, sfs) in zip(axs[:, 0], spectra.items()):
+        ax.bar(np.arange(1, len(sfs)), sfs[1:], color='skyblue', edgecolor='black')
+        ax.set_title(label)
+        ax.set_xlabel('Allele count')
+        ax.set_ylabel('Alleles')
         ax.grid(axis='y', alpha=0.75)
-    
-    plt.tight_layout(pad=3.0)
-    plt.suptitle(title, va='top')
-    plt.subplots_adjust(top=0.95)  # Adjust top spacing to accommodate the main title
-    plt.savefig(save_path)
+    fig.tight_layout()
+    fig.savefig(save_path)
+    plt.close(fig)
 
 
 def main():
-    # Check for command-line argument for file path
-    if len(sys.argv) < 2:
-        print("Usage: script.py <file_path>")
+    parser = argparse.ArgumentParser(description='Allele-frequency spectra, θ estimators, Tajima\'s D and Fay & Wu\'s H')
+    parser.add_argument('matrix', help='tab-separated haplotype matrix with header: 3 annotation columns, then one integer-coded column per site')
+    parser.add_argument('-g', '--population', action='append', default=[], metavar='NAME=FILE',
+                        help='population sample list (repeatable; default: one population of all rows)')
+    parser.add_argument('--ancestral', metavar='ID',
+                        help='row holding the ancestral allele (excluded from the populations); default: allele code 0')
+    parser.add_argument('-o', '--output', help='statistics table (default: stdout)')
+    parser.add_argument('--sfs', help='write the spectra as a long TSV table')
+    parser.add_argument('--npz', help='write the spectra to a NumPy .npz archive')
+    parser.add_argument('--plot', help='plot the unfolded spectra to this image (needs matplotlib)')
+    args = parser.parse_args()
+
+    ids, sites, codes = read_file_to_matrix(args.matrix)
+    if not sites or not ids:
+        print(f"Error: No sites or haplotypes in {args.matrix}", file=sys.stderr)
         sys.exit(1)
-        pass
-
-    file_path = sys.argv[1]
-    matrix_df = read_file_to_matrix(file_path)
-
-   # print (matrix_df.info())
-    # Process each vector (column) in the matrix starting from the 4th column
-    counts_d={}; counts_f={}
-    for column in matrix_df.columns[3:]:
-        label=column
-        values = matrix_df[column].iloc[0:].tolist()  # Rest of the column values
-        label, value, count, freq= allele_freq(values, label)
-        counts_d.setdefault(value, []).append(count)
-        counts_f.setdefault(value, []).append(freq)
-        #print (label, value, count, freq)
-        #print (counts_d)
-
-    plot_histograms_from_dict(counts_d, bins='auto', title='Histograms from Vectors', xlabel='Values', ylabel='Frequency', save_path='counts.png')
-    plot_histograms_from_dict(counts_f, bins='auto', title='Histograms from Vectors', xlabel='Values', ylabel='Frequency', save_path='freqs.png')
+
+    n_alleles = max(int(codes.max()), 0) + 1
+    excluded = set()
+    if args.ancestral:
+        if args.ancestral not in ids:
+            print(f"Error: Ancestral row {args.ancestral} not found", file=sys.stderr)
+            sys.exit(1)
+        anc_row = ids.index(args.ancestral)
+        ancestral = codes[anc_row]
+        excluded.add(anc_row)
+    else:
+        ancestral = np.zeros(len(sites), dtype=np.int64)
+
+    if args.population:
+        populations = {}
+        resolved = hfst.PopulationResolver(hfst.read_population_lists(args.population)).resolve(ids)
+        for name, (rows, missing) in resolved.items():
+            if missing:
+                print(f"Warning: {len(missing)} identifiers from population {name} did not match any rows",
+                      file=sys.stderr)
+            populations[name] = np.array(rows, dtype=np.int64)
+    else:
+        populations = {'ALL': np.arange(len(ids))}
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    sfs_out = open(args.sfs, 'w') if args.sfs else None
+    archive = {}
+    unfolded = {}
+    print("POP\tN\tSITES\tS\tTHETA_W\tTHETA_PI\tTHETA_H\tTHETA_L\tTAJIMA_D\tFAY_WU_H\tFAY_WU_H_NORM", file=out)
+    if sfs_out:
+        print("POP\tN\tSPECTRUM\tCOUNT\tALLELES", file=sfs_out)
+    for name, rows in populations.items():
+        rows = np.array([r for r in rows if r not in excluded], dtype=np.int64)
+        n = len(rows)
+        if n < 2:
+            print(f"Warning: Population {name} has fewer than 2 haplotypes, skipping", file=sys.stderr)
+            continue
+        counts = allele_counts(codes[rows], n_alleles)
+        complete = counts.sum(axis=1) == n
+        if not complete.all():
+            print(f"Warning: {name}: {int((~complete).sum())} sites with missing calls left out", file=sys.stderr)
+        sfs = unfolded_sfs(counts[complete], n, ancestral[complete])
+        folded = folded_sfs(counts[complete], n)
+        # The sites of the unfolded spectrum: complete, with a known ancestral allele
+        polarised = counts[complete][ancestral[complete] >= 0]
+        stats = spectrum_statistics(sfs, n, segregating_sites(polarised))
+        unfolded[name] = sfs
+        archive[f"unfolded_{name}"] = sfs
+        archive[f"folded_{name}"] = folded
+
+        print(name, n, int(complete.sum()), stats['segregating_sites'],
+              *(fmt(stats[key]) for key in ('theta_w', 'theta_pi', 'theta_h', 'theta_l',
+                                            'tajima_d', 'fay_wu_h', 'fay_wu_h_norm')),
+              sep='\t', file=out)
+        if sfs_out:
+            for label, spectrum in (('unfolded', sfs), ('folded', folded)):
+                for count in range(1, len(spectrum)):
+                    print(name, n, label, count, int(spectrum[count]), sep='\t', file=sfs_out)
+
+    if out is not sys.stdout:
+        out.close()
+    if sfs_out:
+        sfs_out.close()
+    if args.npz:
+        np.savez(args.npz, populations=np.array(list(unfolded)), **archive)
+    if args.plot and unfolded:
+        try:
+            plot_spectra(unfolded, args.plot)
+        except ImportError:
+            print("Warning: matplotlib is not installed, skipping --plot", file=sys.stderr)
 
 
 if __name__ == "__main__":